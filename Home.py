@@ -5,11 +5,11 @@ create cocktail recipes to help them get rid of excess inventory.
 """
 import streamlit as st
 from streamlit_extras.switch_page_button import switch_page
-from PIL import Image
+from utils.asset_utils import get_asset_path, load_asset
 
 # Define the page config
 st.set_page_config(
-    page_title="BarKeepAI", page_icon="./resources/cocktail_icon.png",
+    page_title="BarKeepAI", page_icon=get_asset_path("cocktail_icon"),
     initial_sidebar_state="collapsed"
 )
 
@@ -54,7 +54,7 @@ col1, col2 = st.columns(2, gap="large")
 # With the second column we will display a picture of a bar with a "Chat with a Bartender" button underneath
 with col1:
     # Load in the image of the cocktail
-    cocktail_image = Image.open('./resources/cocktail_pic.png')
+    cocktail_image = load_asset("cocktail_hero")
     # Display the image
     st.image(cocktail_image, use_column_width=True)
     # Create a button to start creating cocktails
@@ -65,7 +65,7 @@ with col1:
 
 with col2:
     # Load in the image of the bar
-    bar_image = Image.open('./resources/bartenders.png')
+    bar_image = load_asset("bartenders_hero")
     # Display the image
     st.image(bar_image, use_column_width=True)
     # Create a button to start chatting with a bartender
@@ -0,0 +1 @@
+""" Micro-benchmarks for the app's CPU-side hot paths """
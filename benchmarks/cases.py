@@ -0,0 +1,151 @@
+""" The benchmarks.  Each case is a setup function that builds its fixtures and returns
+the zero-argument callable to time, so setup cost is never measured. """
+import io
+import os
+from typing import Callable, Dict
+from PIL import Image
+from models.recipes import Cocktail
+from utils.asset_utils import RESOURCES_DIR, load_asset
+from utils.chat_context import ChatContextManager
+from utils.partial_json import PartialJsonObject
+from utils.cocktail_utils import convert_recipe_to_text, get_recipe_hash
+from utils.recipe_index import RecipeIndex
+from utils.render_utils import render_recipes
+from utils.save_print_utils import recipe_to_html
+from utils.session_utils import (
+    BATCH_SESSION_DEFAULTS, COCKTAIL_SESSION_DEFAULTS, GENERAL_CHAT_SESSION_DEFAULTS,
+    init_session_variables
+)
+from utils.streaming_utils import render_stream
+from benchmarks.fixtures import (
+    NullPlaceholder, chat_history, large_recipe, recipe_json, recipe_requests, stream_chunks
+)
+
+BENCHMARKS: Dict[str, Callable[[], Callable[[], object]]] = {}
+
+def benchmark(name: str):
+    """ Register a benchmark setup function under name """
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+def _run_coroutine(coroutine):
+    """ Run a coroutine that never suspends without the cost of an event loop """
+    try:
+        coroutine.send(None)
+    except StopIteration as done:
+        return done.value
+    raise RuntimeError("Benchmarked coroutine suspended")
+
+class _OfflineContextManager(ChatContextManager):
+    """ Chat context manager with a canned summary, so only local work is timed """
+    def _summarize(self, previous, messages):
+        return "The user is rebalancing a stirred Frangelico drink and prefers less sugar."
+
+@benchmark("cocktail_validate_json")
+def _cocktail_validate_json():
+    data = recipe_json()
+    return lambda: Cocktail.model_validate_json(data)
+
+@benchmark("cocktail_dump_json")
+def _cocktail_dump_json():
+    recipe = large_recipe()
+    return lambda: recipe.model_dump_json(exclude_none=True)
+
+@benchmark("recipe_hash")
+def _recipe_hash():
+    recipe = large_recipe()
+    return lambda: get_recipe_hash(recipe)
+
+@benchmark("convert_recipe_to_text")
+def _convert_recipe_to_text():
+    recipe = large_recipe()
+    return lambda: _run_coroutine(convert_recipe_to_text(recipe))
+
+@benchmark("recipe_to_html")
+def _recipe_to_html():
+    recipe = large_recipe()
+    return lambda: _run_coroutine(recipe_to_html(recipe))
+
+@benchmark("render_menu_markdown_50")
+def _render_menu_markdown():
+    recipes = [large_recipe()] * 50
+    return lambda: render_recipes(recipes, "markdown")
+
+@benchmark("chat_stream_render_1500_tokens")
+def _chat_stream_render():
+    chunks = stream_chunks(1500)
+    return lambda: render_stream(iter(chunks), NullPlaceholder())
+
+@benchmark("chat_context_build_400_messages")
+def _chat_context_build():
+    manager = _OfflineContextManager()
+    system_message = {"role": "system", "content": "You are a master mixologist."}
+    history = chat_history(200)
+    # Mirrors a rerun mid-conversation, where the summary from the last turn is reused
+    _, summary = manager.build_messages(system_message, history[:-2])
+    return lambda: manager.build_messages(system_message, history, summary)
+
+@benchmark("init_session_variables_first_run")
+def _init_session_variables_first_run():
+    def first_run():
+        state = {}
+        for defaults in (COCKTAIL_SESSION_DEFAULTS, GENERAL_CHAT_SESSION_DEFAULTS, BATCH_SESSION_DEFAULTS):
+            init_session_variables(state, defaults)
+    return first_run
+
+@benchmark("init_session_variables_rerun")
+def _init_session_variables_rerun():
+    state = {}
+    for defaults in (COCKTAIL_SESSION_DEFAULTS, GENERAL_CHAT_SESSION_DEFAULTS, BATCH_SESSION_DEFAULTS):
+        init_session_variables(state, defaults)
+
+    def rerun():
+        for defaults in (COCKTAIL_SESSION_DEFAULTS, GENERAL_CHAT_SESSION_DEFAULTS, BATCH_SESSION_DEFAULTS):
+            init_session_variables(state, defaults)
+    return rerun
+
+@benchmark("recipe_index_search_20k")
+def _recipe_index_search_20k():
+    index = RecipeIndex()
+    for i, (liquor, cocktail_type, cuisine, theme) in enumerate(recipe_requests(20_000)):
+        index.add(f"recipe-{i}", liquor, cocktail_type, cuisine, theme, f"{theme} {cuisine} cocktail")
+    return lambda: index.search("Gin", "Craft", "Any", "tiki summer")
+
+@benchmark("partial_json_stream_recipe")
+def _partial_json_stream_recipe():
+    data = recipe_json()
+    # Pieces about the size of the streamed tokens
+    pieces = [data[start:start + 4] for start in range(0, len(data), 4)]
+
+    def parse():
+        parser = PartialJsonObject()
+        for piece in pieces:
+            parser.feed(piece)
+        return parser.fields
+    return parse
+
+def _decode_file(path: str):
+    def decode():
+        with Image.open(path) as image:
+            image.load()
+    return decode
+
+def _decode_bytes(data: bytes):
+    def decode():
+        with Image.open(io.BytesIO(data)) as image:
+            image.load()
+    return decode
+
+# The full-size originals the pages used to decode, against the optimized variants they use now
+for _source, _asset in (
+    ("cocktail_pic.png", "cocktail_hero"), ("bartenders.png", "bartenders_hero"),
+    ("mixologist1.png", "mixologist_avatar"),
+):
+    benchmark(f"decode_original_{_source.split('.')[0]}")(
+        lambda source=_source: _decode_file(os.path.join(RESOURCES_DIR, source))
+    )
+    benchmark(f"decode_optimized_{_asset}")(
+        lambda asset=_asset: _decode_bytes(load_asset(asset))
+    )
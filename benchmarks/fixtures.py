@@ -0,0 +1,73 @@
+""" Realistic inputs for the benchmarks """
+import random
+from types import SimpleNamespace
+from typing import Dict, List, Tuple
+from models.recipes import Cocktail
+
+_SENTENCE = (
+    "Build the drink in a chilled mixing glass, stir with large cubes until the dilution "
+    "softens the spirit's heat, then taste and adjust before straining. "
+)
+
+def large_recipe() -> Cocktail:
+    """ A recipe at the upper end of what the model returns, with long directions """
+    return Cocktail(
+        name="The Long Goodbye: A Frangelico & Smoked Rosemary Old Fashioned Riff",
+        ingredients=[
+            "2 oz Frangelico", "1 oz Bourbon", "0.5 oz Amaro Nonino", "0.25 oz Demerara Syrup",
+            "2 dashes Angostura Bitters", "1 dash Orange Bitters", "1 bar spoon Islay Scotch",
+            "1 sprig Rosemary, torched", "1 Orange Peel", "3 Coffee Beans",
+            "0.5 oz Cold Brew Concentrate", "1 pinch Flaky Salt",
+        ],
+        directions=[f"Step {step}: {_SENTENCE * 2}" for step in range(1, 11)],
+        glass="Double Old Fashioned over a large clear cube",
+        garnish="Torched rosemary sprig, expressed orange peel and three coffee beans",
+        fun_fact=_SENTENCE * 3,
+        description=_SENTENCE * 5,
+    )
+
+def recipe_json() -> str:
+    """ The large recipe as the JSON the model and the recipe cache hand back """
+    return large_recipe().model_dump_json(exclude_none=True)
+
+def chat_history(turns: int = 200) -> List[Dict[str, str]]:
+    """ A long bartender / mixologist conversation """
+    history = []
+    for turn in range(turns):
+        history.append({"role": "user", "content": f"Question {turn}: how do I rebalance this? {_SENTENCE}"})
+        history.append({"role": "assistant", "content": f"Answer {turn}: {_SENTENCE * 6}"})
+    return history
+
+def stream_chunks(tokens: int = 1500) -> List[SimpleNamespace]:
+    """ Chat completion chunks shaped like the OpenAI SDK's, a few characters each """
+    words = (_SENTENCE * (tokens // 20 + 1)).split(" ")[:tokens]
+    chunks = [
+        SimpleNamespace(choices=[SimpleNamespace(
+            delta=SimpleNamespace(content=word + " "), finish_reason=None
+        )])
+        for word in words
+    ]
+    chunks.append(SimpleNamespace(choices=[SimpleNamespace(
+        delta=SimpleNamespace(content=None), finish_reason="stop"
+    )]))
+    return chunks
+
+def recipe_requests(count: int) -> List[Tuple[str, str, str, str]]:
+    """ Repeatable (liquor, type, cuisine, theme) requests spread over a few spirits """
+    rng = random.Random(0)
+    liquors = ["Gin", "Rum", "Bourbon", "Mezcal", "Tequila"]
+    cuisines = ["Any", "Italian", "Mexican", "Thai", "Caribbean"]
+    themes = ["None", "tiki", "summer", "holiday", "smoky", "garden party", "tiki summer"]
+    return [
+        (rng.choice(liquors), rng.choice(["Classic", "Craft", "Standard"]),
+         rng.choice(cuisines), rng.choice(themes))
+        for _ in range(count)
+    ]
+
+class NullPlaceholder:
+    """ Stands in for st.empty(), counting renders instead of drawing them """
+    def __init__(self):
+        self.renders = 0
+
+    def markdown(self, text: str):
+        self.renders += 1
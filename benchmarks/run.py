@@ -0,0 +1,132 @@
+""" Run the micro-benchmarks, save the results as JSON and compare them against a baseline.
+
+    python -m benchmarks.run --save-baseline          # record benchmarks/baseline.json
+    python -m benchmarks.run --compare                # fail on >10% regressions against it
+    python -m benchmarks.run --filter render --output results.json
+
+Per-call times are the median of several rounds, each long enough to swamp timer
+resolution.  Compare results from the same machine only.
+"""
+import os
+import re
+import sys
+import json
+import time
+import logging
+import platform
+import argparse
+import statistics
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+# App modules log at DEBUG, which would be timed along with the code under test
+logging.disable(logging.INFO)
+
+from benchmarks.cases import BENCHMARKS  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+def measure(function: Callable[[], object], rounds: int = 7, min_round_time: float = 0.05) -> Dict:
+    """ Time function, calling it enough times per round to fill min_round_time """
+    function()  # Warm caches and imports before timing
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_round_time or number >= 1_000_000:
+            break
+        number *= 10 if elapsed < min_round_time / 10 else 2
+
+    timings = [elapsed / number]
+    for _ in range(rounds - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        timings.append((time.perf_counter() - start) / number)
+    return {
+        "median": statistics.median(timings),
+        "min": min(timings),
+        "mean": statistics.fmean(timings),
+        "stdev": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        "rounds": rounds,
+        "calls_per_round": number,
+    }
+
+def run_benchmarks(pattern: Optional[str] = None, rounds: int = 7) -> Dict:
+    """ Run every benchmark whose name matches pattern """
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if pattern and not re.search(pattern, name):
+            continue
+        results[name] = measure(setup(), rounds=rounds)
+        print(f"{name:<40}{_format_time(results[name]['median']):>12}", file=sys.stderr)
+    return {
+        "meta": {
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+
+def compare(current: Dict, baseline: Dict, threshold: float = 0.10) -> List[str]:
+    """ Print current medians against the baseline and return the names that regressed
+    by more than threshold """
+    regressions = []
+    print(f"{'benchmark':<40}{'baseline':>12}{'current':>12}{'change':>9}")
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            print(f"{name:<40}{'-':>12}{_format_time(result['median']):>12}{'new':>9}")
+            continue
+        change = result["median"] / base["median"] - 1.0
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<40}{_format_time(base['median']):>12}"
+              f"{_format_time(result['median']):>12}{change:>+9.1%}{flag}")
+    return regressions
+
+def _format_time(seconds: float) -> str:
+    for unit, scale in (("s", 1.0), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f} {unit}"
+    return f"{seconds / 1e-9:.0f} ns"
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run the micro-benchmarks.")
+    parser.add_argument("--filter", default=None, help="Only run benchmarks matching this regex")
+    parser.add_argument("--rounds", type=int, default=7, help="Timed rounds per benchmark")
+    parser.add_argument("--output", default=None, help="Write the results to this JSON file")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="Save the results as the baseline")
+    parser.add_argument("--compare", action="store_true",
+                        help="Compare against the baseline and exit 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Slowdown, as a fraction of the baseline, that counts as a regression")
+    parser.add_argument("--list", action="store_true", help="List the benchmarks and exit")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        print("\n".join(BENCHMARKS))
+        return 0
+    current = run_benchmarks(args.filter, rounds=args.rounds)
+    for path in filter(None, [args.output, args.baseline if args.save_baseline else None]):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=2)
+        print(f"Saved results to {path}", file=sys.stderr)
+    if args.compare:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(current, json.load(f), args.threshold)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) regressed: {', '.join(regressions)}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
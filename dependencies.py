@@ -1,11 +1,36 @@
 """ Module to handle dependencies. """
 import os
-from openai import OpenAI
+import sys
+import json
+import asyncio
+import importlib.util
+import threading
+from typing import Optional
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+# The httpx release the installed openai package is built on.  Transports, settings and
+# the errors to catch must come from it to work with the clients it creates.
+sdk_httpx = sys.modules[DefaultAsyncHttpxClient.__mro__[1].__module__.partition(".")[0]]
+
+# Default per-call timeouts in seconds for each kind of model call
+OPENAI_TIMEOUTS = {
+    "recipe": 60.0,
+    "image": 90.0,
+    "training": 45.0,
+    "chat": 30.0,
+    "summary": 20.0,
+}
+
+_client_lock = threading.Lock()
+_loop_lock = threading.Lock()
+_openai_client: Optional[OpenAI] = None
+_async_openai_client: Optional[AsyncOpenAI] = None
+_background_loop: Optional[asyncio.AbstractEventLoop] = None
+
 def get_openai_api_key():
     """ Function to get the OpenAI API key. """
     return os.getenv("OPENAI_API_KEY")
@@ -14,9 +39,175 @@ def get_openai_org():
     """ Function to get the OpenAI organization. """
     return os.getenv("OPENAI_ORG")
 
-def get_openai_client():
-    """ Get the OpenAI client. """
-    return OpenAI(
-        api_key=get_openai_api_key(), organization=get_openai_org(),
-        max_retries=3, timeout=30
+def get_cache_dir():
+    """ Function to get the local cache directory, creating it if needed. """
+    cache_dir = os.getenv("BARGURU_CACHE_DIR", ".cache")
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+def _on_response(response: sdk_httpx.Response):
+    """ Count every HTTP response against the model call in progress, so SDK retries
+    show up in the metrics, and pause the shared request scheduler for a model when
+    the API answers 429, so other sessions stop sending requests that would be
+    rejected too """
+    # Imported here since the metrics' and scheduler's own imports depend on this module
+    from utils.metrics import note_http_response
+    note_http_response()
+    if response.status_code != 429:
+        return
+    from utils.rate_limiter import get_request_scheduler
+    try:
+        model = json.loads(response.request.content).get("model")
+    except (ValueError, AttributeError, sdk_httpx.RequestNotRead):
+        model = None
+    if not model:
+        return
+    if "retry-after-ms" in response.headers:
+        seconds = float(response.headers["retry-after-ms"]) / 1000
+    else:
+        try:
+            seconds = float(response.headers.get("retry-after", 2))
+        except ValueError:
+            seconds = 2.0
+    get_request_scheduler().backoff(model, min(seconds, 60.0))
+
+async def _async_on_response(response: sdk_httpx.Response):
+    """ Async event hook wrapper for _on_response """
+    _on_response(response)
+
+def _transport_options():
+    """ Connection pool, keep-alive and HTTP/2 settings for the OpenAI transport.  HTTP/2
+    is used when the optional h2 package is installed. """
+    http2_setting = os.getenv("OPENAI_HTTP2", "auto").lower()
+    http2_available = importlib.util.find_spec("h2") is not None
+    return {
+        "limits": sdk_httpx.Limits(
+            max_connections=int(os.getenv("OPENAI_POOL_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(os.getenv("OPENAI_POOL_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60")),
+        ),
+        "http2": http2_available and http2_setting in ("auto", "1", "true", "yes"),
+    }
+
+def _http_options():
+    """ Transport and timeout settings for the OpenAI clients """
+    return {
+        **_transport_options(),
+        "timeout": sdk_httpx.Timeout(
+            float(os.getenv("OPENAI_TIMEOUT", "30")),
+            connect=float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5")),
+        ),
+    }
+
+def get_background_loop() -> asyncio.AbstractEventLoop:
+    """ Get the process-wide event loop running on its own thread.  The async OpenAI
+    connections live on it, and background work such as guide prefetching runs on it. """
+    global _background_loop
+    if _background_loop is None:
+        with _loop_lock:
+            if _background_loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="background-loop", daemon=True).start()
+                _background_loop = loop
+    return _background_loop
+
+async def _on_loop(coroutine, loop: asyncio.AbstractEventLoop):
+    """ Await a coroutine on another event loop, cancelling it there if the caller is cancelled """
+    if asyncio.get_running_loop() is loop:
+        return await coroutine
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, loop))
+
+async def _next_chunk(iterator):
+    """ The next chunk of a response body, or None once it ends """
+    try:
+        return await iterator.__anext__()
+    except StopAsyncIteration:
+        return None
+
+class _LoopBridgeStream(sdk_httpx.AsyncByteStream):
+    """ A response body read on the loop its connection belongs to """
+    def __init__(self, stream: sdk_httpx.AsyncByteStream, loop: asyncio.AbstractEventLoop):
+        self._stream = stream
+        self._loop = loop
+
+    async def __aiter__(self):
+        iterator = self._stream.__aiter__()
+        while (chunk := await _on_loop(_next_chunk(iterator), self._loop)) is not None:
+            yield chunk
+
+    async def aclose(self):
+        await _on_loop(self._stream.aclose(), self._loop)
+
+class _LoopBridgeTransport(sdk_httpx.AsyncBaseTransport):
+    """ Sends every request through one connection pool on the background loop, whichever
+    loop it was made from.  httpx async connections cannot move between loops, and
+    Streamlit scripts run each rerun on a new one, so without this every rerun would open
+    its own connections. """
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._transport = sdk_httpx.AsyncHTTPTransport(**_transport_options())
+
+    async def handle_async_request(self, request: sdk_httpx.Request) -> sdk_httpx.Response:
+        response = await _on_loop(self._transport.handle_async_request(request), self._loop)
+        return sdk_httpx.Response(
+            response.status_code, headers=response.headers,
+            stream=_LoopBridgeStream(response.stream, self._loop), extensions=response.extensions
+        )
+
+    async def aclose(self):
+        await _on_loop(self._transport.aclose(), self._loop)
+
+def _with_timeout(client, timeout: Optional[float]):
+    """ Apply a per-call timeout to a shared client without copying its transport """
+    if timeout is None:
+        return client
+    return client.with_options(
+        timeout=sdk_httpx.Timeout(timeout, connect=float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5")))
     )
+
+def get_openai_client(timeout: Optional[float] = None):
+    """ Get the process-wide OpenAI client.  Every session and thread shares its
+    connection pool, so keep-alive connections are reused instead of re-handshaking. """
+    global _openai_client
+    if _openai_client is None:
+        with _client_lock:
+            if _openai_client is None:
+                _openai_client = OpenAI(
+                    api_key=get_openai_api_key(), organization=get_openai_org(),
+                    max_retries=2, http_client=DefaultHttpxClient(
+                        **_http_options(), event_hooks={"response": [_on_response]}
+                    )
+                )
+    return _with_timeout(_openai_client, timeout)
+
+def get_async_openai_client(timeout: Optional[float] = None):
+    """ Get the process-wide async OpenAI client.  It can be used from any event loop: its
+    requests all go through one connection pool on the background loop, so keep-alive
+    connections are reused across reruns, sessions and batches. """
+    global _async_openai_client
+    if _async_openai_client is None:
+        with _client_lock:
+            if _async_openai_client is None:
+                _async_openai_client = AsyncOpenAI(
+                    api_key=get_openai_api_key(), organization=get_openai_org(),
+                    max_retries=2, http_client=DefaultAsyncHttpxClient(
+                        transport=_LoopBridgeTransport(get_background_loop()),
+                        timeout=_http_options()["timeout"],
+                        event_hooks={"response": [_async_on_response]}
+                    )
+                )
+    return _with_timeout(_async_openai_client, timeout)
+
+async def close_async_openai_client():
+    """ Close the async client and its connections, e.g. before a script exits """
+    global _async_openai_client
+    with _client_lock:
+        client, _async_openai_client = _async_openai_client, None
+    if client is not None:
+        await client.close()
+
+def run_async(coroutine):
+    """ Run a coroutine from a Streamlit script.  The coroutine runs on the script's own
+    thread, so it can update the page, while its OpenAI calls share the pooled
+    connections on the background loop. """
+    return asyncio.run(coroutine)
@@ -0,0 +1,318 @@
+""" A local stand-in for the OpenAI API, so the app can be load tested without
+spending credits.
+
+Run "python -m loadtest.fake_openai --port 8800" and point the app or the load
+harness at it with OPENAI_BASE_URL=http://127.0.0.1:8800/v1.  It serves chat
+completions (plain, streamed and structured Cocktail output) and image
+generations with placeholder PNGs, with configurable latency, streaming cadence
+and injected 429 and 500 errors.
+"""
+import sys
+import json
+import math
+import time
+import uuid
+import zlib
+import struct
+import random
+import logging
+import argparse
+import threading
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_NAMES = ["Velvet", "Smoked", "Golden", "Midnight", "Garden", "Harbor", "Copper", "Ember"]
+_NOUNS = ["Sour", "Fizz", "Old Fashioned", "Collins", "Negroni", "Julep", "Spritz", "Flip"]
+_INGREDIENTS = [
+    "2 oz Bourbon", "1.5 oz Gin", "1 oz Aperol", "0.75 oz Fresh Lemon Juice",
+    "0.5 oz Simple Syrup", "2 dashes Angostura Bitters", "1 oz Sweet Vermouth",
+    "0.75 oz Lime Juice", "3 oz Soda Water", "0.5 oz Honey Syrup",
+]
+_GLASSES = ["Coupe", "Rocks", "Highball", "Nick and Nora", "Collins"]
+_GARNISHES = ["Orange peel", "Lemon twist", "Mint sprig", "Brandied cherry", "Grapefruit peel"]
+_GUIDE = """## Flavor Profile
+Bright, balanced and approachable, with the base spirit leading and citrus lifting the finish.
+
+## Ingredients
+- The base spirit carries the drink, so measure it precisely.
+- Fresh citrus only, juiced before service.
+
+## Technique
+1. Build in a chilled shaker tin.
+2. Shake hard for ten seconds and double strain.
+
+## Upselling
+Suggest it to guests who enjoy classic sours, and mention the house-made syrup."""
+_CHAT_REPLY = (
+    "Great question!  I would keep the spec as is but try a split base, swapping half an "
+    "ounce of the main spirit for something with a little more character.  Taste as you go, "
+    "adjust the sweetener in quarter ounce steps, and let me know how it lands with guests."
+)
+
+@dataclass
+class FakeServerConfig:
+    """ Latency and failure behaviour of the fake server.  Latencies are the medians of
+    lognormal distributions, in seconds, with the shared latency_sigma spread. """
+    recipe_latency: float = 2.0
+    chat_latency: float = 0.4
+    image_latency: float = 6.0
+    latency_sigma: float = 0.4
+    chunk_interval: float = 0.03
+    chunk_chars: int = 16
+    rate_limit_rate: float = 0.0
+    error_rate: float = 0.0
+    retry_after: float = 1.0
+
+    def sample_latency(self, median: float) -> float:
+        """ Draw a latency from a lognormal distribution around the median """
+        if median <= 0:
+            return 0.0
+        return median * math.exp(random.gauss(0.0, self.latency_sigma))
+
+def _placeholder_png(size: int = 512) -> bytes:
+    """ A solid colour PNG, built with the standard library only """
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return (struct.pack(">I", len(data)) + kind + data
+                + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF))
+    row = b"\x00" + bytes((180, 60, 80)) * size
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(row * size, 9))
+            + chunk(b"IEND", b""))
+
+def _estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+def fake_cocktail() -> Dict:
+    """ A random recipe matching the Cocktail schema """
+    name = f"{random.choice(_NAMES)} {random.choice(_NOUNS)}"
+    return {
+        "name": name,
+        "ingredients": random.sample(_INGREDIENTS, 4),
+        "directions": ["Add everything to a shaker with ice.", "Shake until chilled.",
+                       "Strain into the chilled glass and garnish."],
+        "glass": random.choice(_GLASSES),
+        "garnish": random.choice(_GARNISHES),
+        "fun_fact": f"The {name} was first poured at a load test.",
+        "description": f"A bright, balanced take on the {name.split()[-1].lower()}.",
+    }
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """ Handles one request against the fake API """
+    protocol_version = "HTTP/1.1"
+    server: "FakeOpenAIServer"
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def _send_json(self, status: int, payload: Dict, headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status: int, kind: str, message: str, headers=None):
+        self._send_json(status, {"error": {"message": message, "type": kind, "code": kind}}, headers)
+
+    def _inject_failure(self) -> bool:
+        """ Answer with an injected 429 or 500 instead of a result, some of the time """
+        config = self.server.config
+        roll = random.random()
+        if roll < config.rate_limit_rate:
+            self.server.record("rate_limited")
+            self._send_error(
+                429, "rate_limit_exceeded", "Rate limit reached (injected)",
+                {"retry-after": f"{config.retry_after:g}"}
+            )
+            return True
+        if roll < config.rate_limit_rate + config.error_rate:
+            self.server.record("errors")
+            self._send_error(500, "server_error", "The server had an error (injected)")
+            return True
+        return False
+
+    def do_GET(self):
+        if self.path.startswith("/images/"):
+            body = self.server.image
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_error(404, "not_found", f"No route for {self.path}")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_error(400, "invalid_request_error", "Request body is not JSON")
+            return
+        if self._inject_failure():
+            return
+        if self.path.endswith("/chat/completions"):
+            self._chat_completion(request)
+        elif self.path.endswith("/images/generations"):
+            self._image_generation(request)
+        else:
+            self._send_error(404, "not_found", f"No route for {self.path}")
+
+    def _chat_completion(self, request: Dict):
+        config = self.server.config
+        messages: List[Dict] = request.get("messages", [])
+        prompt_tokens = sum(_estimate_tokens(str(m.get("content") or "")) for m in messages)
+        response_format = request.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            content, median = json.dumps(fake_cocktail()), config.recipe_latency
+        elif "training guide" in str(messages[:1]).lower():
+            content, median = _GUIDE, config.chat_latency
+        else:
+            content, median = _CHAT_REPLY, config.chat_latency
+        content = content[: request.get("max_tokens", 4096) * 4]
+        completion_tokens = _estimate_tokens(content)
+        usage = {
+            "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        time.sleep(config.sample_latency(median))
+        base = {"id": f"chatcmpl-{uuid.uuid4().hex[:24]}", "created": int(time.time()),
+                "model": request.get("model", "gpt-4o-mini")}
+        self.server.record("chat_completions")
+
+        if not request.get("stream"):
+            self._send_json(200, {
+                **base, "object": "chat.completion", "usage": usage,
+                "choices": [{
+                    "index": 0, "finish_reason": "stop", "logprobs": None,
+                    "message": {"role": "assistant", "content": content, "refusal": None},
+                }],
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        chunk_base = {**base, "object": "chat.completion.chunk"}
+
+        def send_event(data: str):
+            event = f"data: {data}\n\n".encode()
+            self.wfile.write(f"{len(event):x}\r\n".encode() + event + b"\r\n")
+            self.wfile.flush()
+
+        def send_delta(delta: Dict, finish_reason: Optional[str] = None):
+            send_event(json.dumps({**chunk_base, "choices": [
+                {"index": 0, "delta": delta, "finish_reason": finish_reason, "logprobs": None}
+            ]}))
+
+        send_delta({"role": "assistant", "content": ""})
+        for start in range(0, len(content), config.chunk_chars):
+            send_delta({"content": content[start:start + config.chunk_chars]})
+            time.sleep(config.sample_latency(config.chunk_interval))
+        send_delta({}, "stop")
+        if (request.get("stream_options") or {}).get("include_usage"):
+            send_event(json.dumps({**chunk_base, "choices": [], "usage": usage}))
+        send_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _image_generation(self, request: Dict):
+        time.sleep(self.server.config.sample_latency(self.server.config.image_latency))
+        self.server.record("images")
+        host, port = self.server.server_address[:2]
+        self._send_json(200, {
+            "created": int(time.time()),
+            "data": [{
+                "url": f"http://{host}:{port}/images/{uuid.uuid4().hex}.png",
+                "revised_prompt": request.get("prompt", ""),
+            }],
+        })
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    """ Threaded fake API server that counts what it served """
+    daemon_threads = True
+
+    def __init__(self, address, config: FakeServerConfig):
+        super().__init__(address, FakeOpenAIHandler)
+        self.config = config
+        self.image = _placeholder_png()
+        self.counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def handle_error(self, request, client_address):
+        """ Clients dropping keep-alive connections are expected, not errors """
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+    def record(self, kind: str):
+        """ Count a response of the given kind """
+        with self._lock:
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+def start_fake_server(
+    config: Optional[FakeServerConfig] = None, host: str = "127.0.0.1", port: int = 0
+) -> FakeOpenAIServer:
+    """ Start a fake server on a background thread.  Port 0 picks a free port. """
+    server = FakeOpenAIServer((host, port), config or FakeServerConfig())
+    threading.Thread(target=server.serve_forever, name="fake-openai", daemon=True).start()
+    return server
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    """ Command line options for FakeServerConfig, shared with the load harness """
+    defaults = FakeServerConfig()
+    parser.add_argument("--recipe-latency", type=float, default=defaults.recipe_latency,
+                        help="Median seconds for a structured recipe response")
+    parser.add_argument("--chat-latency", type=float, default=defaults.chat_latency,
+                        help="Median seconds to the first chat or training guide token")
+    parser.add_argument("--image-latency", type=float, default=defaults.image_latency,
+                        help="Median seconds for an image generation")
+    parser.add_argument("--latency-sigma", type=float, default=defaults.latency_sigma,
+                        help="Spread of the lognormal latency distributions")
+    parser.add_argument("--chunk-interval", type=float, default=defaults.chunk_interval,
+                        help="Median seconds between streamed chunks")
+    parser.add_argument("--chunk-chars", type=int, default=defaults.chunk_chars,
+                        help="Characters per streamed chunk")
+    parser.add_argument("--rate-limit-rate", type=float, default=defaults.rate_limit_rate,
+                        help="Fraction of requests answered with a 429")
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate,
+                        help="Fraction of requests answered with a 500")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed")
+
+def config_from_arguments(args: argparse.Namespace) -> FakeServerConfig:
+    """ Build the server config from parsed command line options """
+    if args.seed is not None:
+        random.seed(args.seed)
+    return FakeServerConfig(
+        recipe_latency=args.recipe_latency, chat_latency=args.chat_latency,
+        image_latency=args.image_latency, latency_sigma=args.latency_sigma,
+        chunk_interval=args.chunk_interval, chunk_chars=args.chunk_chars,
+        rate_limit_rate=args.rate_limit_rate, error_rate=args.error_rate,
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a fake OpenAI-compatible API server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    fake_server = FakeOpenAIServer((args.host, args.port), config_from_arguments(args))
+    logger.info("Fake OpenAI API listening, set OPENAI_BASE_URL=%s", fake_server.base_url)
+    try:
+        fake_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
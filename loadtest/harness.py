@@ -0,0 +1,231 @@
+""" Drive many simulated bartender sessions through the app's create -> image ->
+training -> chat flow and report throughput and latency percentiles.
+
+By default a fake OpenAI server is started in-process:
+
+    python -m loadtest.harness --sessions 20 --flows 3
+
+Pass --base-url to target a fake server running elsewhere, such as one started
+with "python -m loadtest.fake_openai" on another machine.  The real API is never
+used unless its URL is passed explicitly.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+import numpy as np
+from loadtest.fake_openai import add_config_arguments, config_from_arguments, start_fake_server
+
+logger = logging.getLogger(__name__)
+
+STAGES = ["recipe", "image", "training_first_token", "training", "chat_first_token", "chat"]
+_LIQUORS = ["Bourbon", "Gin", "Mezcal", "Aperol", "Rum", "Frangelico", "Chartreuse"]
+_TYPES = ["Classic", "Craft", "Standard"]
+_CUISINES = ["Any", "Italian", "Mexican", "Japanese", "Thai"]
+
+@dataclass
+class LoadTestResults:
+    """ Latencies per stage and failures per stage across every session """
+    latencies: Dict[str, List[float]] = field(default_factory=lambda: defaultdict(list))
+    errors: Dict[str, int] = field(default_factory=lambda: defaultdict(int))
+    flows_completed: int = 0
+    wall_time: float = 0.0
+
+    def record(self, stage: str, seconds: float):
+        """ Add a latency sample for a stage """
+        self.latencies[stage].append(seconds)
+
+    def summary(self) -> Dict:
+        """ Throughput and p50 / p95 / p99 latency per stage """
+        stages = {}
+        for stage in STAGES:
+            samples = np.asarray(self.latencies.get(stage, []), dtype=float)
+            stats = {"count": int(samples.size), "errors": self.errors.get(stage, 0)}
+            if samples.size:
+                p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+                stats.update(p50=round(p50, 3), p95=round(p95, 3), p99=round(p99, 3),
+                             max=round(float(samples.max()), 3))
+            stages[stage] = stats
+        return {
+            "flows_completed": self.flows_completed,
+            "wall_time": round(self.wall_time, 2),
+            "flows_per_minute": round(60 * self.flows_completed / self.wall_time, 2)
+            if self.wall_time else 0.0,
+            "stages": stages,
+        }
+
+def _chat_turn(cocktail, question: str):
+    """ One streamed chat turn, made the way the chat pages make it.  Returns the time
+    to first token and the total time. """
+    from dependencies import OPENAI_TIMEOUTS, get_openai_client
+    from utils.metrics import track_call
+    from utils.rate_limiter import Priority, estimate_request_tokens, get_request_scheduler
+    from utils.streaming_utils import iter_stream_text
+
+    messages = [
+        {"role": "system", "content": f"You are a master mixologist who created {cocktail}."},
+        {"role": "user", "content": question},
+    ]
+    start = time.perf_counter()
+    ticket = get_request_scheduler().acquire_sync(
+        "gpt-4o-mini", estimate_request_tokens(messages, 750), Priority.CHAT
+    )
+    with track_call("chat", "gpt-4o-mini", ticket.tokens - 750, ticket.waited) as call:
+        response = call.stream(get_openai_client(timeout=OPENAI_TIMEOUTS["chat"]).chat.completions.create(
+            model="gpt-4o-mini", messages=messages, stream=True, temperature=0.6, max_tokens=750,
+        ))
+    first_token = None
+    for _ in iter_stream_text(response):
+        if first_token is None:
+            first_token = time.perf_counter() - start
+    return first_token or 0.0, time.perf_counter() - start
+
+async def _timed(results: LoadTestResults, stage: str, coroutine):
+    """ Await a stage, recording its latency, or its failure and None """
+    start = time.perf_counter()
+    try:
+        value = await coroutine
+    except Exception as e:
+        logger.debug("%s failed: %s", stage, e)
+        results.errors[stage] += 1
+        return None
+    results.record(stage, time.perf_counter() - start)
+    return value
+
+async def run_session(
+    session: int, results: LoadTestResults, flows: int, chat_turns: int, think_time: float
+):
+    """ One simulated bartender creating cocktails and following up on them """
+    from utils.cocktail_utils import create_cocktail
+    from utils.image_utils import generate_image
+    from utils.pipeline_utils import build_image_prompt
+    from utils.training_utils import stream_training_guide
+
+    for _ in range(flows):
+        start = time.perf_counter()
+        cocktail = await create_cocktail(
+            liqour=random.choice(_LIQUORS), type=random.choice(_TYPES),
+            cuisine=random.choice(_CUISINES), theme="None", fresh=True
+        )
+        if cocktail is None:
+            results.errors["recipe"] += 1
+            continue
+        results.record("recipe", time.perf_counter() - start)
+
+        # The page starts the image and the training guide prefetch together
+        async def training():
+            guide_start = time.perf_counter()
+            first_token = None
+            async for _ in stream_training_guide(cocktail):
+                if first_token is None:
+                    first_token = time.perf_counter() - guide_start
+                    results.record("training_first_token", first_token)
+        await asyncio.gather(
+            _timed(results, "image", generate_image(build_image_prompt(cocktail))),
+            _timed(results, "training", training()),
+        )
+
+        for turn in range(chat_turns):
+            await asyncio.sleep(think_time)
+            timings = await _timed(results, "chat", asyncio.to_thread(
+                _chat_turn, cocktail, f"Question {turn + 1}: how would you batch the {cocktail.name}?"
+            ))
+            if timings is not None:
+                results.record("chat_first_token", timings[0])
+        results.flows_completed += 1
+        logger.info("Session %d finished a flow in %.2fs", session, time.perf_counter() - start)
+        await asyncio.sleep(think_time)
+
+async def run_load_test(
+    sessions: int, flows: int, chat_turns: int = 2, think_time: float = 0.0, ramp_up: float = 0.0
+) -> LoadTestResults:
+    """ Run every session concurrently on one event loop, staggering their starts
+    over ramp_up seconds """
+    from dependencies import close_async_openai_client
+
+    results = LoadTestResults()
+
+    async def staggered(session: int):
+        await asyncio.sleep(ramp_up * session / max(1, sessions))
+        await run_session(session, results, flows, chat_turns, think_time)
+
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(staggered(session) for session in range(sessions)))
+    finally:
+        await close_async_openai_client()
+    results.wall_time = time.perf_counter() - start
+    return results
+
+def format_summary(summary: Dict) -> str:
+    """ Render the summary as a plain text table """
+    lines = [
+        f"Flows completed: {summary['flows_completed']} in {summary['wall_time']}s "
+        f"({summary['flows_per_minute']} per minute)",
+        f"{'stage':<22}{'count':>7}{'errors':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}",
+    ]
+    for stage, stats in summary["stages"].items():
+        lines.append(
+            f"{stage:<22}{stats['count']:>7}{stats['errors']:>8}"
+            + "".join(f"{stats.get(key, float('nan')):>9.3f}" for key in ("p50", "p95", "p99", "max"))
+        )
+    if "server_counts" in summary:
+        lines.append(f"Fake server responses: {summary['server_counts']}")
+    return "\n".join(lines)
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Load test the app against a fake OpenAI API.")
+    parser.add_argument("--sessions", type=int, default=10, help="Concurrent simulated sessions")
+    parser.add_argument("--flows", type=int, default=2, help="Cocktails each session creates")
+    parser.add_argument("--chat-turns", type=int, default=2, help="Chat questions per cocktail")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Seconds between steps")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="Seconds to stagger starts over")
+    parser.add_argument("--base-url", default=None,
+                        help="Fake server to target, instead of starting one in-process")
+    parser.add_argument("--app-rate-limits", action="store_true",
+                        help="Keep the app's default rate limits instead of lifting them")
+    parser.add_argument("--json", dest="json_path", default=None, help="Also write results here")
+    add_config_arguments(parser)
+    args = parser.parse_args(argv)
+    # Only the harness's own progress, the app's debug logging would swamp the results
+    logging.basicConfig(level=logging.WARNING)
+    logger.setLevel(logging.INFO)
+
+    server = None
+    if args.base_url is None:
+        server = start_fake_server(config_from_arguments(args))
+        args.base_url = server.base_url
+    # Clients and the scheduler read these lazily, so they apply from the first request
+    os.environ["OPENAI_BASE_URL"] = args.base_url
+    os.environ.setdefault("OPENAI_API_KEY", "fake-key")
+    os.environ.setdefault("BARGURU_CACHE_DIR", tempfile.mkdtemp(prefix="barguru-loadtest-"))
+    if not args.app_rate_limits:
+        unlimited = {"rpm": 1_000_000, "tpm": 1_000_000_000}
+        os.environ["BARGURU_RATE_LIMITS"] = json.dumps({
+            model: unlimited for model in ("gpt-4o-2024-08-06", "gpt-4o", "gpt-4o-mini", "dall-e-3")
+        })
+        os.environ.setdefault("BARGURU_MAX_QUEUED_REQUESTS", str(max(64, args.sessions * 4)))
+
+    results = asyncio.run(run_load_test(
+        args.sessions, args.flows, args.chat_turns, args.think_time, args.ramp_up
+    ))
+    summary = results.summary()
+    if server is not None:
+        summary["server_counts"] = dict(server.counts)
+        server.shutdown()
+    print(format_summary(summary))
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    return summary
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,112 @@
+""" Admin page showing latency, token and cost metrics for the model calls made by this server """
+# Import libraries
+import pandas as pd
+import streamlit as st
+from streamlit_extras.switch_page_button import switch_page
+from utils.asset_utils import get_asset_path
+from utils.circuit_breaker import get_circuit_breakers
+from utils.metrics import get_metrics
+from utils.rate_limiter import get_request_scheduler
+from utils.session_store import get_session_store
+
+# Define the page config
+st.set_page_config(
+    page_title="BarGuru Metrics", page_icon=get_asset_path("cocktail_icon"), initial_sidebar_state="auto"
+)
+
+def _milliseconds(seconds):
+    """ Seconds to whole milliseconds for display """
+    return None if seconds is None else round(seconds * 1000)
+
+def _megabytes(size):
+    """ Bytes to megabytes for display """
+    return "n/a" if size is None else f"{size / 1024 / 1024:.1f} MB"
+
+def session_memory():
+    """ Show the chat history held by each session against the process memory budget """
+    st.markdown("### Session memory")
+    report = get_session_store().report()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Sessions", len(report["sessions"]))
+    col2.metric("Chat history in memory", _megabytes(report["in_memory_bytes"]),
+                help=f"Budget {_megabytes(report['budget_bytes'])}")
+    col3.metric("Spilled to disk", report["spills"])
+    col4.metric("Process RSS", _megabytes(report["rss_bytes"]))
+    if report["sessions"]:
+        table = pd.DataFrame(report["sessions"])
+        table["in_memory_bytes"] = table["in_memory_bytes"].map(lambda size: round(size / 1024, 1))
+        table["idle_seconds"] = table["idle_seconds"].round()
+        st.dataframe(table.rename(columns={
+            "in_memory_bytes": "in memory (KB)", "spilled_histories": "spilled histories",
+            "idle_seconds": "idle (s)",
+        }), hide_index=True, use_container_width=True)
+    st.caption(
+        f"{report['shared_recipes']} recipes and {report['shared_texts']} training guides are shared "
+        "between the sessions showing them."
+    )
+
+def admin_metrics():
+    """ Show p50 / p99 latency, tokens and cost by call type since the server started """
+    metrics = get_metrics()
+    st.markdown("### Model calls")
+    rows = metrics.snapshot()
+    if not rows:
+        st.info("No model calls have been made since the server started.")
+    else:
+        table = pd.DataFrame(rows)
+        for column in ("p50", "p90", "p99", "mean", "first_token_p50", "first_token_p99", "queued_p99"):
+            table[column] = table[column].map(_milliseconds)
+        table = table.rename(columns={
+            "p50": "p50 (ms)", "p90": "p90 (ms)", "p99": "p99 (ms)", "mean": "mean (ms)",
+            "first_token_p50": "first token p50 (ms)", "first_token_p99": "first token p99 (ms)",
+            "queued_p99": "queued p99 (ms)", "cost": "est. cost ($)",
+        })
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Calls", int(table["calls"].sum()))
+        col2.metric("Errors", int(table["errors"].sum()))
+        col3.metric("Estimated spend", f"${table['est. cost ($)'].sum():.2f}")
+        st.dataframe(table, hide_index=True, use_container_width=True)
+
+    routes = metrics.routes_snapshot()
+    if routes:
+        st.markdown("### Model routing")
+        st.caption("Which model answered each call: the primary, a hedge started because the primary "
+                   "was slow, or a fallback after a failure.")
+        table = pd.DataFrame(routes)
+        table["mean"] = table["mean"].map(_milliseconds)
+        st.dataframe(table.rename(columns={"mean": "mean (ms)"}), hide_index=True, use_container_width=True)
+
+    breakers = get_circuit_breakers().snapshot()
+    if breakers:
+        st.markdown("### Circuit breakers")
+        st.caption("An open breaker refuses calls at once, and the pages serve stored recipes, a placeholder "
+                   "image or a pending training guide, until a probe call succeeds.")
+        st.dataframe(pd.DataFrame(breakers).rename(columns={"retry_in": "retry in (s)"}),
+                     hide_index=True, use_container_width=True)
+
+    st.markdown("### Request queues")
+    queues = get_request_scheduler().snapshot()
+    if queues:
+        st.dataframe(
+            pd.DataFrame.from_dict(queues, orient="index").rename_axis("model").reset_index(),
+            hide_index=True, use_container_width=True
+        )
+    else:
+        st.info("No requests have been scheduled yet.")
+
+    session_memory()
+
+    st.download_button(
+        "Export metrics (JSON)", data=metrics.to_json(), file_name="barguru_metrics.json",
+        mime="application/json", use_container_width=True
+    )
+    if st.sidebar.button("Refresh", use_container_width=True, type="primary"):
+        st.rerun()
+    if st.sidebar.button("Reset metrics", use_container_width=True, type="secondary"):
+        metrics.reset()
+        st.rerun()
+    if st.sidebar.button("Home", use_container_width=True, type="secondary"):
+        switch_page("Home")
+        st.rerun()
+
+admin_metrics()
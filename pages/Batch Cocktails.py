@@ -0,0 +1,172 @@
+""" Bulk "clear the back bar" page to create recipes for many bottles at once """
+# Import libraries
+import logging
+import streamlit as st
+from streamlit_extras.switch_page_button import switch_page
+from dependencies import run_async
+from utils.asset_utils import get_asset_path
+from utils.inventory_utils import INVALID_ROWS_ATTR, load_inventory, rank_dead_stock
+from utils.pour_cost_utils import cost_recipes, bottles_depleted
+from utils.save_print_utils import render_menu_pdf
+from utils.render_utils import render_recipe
+from utils.session_utils import BATCH_SESSION_DEFAULTS, init_session_variables
+from utils.batch_utils import (
+    build_batch_items, generate_batch, batch_results_to_json, batch_results_to_csv
+)
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Define the page config
+st.set_page_config(
+    page_title="BarGuruV1", page_icon=get_asset_path("cocktail_icon"), initial_sidebar_state="auto"
+)
+
+# Initialize the session state
+def init_batch_session_variables():
+    # Initialize session state variables
+    init_session_variables(st.session_state, BATCH_SESSION_DEFAULTS)
+
+# Initialize the session state variables
+init_batch_session_variables()
+
+def display_batch_recipe(result):
+    """ Display a single recipe from the batch """
+    recipe = result.cocktail
+    with st.expander(f"{recipe.name}  ({result.item.liquor})"):
+        st.markdown(render_recipe(recipe, "markdown"))
+
+async def run_batch(items, concurrency, fresh):
+    """ Run the batch, updating the progress and results as each recipe completes """
+    progress_bar = st.progress(0.0, text="Starting the batch...")
+    status_placeholder = st.empty()
+    results_container = st.container()
+    results, failures = [], 0
+    async for result in generate_batch(items, concurrency=concurrency, fresh=fresh):
+        results.append(result)
+        if result.ok:
+            with results_container:
+                display_batch_recipe(result)
+        else:
+            failures += 1
+            status_placeholder.warning(f"{failures} recipe(s) failed, the rest of the batch continues.")
+        progress_bar.progress(
+            len(results) / len(items), text=f"Created {len(results)} of {len(items)} recipes"
+        )
+    return results
+
+def batch_cocktails():
+    """ Create recipes for a batch of inventory items """
+    st.markdown('''<div style="text-align: center;">
+    <h2>Clear the back bar</h2>
+    </div>''', unsafe_allow_html=True)
+    st.success(
+        """**Pick the bottles you need to move and we will create recipes for all of them at
+        once.  Use our sample inventory or upload your own csv with the columns
+        Name, Quantity, Volume per Unit (ml) and Cost per Unit.**"""
+    )
+
+    uploaded_inventory = st.file_uploader("Upload an inventory csv (optional)", type=["csv"])
+    try:
+        inventory = load_inventory(uploaded_inventory) if uploaded_inventory else load_inventory()
+        # Rank the bottles so the ones costing the most to sit on the shelf come first
+        ranked_inventory = rank_dead_stock(inventory)
+    except ValueError as e:
+        st.error(f"We could not read that inventory: {e}")
+        st.stop()
+    invalid_rows = inventory.attrs.get(INVALID_ROWS_ATTR)
+    if invalid_rows:
+        st.warning(
+            f"Some quantities, volumes or costs could not be read and were counted as 0 for: "
+            f"{', '.join(invalid_rows)}"
+        )
+    with st.expander("What is costing us the most to sit on the shelf?"):
+        st.dataframe(
+            ranked_inventory[["Name", "Quantity", "Capital Tied Up", "Volume on Hand (ml)", "Priority Score"]],
+            hide_index=True, use_container_width=True
+        )
+
+    chosen_items = st.multiselect(
+        "Which bottles are you trying to use up?", ranked_inventory["Name"].tolist(),
+        default=ranked_inventory["Name"].tolist()[:5]
+    )
+    col1, col2 = st.columns(2, gap="small")
+    with col1:
+        recipes_per_item = st.number_input("Recipes per bottle", min_value=1, max_value=5, value=1)
+        cocktail_type = st.selectbox(
+            'What type of cocktails are you looking for?', ['Classic', 'Craft', 'Standard']
+        )
+    with col2:
+        concurrency = st.slider("Recipes to create at the same time", min_value=1, max_value=10, value=5)
+        theme = st.text_input('What theme, if any? (e.g. "tiki", "holiday", "summer")', 'None')
+    fresh = st.checkbox("Give me fresh ones (skip recipes we have already created)")
+
+    run_button = st.button(
+        "Create the batch!", type="primary", use_container_width=True, disabled=not chosen_items
+    )
+    if run_button:
+        items = build_batch_items(
+            chosen_items, recipes_per_item=int(recipes_per_item),
+            cocktail_type=cocktail_type, cuisine="Any", theme=theme
+        )
+        st.session_state.batch_results = run_async(run_batch(items, concurrency, fresh))
+        st.session_state.batch_menu_pdf = None
+    elif st.session_state.batch_results:
+        for result in st.session_state.batch_results:
+            if result.ok:
+                display_batch_recipe(result)
+
+    if any(result.ok for result in st.session_state.batch_results):
+        col1, col2, col3 = st.columns(3, gap="small")
+        with col3:
+            if st.button("Build menu PDF", use_container_width=True):
+                with st.spinner("Rendering the menu..."):
+                    st.session_state.batch_menu_pdf = render_menu_pdf(
+                        [result.cocktail for result in st.session_state.batch_results if result.ok]
+                    )
+            if st.session_state.get("batch_menu_pdf"):
+                st.download_button(
+                    "Download menu (pdf)", st.session_state.batch_menu_pdf,
+                    file_name="batch_menu.pdf", mime="application/pdf", use_container_width=True
+                )
+        with col1:
+            st.download_button(
+                "Download recipes (csv)", batch_results_to_csv(st.session_state.batch_results),
+                file_name="batch_recipes.csv", mime="text/csv", use_container_width=True
+            )
+        with col2:
+            st.download_button(
+                "Download recipes (json)", batch_results_to_json(st.session_state.batch_results),
+                file_name="batch_recipes.json", mime="application/json", use_container_width=True
+            )
+
+        # Price the whole batch against the inventory in one pass
+        with st.expander("Price the menu"):
+            n_drinks = st.number_input("Drinks of each recipe", min_value=1, value=50, step=10)
+            batch_cocktails = [result.cocktail for result in st.session_state.batch_results if result.ok]
+            st.dataframe(
+                cost_recipes(batch_cocktails, inventory, n_drinks=int(n_drinks)).drop(columns=["recipe"]),
+                hide_index=True, use_container_width=True
+            )
+            st.markdown("**Bottles used up:**")
+            st.dataframe(
+                bottles_depleted(batch_cocktails, inventory, n_drinks=int(n_drinks)).drop(columns=["recipe"]),
+                hide_index=True, use_container_width=True
+            )
+
+    create_cocktail_button = st.sidebar.button(
+        "Create a Single Cocktail", use_container_width=True, type='primary'
+    )
+    if create_cocktail_button:
+        switch_page("Create Cocktails")
+        st.rerun()
+
+    home_button = st.sidebar.button(
+        "Home", use_container_width=True, type='primary'
+    )
+    if home_button:
+        switch_page("Home")
+        st.rerun()
+
+batch_cocktails()
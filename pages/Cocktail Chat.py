@@ -1,40 +1,35 @@
 """ General Chat page... not tied to a cocktail recipe """
-from PIL import Image
-from dependencies import get_openai_client
+from utils.asset_utils import get_asset_path, load_asset
+from utils.session_utils import COCKTAIL_SESSION_DEFAULTS, init_session_variables
+from utils.streaming_utils import run_chat_turn
 import streamlit as st
 from streamlit_extras.switch_page_button import switch_page
 
 st.set_page_config(
-    page_title="General Chat", page_icon="./resources/bartenders.png", initial_sidebar_state="auto"
+    page_title="General Chat", page_icon=get_asset_path("bartenders_icon"), initial_sidebar_state="auto"
 )
 
-if "cocktail_chat_messages" not in st.session_state:
-    st.session_state.cocktail_chat_messages = []
+init_session_variables(st.session_state, COCKTAIL_SESSION_DEFAULTS)
 if "show_recipe" not in st.session_state:
     st.session_state.show_recipe = False
-if "current_cocktail" not in st.session_state:
-    st.session_state.current_cocktail = None
-
-client = get_openai_client()
-
-IMG_PATH = "./resources/mixologist1.png"  # Replace with your image's path
-mixologist_image = Image.open(IMG_PATH)
-
-initial_message = [
-    {
-        "role": "system",
-        "content": f"""
-        You are a master mixologist who has created a new cocktail recipe
-        {st.session_state.current_cocktail} for a user,
-        helping them creatively use up their excess inventory.
-        They would like to ask you some follow up questions about the recipe.
-        Your tone should be warm and welcoming while having high standards and a passion for the
-        details. Your recent chat history is {st.session_state.cocktail_chat_messages}.  Keep
-        the conversation open-ended, asking follow up questions such as 'Is there anything
-        else I can help you with?' or whatever seems appropriate.
-        """
-    }
-]
+if "cocktail_chat_summary" not in st.session_state:
+    st.session_state.cocktail_chat_summary = None
+
+# Avatar-sized mixologist icon, loaded once per process and shared by every session
+mixologist_image = load_asset("mixologist_avatar")
+
+initial_message = {
+    "role": "system",
+    "content": f"""
+    You are a master mixologist who has created a new cocktail recipe
+    {st.session_state.current_cocktail} for a user,
+    helping them creatively use up their excess inventory.
+    They would like to ask you some follow up questions about the recipe.
+    Your tone should be warm and welcoming while having high standards and a passion for the
+    details.  Keep the conversation open-ended, asking follow up questions such as 'Is there
+    anything else I can help you with?' or whatever seems appropriate.
+    """
+}
 
 def cocktail_chat():
     """ Chat bot to answer questions about a specific cocktail """
@@ -68,33 +63,21 @@ def cocktail_chat():
 
     # Accept user input
     if prompt := st.chat_input(f"What questions can I answer about the {recipe.name}?"):
-        with st.spinner("Grabbing the shaker..."):
-            # Add user message to chat history
-            st.session_state.cocktail_chat_messages.append({"role": "user", "content": prompt})
-
-            # Display user message in chat message container
-            with st.chat_message("user"):
-                st.markdown(prompt)
-
-            # Display assistant response in chat message container
-            with st.chat_message("assistant", avatar=mixologist_image):
-                message_placeholder = st.empty()
-                full_response = ""
-
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=initial_message + st.session_state.cocktail_chat_messages,
-                stream=True,
-                temperature=0.6,
-                max_tokens=750,
-            )
-        for chunk in response:
-          if chunk.choices[0].finish_reason == "stop":
-            break
-          full_response += chunk.choices[0].delta.content
-          message_placeholder.markdown(full_response + "▌")
-        message_placeholder.markdown(full_response)
-        st.session_state.cocktail_chat_messages.append({"role": "assistant", "content": full_response})
+        # Add user message to chat history
+        st.session_state.cocktail_chat_messages.append({"role": "user", "content": prompt})
+
+        # Display user message in chat message container
+        with st.chat_message("user"):
+            st.markdown(prompt)
+
+        # Display assistant response in chat message container
+        with st.chat_message("assistant", avatar=mixologist_image):
+            message_placeholder = st.empty()
+
+        run_chat_turn(
+            st.session_state, "cocktail_chat", initial_message, message_placeholder,
+            waiting=st.spinner("Grabbing the shaker...")
+        )
 
     show_recipe_button = st.sidebar.button(
         "Show Recipe", use_container_width=True, type='secondary'
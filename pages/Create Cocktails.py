@@ -1,13 +1,24 @@
 """ This is the main entry point for the user to create cocktails """
 # Import libraries
 import logging
-import asyncio
+from typing import Any, Dict
 import streamlit as st
 from streamlit_extras.switch_page_button import switch_page
+from dependencies import run_async
+from utils.asset_utils import get_asset_path
+from utils.cocktail_options import COCKTAIL_TYPES, CUISINES, DEFAULT_THEME, SPIRITS
 from utils.image_utils import generate_image
-from utils.cocktail_utils import create_cocktail
-from utils.training_utils import create_training_guide
-# from utils.save_print_utils import get_recipe_pdf_download_link
+from utils.image_store import get_image_store
+from utils.inventory_utils import load_inventory, rank_dead_stock, prioritize_spirits
+from utils.ingredient_index import get_ingredient_index
+from utils.pour_cost_utils import cost_recipes
+from utils.recipe_library import get_recipe_library
+from utils.training_utils import get_training_guide_prefetcher
+from utils.pipeline_utils import stream_cocktail_pipeline, build_image_prompt
+from utils.rate_limiter import format_queue_position, listen_for_queue
+from utils.session_store import get_session_store
+from utils.session_utils import COCKTAIL_SESSION_DEFAULTS, init_session_variables
+from utils.save_print_utils import render_recipe_pdf
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
@@ -15,7 +26,7 @@ logger = logging.getLogger(__name__)
 
 # Define the page config
 st.set_page_config(
-    page_title="BarGuruV1", page_icon="./resources/cocktail_icon.png", initial_sidebar_state="auto"
+    page_title="BarGuruV1", page_icon=get_asset_path("cocktail_icon"), initial_sidebar_state="auto"
 )
 
 general_chat_button = st.sidebar.button(
@@ -35,47 +46,15 @@ if home_button:
 # Initialize the session state
 def init_cocktail_session_variables():
     # Initialize session state variables
-    session_vars = [
-        "current_cocktail", "current_image", "cocktail_page", "training_guide",
-        "cocktail_chat_messages"
-    ]
-    default_values = [
-        None, None, "get_cocktail_info", None, []
-    ]
-
-    for var, default_value in zip(session_vars, default_values):
-        if var not in st.session_state:
-            st.session_state[var] = default_value
+    init_session_variables(st.session_state, COCKTAIL_SESSION_DEFAULTS)
 
 # Initialize the session state variables
 init_cocktail_session_variables()
 
-# Create a list of commnonly used spirits that the user can choose from
-spirits_list = [
-    # Basic spirits
-    "Vodka", "Gin", "Rum", "Tequila", "Mezcal", "Brandy", "Whiskey", "Scotch",
-    "Bourbon", "Rye Whiskey", "Irish Whiskey", "Canadian Whisky", "Japanese Whisky",
-    "Cognac", "Armagnac", "Calvados", "Pisco", "Grappa", "Sake", "Soju", "Shochu",
-
-    # Liqueurs & Cordials
-    "Amaretto", "Baileys Irish Cream", "Benedictine", "Chartreuse (Green)",
-    "Chartreuse (Yellow)", "Cointreau", "Drambuie", "Frangelico", "Galliano",
-    "Grand Marnier", "Jägermeister", "Kahlua", "Limoncello", "Sambuca",
-    "Southern Comfort", "St. Germain (Elderflower Liqueur)", "Tia Maria",
-    "Chambord", "Aperol", "Campari", "Fernet Branca", "Pimm's No. 1",
-
-    # Vermouths & Amaro
-    "Sweet Vermouth", "Dry Vermouth", "Red Vermouth", "White Vermouth", "Amaro Montenegro",
-    "Amaro Nonino", "Averna", "Cynar", "Ramazzotti", "Zucca", "Amaro Lucano",
-
-    # Flavored Spirits
-    "Absinthe", "Anisette", "Aquavit", "Arak", "Bitters", "Ouzo", "Schnapps",
-    "Flavored Vodka", "Spiced Rum", "Peach Schnapps", "Peppermint Schnapps",
-
-    # Other
-    "Moonshine", "Everclear", "Fireball", "Malibu (Coconut Rum)",
-    "Margarita Mix", "Bloody Mary Mix", "Other"
-]
+@st.cache_data
+def get_prioritized_spirits():
+    """ Put the spirits tying up the most money in our inventory at the top of the list """
+    return prioritize_spirits(SPIRITS, rank_dead_stock(load_inventory()))
 
 async def get_cocktail_info():
     """ Get the cocktail info from the user """
@@ -87,30 +66,34 @@ async def get_cocktail_info():
 
     # Start by getting the input for the liquor that the user is trying to use up
     chosen_liquor = st.selectbox('What spirit are you trying to use up?\
-    (Type to search by name)', spirits_list)
-    st.markdown('**Note:  If you do not see the spirit you are looking for above,\
+    (Type to search by name)', get_prioritized_spirits())
+    st.markdown('**Note:  Spirits in your inventory are listed first, starting with the ones\
+    costing you the most to keep on the shelf.  If you do not see the spirit you are looking for above,\
     select "Other" and manually enter it below.**')
     # If the spirit they need to use up is not in the list, allow them to enter it manually
     if chosen_liquor == 'Other':
         chosen_liquor = st.text_input('What is the name of the spirit you are trying to use up?')
+        # Suggest matching ingredient names from our ingredient list
+        suggestions = get_ingredient_index().search(chosen_liquor, limit=8) if chosen_liquor else []
+        if suggestions:
+            chosen_liquor = st.selectbox(
+                'Did you mean one of these?', [chosen_liquor] + suggestions,
+                format_func=lambda name: f'Use "{name}" as entered' if name == chosen_liquor else name
+            )
     chosen_liquor = str(chosen_liquor)
     logger.info(f"Chosen liquor: {chosen_liquor}")
     # Allow the user to choose what type of cocktail from "Classic", "Craft", "Standard"
-    cocktail_type = st.selectbox(
-        'What type of cocktail are you looking for?', ['Classic', 'Craft', 'Standard']
-    )
+    cocktail_type = st.selectbox('What type of cocktail are you looking for?', COCKTAIL_TYPES)
     # Allow the user the option to select a type of cuisine to pair
     # it with if they have not uploaded a food menu
-    cuisine = st.selectbox('What type of cuisine, if any, are you looking to pair it with?', [
-        'Any', 'American', 'Mexican', 'Italian', 'French', 'Chinese', 'Japanese', 'Thai', 'Indian',
-        'Greek', 'Spanish', 'Korean', 'Vietnamese', 'Mediterranean', 'Middle Eastern', 'Caribbean',
-        'British', 'German', 'Irish', 'African', 'Moroccan', 'Nordic', 'Eastern European',
-        'Jewish', 'South American', 'Central American', 'Australian',
-        'New Zealand', 'Pacific Islands', 'Canadian', 'Other'
-    ])
+    cuisine = st.selectbox('What type of cuisine, if any, are you looking to pair it with?', CUISINES)
     # Allow the user to enter a theme for the cocktail if they want
     theme = st.text_input(
-        'What theme, if any, are you looking for? (e.g. "tiki", "holiday", "summer", etc.)', 'None'
+        'What theme, if any, are you looking for? (e.g. "tiki", "holiday", "summer", etc.)', DEFAULT_THEME
+    )
+    # Allow the user to skip previously generated recipes for the same request
+    fresh_recipe = st.checkbox(
+        'Give me a fresh one (skip recipes we have already created for these choices)'
     )
     col1, col2 = st.columns(2, gap="small")
     # Create the submit button
@@ -120,13 +103,21 @@ async def get_cocktail_info():
             type='primary'
         )
         if cocktail_submit_button:
-            with st.spinner('Creating your cocktail recipe.  This may take a minute...'):
-                st.session_state.current_cocktail = await create_cocktail(
-                    liqour=chosen_liquor, type=cocktail_type, cuisine=cuisine, theme=theme
-                )
-                if st.session_state.current_cocktail:
-                    st.session_state.cocktail_page = "display_recipe"
-                    st.rerun()
+            # Any guide still being written for a previous recipe is no longer needed
+            get_training_guide_prefetcher().cancel(
+                st.session_state.training_guide_key, owner=st.session_state.session_id
+            )
+            # The recipe page streams the recipe in as it is written
+            st.session_state.recipe_request = {
+                "liquor": chosen_liquor, "cocktail_type": cocktail_type, "cuisine": cuisine,
+                "theme": theme, "fresh": fresh_recipe,
+            }
+            st.session_state.current_cocktail = None
+            st.session_state.current_image = None
+            st.session_state.training_guide = None
+            st.session_state.training_guide_key = None
+            st.session_state.cocktail_page = "display_recipe"
+            st.rerun()
     st.markdown('---')
     st.text("")
     general_chat_button = st.button(
@@ -153,7 +144,72 @@ async def get_cocktail_info():
         url = "mailto:barguru@enoughwebapp.com",
         type = "secondary",
         use_container_width=True)
+def show_recipe_fields(fields: Dict[str, Any]):
+    """ Show whichever fields of a recipe are known, so it can be shown while it streams """
+    if fields.get("name"):
+        st.markdown(f':violet[**Recipe Name:**]  {fields["name"]}')
+    if fields.get("ingredients"):
+        st.markdown(':violet[**Ingredients:**]')
+        for ingredient in fields["ingredients"]:
+            st.markdown(f'{ingredient}')
+    if fields.get("directions"):
+        st.markdown(':violet[**Directions:**]')
+        for direction in fields["directions"]:
+            st.markdown(f'{direction}')
+    if fields.get("garnish"):
+        st.markdown(f':violet[**Garnish:**] {fields["garnish"]}')
+    if fields.get("glass"):
+        st.markdown(f':violet[**Glass:**] {fields["glass"]}')
+    if fields.get("description"):
+        st.markdown(f':violet[**Description:**] {fields["description"]}')
+    if fields.get("fun_fact"):
+        st.markdown(f':violet[**Fun Fact:**] {fields["fun_fact"]}')
+
+async def stream_recipe():
+    """ Show the requested recipe field by field as it is written, while its image is
+    generated alongside, then show it in full """
+    request = st.session_state.recipe_request
+    st.markdown('''<div style="text-align: center; color:#778da9">
+    <h4>Mixing your recipe...</h4>
+    <hr>
+    </div>''', unsafe_allow_html=True)
+    col1, col2 = st.columns([1.5, 1], gap = "large")
+    with col1:
+        queue_status = st.empty()
+        recipe_placeholder = st.empty()
+    with col2:
+        st.image(get_asset_path("cocktail_placeholder"), use_column_width=True)
+
+    def show_progress(fields: Dict[str, Any]):
+        queue_status.empty()
+        with recipe_placeholder.container():
+            show_recipe_fields(fields)
+
+    with col2, st.spinner('Creating your cocktail.  This may take a minute...'), listen_for_queue(
+        lambda position, eta: queue_status.caption(format_queue_position(position, eta))
+    ):
+        pipeline_result = await stream_cocktail_pipeline(
+            liquor=request["liquor"], cocktail_type=request["cocktail_type"], cuisine=request["cuisine"],
+            theme=request["theme"], fresh=request["fresh"], degrade=True, on_progress=show_progress
+        )
+    st.session_state.recipe_request = None
+    # Sessions shown the same recipe share one copy of it
+    session_store = get_session_store()
+    st.session_state.current_cocktail = session_store.share_recipe(pipeline_result.cocktail)
+    st.session_state.current_image = pipeline_result.image_key
+    st.session_state.training_guide = session_store.share_text(pipeline_result.training_guide)
+    st.session_state.recipe_degraded = pipeline_result.degraded
+    if not st.session_state.current_cocktail:
+        st.session_state.cocktail_page = "get_cocktail_info"
+        recipe_placeholder.error("We could not create a recipe right now.  Please try again in a few minutes.")
+        if st.button("Back", type="primary"):
+            st.rerun()
+        st.stop()
+    st.rerun()
+
 async def display_recipe():
+    if not st.session_state.current_cocktail and st.session_state.recipe_request:
+        await stream_recipe()
     if not st.session_state.current_cocktail:
         st.session_state.cocktail_page = "get_cocktail_info"
         st.rerun()
@@ -162,56 +218,60 @@ async def display_recipe():
     <h4>Here's your recipe!</h4>
     <hr>
     </div>''', unsafe_allow_html=True)
+    if st.session_state.recipe_degraded:
+        st.info("Our recipe service is busy right now, so here is the closest recipe from our library "
+                "instead.  Try again in a few minutes for a brand new one.")
     recipe = st.session_state.current_cocktail
+    # Start writing the training guide in the background while the recipe is read
+    prefetcher = get_training_guide_prefetcher()
+    if not st.session_state.training_guide:
+        st.session_state.training_guide_key = prefetcher.start(
+            recipe, owner=st.session_state.session_id
+        )
     # Create 2 columns, one to display the recipe and the other to display
     # a generated picture as well as the buttons
     col1, col2 = st.columns([1.5, 1], gap = "large")
     with col1:
-        # Display the recipe name
-        st.markdown(f':violet[**Recipe Name:**]  {recipe.name}')
-        # Convert the ingredients tuples into a list of strings
-
-        # Display the recipe ingvioletients
-        st.markdown(':violet[**Ingredients:**]')
-        ingredients_list = recipe.ingredients
-        # Convert the ingredients tuple into a list
-        for ingredient in ingredients_list:
-            st.markdown(f'{ingredient}')
-        # Display the recipe instructions
-        st.markdown(':violet[**Directions:**]')
-        for direction in recipe.directions:
-            st.markdown(f'{direction}')
-        # Display the recipe garnish
-        st.markdown(f':violet[**Garnish:**] {recipe.garnish}')
-        # Display the recipe glass
-        st.markdown(f':violet[**Glass:**] {recipe.glass}')
-        # Display the recipe description
-        st.markdown(f':violet[**Description:**] {recipe.description}')
-        # Display the recipe fun fact
-        if recipe.fun_fact:
-            st.markdown(f':violet[**Fun Fact:**] {recipe.fun_fact}')
+        show_recipe_fields(recipe.model_dump())
+        # Estimate the pour cost from the ingredients we have in inventory
+        pour_cost = cost_recipes([recipe]).iloc[0]
+        if pour_cost["uncosted_ingredients"] < pour_cost["ingredients"]:
+            st.markdown(
+                f':violet[**Estimated Pour Cost:**] ${pour_cost["cost_per_drink"]:.2f} '
+                f'({pour_cost["uncosted_ingredients"]} ingredient(s) not in inventory are not included)'
+            )
     with col2:
         # Display the recipe name
         st.markdown(f'<div style="text-align: center;">{recipe.name}</div>', unsafe_allow_html=True)
         st.text("")
-        if not st.session_state.current_image:
+        # The session only keeps the image store key, the image itself is served from disk
+        image_path = get_image_store().display_path(st.session_state.current_image)
+        # A recipe served from the library while the models are down is shown without waiting on one
+        if not image_path and not st.session_state.recipe_degraded:
             with st.spinner('Generating cocktail image...'):
-                # Generate the image
-                image_prompt = f'''Hyper-realistic photograph of a cocktail named {recipe.name}
-                garnished with {recipe.garnish} in a {recipe.glass} glass.'''
-                st.session_state.current_image = await generate_image(image_prompt)
-        if st.session_state.current_image:
-            st.image(st.session_state.current_image, use_column_width=True)
+                # Generate the image if the pipeline did not produce one
+                try:
+                    st.session_state.current_image = await generate_image(build_image_prompt(recipe))
+                except Exception as e:
+                    logger.error("Error generating image: %s", e)
+                image_path = get_image_store().display_path(st.session_state.current_image)
+                if st.session_state.current_image:
+                    get_recipe_library().save(recipe, image_key=st.session_state.current_image)
+        if image_path:
+            st.image(image_path, use_column_width=True)
+        else:
+            st.image(get_asset_path("cocktail_placeholder"), use_column_width=True)
+            st.caption("Your cocktail's picture is on its way, check back in a few minutes.")
         # Markdown "AI image generate by [StabilityAI](https://stabilityai.com)"]"
         st.markdown('''<div style="text-align: center;">
         <p>AI cocktail image generated using "dall-e-3" by OpenAI.</p>
         </div>''', unsafe_allow_html=True)
         st.markdown(':violet[**Note:**] The actual cocktail may not look exactly like this!')
 
-        # pdf_download_link = await get_recipe_pdf_download_link(
-        #    recipe = recipe, recipe_name = recipe["name"]
-        # )
-        # st.markdown(pdf_download_link, unsafe_allow_html=True)
+        st.download_button(
+            '**Download Recipe as PDF**', render_recipe_pdf(recipe, st.session_state.training_guide),
+            file_name=f"{recipe.name}.pdf", mime="application/pdf", use_container_width=True
+        )
 
         # Create an option to chat about the recipe
         chat_button = st.button(
@@ -227,21 +287,25 @@ async def display_recipe():
             '**Click here to generate a training guide for this recipe.**',
             type = 'primary', use_container_width=True)
         if training_guide_button:
-            with st.spinner('Generating training guide...'):
-                st.session_state.training_guide = await create_training_guide(recipe)
-                if st.session_state.training_guide:
-                    switch_page('Training')
-                    st.rerun()
+            # Use the prefetched guide if it is finished, otherwise the training page streams it
+            prefetched_guide = prefetcher.get(st.session_state.training_guide_key)
+            if prefetched_guide and prefetched_guide.done and not prefetched_guide.error:
+                st.session_state.training_guide = get_session_store().share_text(prefetched_guide.text)
+            switch_page('Training')
+            st.rerun()
 
         # Create an option to get a new recipe
         new_recipe_button = st.button('**Get a new recipe**', type = 'primary', use_container_width=True)
         if new_recipe_button:
             # Clear the session state variables
+            prefetcher.cancel(st.session_state.training_guide_key, owner=st.session_state.session_id)
             st.session_state.current_cocktail = None
             st.session_state.current_image = None
+            st.session_state.training_guide = None
+            st.session_state.training_guide_key = None
+            st.session_state.recipe_degraded = False
             # Clear the recipe and chat history
-            if st.session_state.cocktail_chat_messages:
-                st.session_state.cocktail_chat_messages = []
+            st.session_state.cocktail_chat_messages.clear()
             st.session_state.cocktail_page = "get_cocktail_info"
             st.rerun()
 
@@ -266,6 +330,6 @@ async def display_recipe():
             use_container_width=True)
 
 if st.session_state.cocktail_page == "get_cocktail_info":
-    asyncio.run(get_cocktail_info())
+    run_async(get_cocktail_info())
 elif st.session_state.cocktail_page == "display_recipe":
-    asyncio.run(display_recipe())
+    run_async(display_recipe())
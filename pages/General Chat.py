@@ -1,6 +1,7 @@
 """ General Chat page... not tied to a cocktail recipe """
-from PIL import Image
-from dependencies import get_openai_client
+from utils.asset_utils import get_asset_path, load_asset
+from utils.streaming_utils import run_chat_turn
+from utils.session_utils import GENERAL_CHAT_SESSION_DEFAULTS, init_session_variables
 import streamlit as st
 from streamlit_extras.switch_page_button import switch_page
 import logging
@@ -11,27 +12,16 @@ logging.getLogger("openai").setLevel(logging.ERROR)
 logger = logging.getLogger(__name__)
 
 st.set_page_config(
-    page_title="General Chat", page_icon="./resources/bartenders.png", initial_sidebar_state="auto"
+    page_title="General Chat", page_icon=get_asset_path("bartenders_icon"), initial_sidebar_state="auto"
 )
 
-client = get_openai_client()
-
-IMG_PATH = "./resources/mixologist1.png"  # Replace with your image's path
-mixologist_image = Image.open(IMG_PATH)
+# Avatar-sized mixologist icon, loaded once per process and shared by every session
+mixologist_image = load_asset("mixologist_avatar")
 
 # Initialize the session state
 def init_general_chat_session_variables():
     # Initialize session state variables
-    session_vars = [
-        "general_chat_messages"
-    ]
-    default_values = [
-        None
-    ]
-
-    for var, default_value in zip(session_vars, default_values):
-        if var not in st.session_state:
-            st.session_state[var] = default_value
+    init_session_variables(st.session_state, GENERAL_CHAT_SESSION_DEFAULTS)
 
 # Initialize the session state variables
 init_general_chat_session_variables()
@@ -41,19 +31,14 @@ initial_message = {
     "content": f"""You are a master mixologist and bar manager, helping a user create cocktails,
     craft menus, manage their inventory, and answer general bar questions.  Your tone
     should be warm and welcoming while having high standards and a passion for the
-    details. Your recent chat history is {st.session_state.general_chat_messages}.
-    Remeber you are a master mixologist and business person, not an AI, so make sure to
+    details.  Remeber you are a master mixologist and business person, not an AI, so make sure to
     stay in and do not break character.Keep your answer concise and to the point, but ask
     clarifying questions if needed."""
 }
-logger.debug("Initial message: %s", initial_message)
-
-if not st.session_state.general_chat_messages:
-    st.session_state.general_chat_messages = [initial_message]
 
 def general_chat():
     """ Chat bot to answer general bar questions """
-    if len(st.session_state.general_chat_messages) == 1:
+    if len(st.session_state.general_chat_messages) == 0:
         st.success(
             """**This page is designed to help answer general bar questions.\
             Simply type your question in the text input at the bottom of the page to get started.
@@ -72,34 +57,22 @@ def general_chat():
 
     # Accept user input
     if prompt := st.chat_input("Let's get mixing!"):
-        with st.spinner("Grabbing the shaker..."):
-            # Add user message to chat history
-            st.session_state.general_chat_messages.append({"role": "user", "content": prompt})
-            logger.debug("Chat history: %s", st.session_state.general_chat_messages)
-
-            # Display user message in chat message container
-            with st.chat_message("user"):
-                st.markdown(prompt)
-
-            # Display assistant response in chat message container
-            with st.chat_message("assistant", avatar=mixologist_image):
-                message_placeholder = st.empty()
-                full_response = ""
-
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=st.session_state.general_chat_messages,
-                stream=True,
-                temperature=0.6,
-                max_tokens=750,
-            )
-        for chunk in response:
-          if chunk.choices[0].finish_reason == "stop":
-            break
-          full_response += chunk.choices[0].delta.content
-          message_placeholder.markdown(full_response + "▌")
-        message_placeholder.markdown(full_response)
-        st.session_state.general_chat_messages.append({"role": "assistant", "content": full_response})
+        # Add user message to chat history
+        st.session_state.general_chat_messages.append({"role": "user", "content": prompt})
+        logger.debug("Chat history: %s", st.session_state.general_chat_messages)
+
+        # Display user message in chat message container
+        with st.chat_message("user"):
+            st.markdown(prompt)
+
+        # Display assistant response in chat message container
+        with st.chat_message("assistant", avatar=mixologist_image):
+            message_placeholder = st.empty()
+
+        run_chat_turn(
+            st.session_state, "general_chat", initial_message, message_placeholder,
+            waiting=st.spinner("Grabbing the shaker...")
+        )
 
     create_cocktail_button = st.sidebar.button(
         "Create Cocktail", use_container_width=True, type='primary'
@@ -113,7 +86,8 @@ def general_chat():
         "Clear Chat", use_container_width=True, type='primary'
     )
     if clear_chat_button:
-        st.session_state.general_chat_messages = [initial_message]
+        st.session_state.general_chat_messages.clear()
+        st.session_state.general_chat_summary = None
         st.rerun()
 
     home_button = st.sidebar.button(
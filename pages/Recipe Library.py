@@ -0,0 +1,102 @@
+""" Browse and search every recipe the app has created """
+# Import libraries
+import time
+import pandas as pd
+import streamlit as st
+from streamlit_extras.switch_page_button import switch_page
+from utils.asset_utils import get_asset_path
+from utils.image_store import get_image_store
+from utils.recipe_library import get_recipe_library
+from utils.render_utils import render_recipe
+from utils.session_store import get_session_store
+from utils.session_utils import COCKTAIL_SESSION_DEFAULTS, init_session_variables
+
+# Define the page config
+st.set_page_config(
+    page_title="BarGuru Recipe Library", page_icon=get_asset_path("cocktail_icon"),
+    initial_sidebar_state="auto"
+)
+
+init_session_variables(st.session_state, COCKTAIL_SESSION_DEFAULTS)
+
+# Recipes listed at first, and added by each "Load more"
+PAGE_SIZE = 50
+
+def open_recipe(recipe_id: int):
+    """ Show a stored recipe with its image and training guide """
+    stored = get_recipe_library().get(recipe_id)
+    if stored is None:
+        st.warning("That recipe is no longer in the library.")
+        return
+    recipe = stored["cocktail"]
+    col1, col2 = st.columns([1.5, 1], gap="large")
+    with col1:
+        st.markdown(render_recipe(recipe, "markdown"))
+        params = [stored["liquor"], stored["cocktail_type"], stored["cuisine"], stored["theme"]]
+        st.caption(" · ".join(param for param in params if param))
+    with col2:
+        image_path = get_image_store().display_path(stored["image_key"])
+        if image_path:
+            st.image(image_path, use_column_width=True)
+        if st.button("**Use this recipe**", type="primary", use_container_width=True):
+            session_store = get_session_store()
+            st.session_state.current_cocktail = session_store.share_recipe(recipe)
+            st.session_state.current_image = stored["image_key"]
+            st.session_state.training_guide = session_store.share_text(stored["training_guide"])
+            st.session_state.training_guide_key = None
+            st.session_state.recipe_degraded = False
+            st.session_state.cocktail_chat_messages.clear()
+            st.session_state.cocktail_page = "display_recipe"
+            switch_page("Create Cocktails")
+            st.rerun()
+    if stored["training_guide"]:
+        with st.expander("Training guide"):
+            st.markdown(stored["training_guide"])
+
+def recipe_library():
+    """ Search the library and open a recipe from the results """
+    library = get_recipe_library()
+    st.markdown('''<div style="text-align: center;">
+    <h2>Recipe Library</h2>
+    </div>''', unsafe_allow_html=True)
+    col1, col2 = st.columns([2, 1])
+    text = col1.text_input("Search by name, ingredient, spirit, cuisine or theme", "")
+    liquor = col2.selectbox("Spirit", ["Any"] + library.liquors())
+
+    # A new search starts again from the first page
+    if st.session_state.get("library_query") != (text, liquor):
+        st.session_state.library_query = (text, liquor)
+        st.session_state.library_limit = PAGE_SIZE
+    start = time.perf_counter()
+    results = library.search(
+        text, limit=st.session_state.library_limit, liquor=None if liquor == "Any" else liquor
+    )
+    elapsed = time.perf_counter() - start
+    st.caption(f"{len(results)} of {library.count()} recipes in {elapsed * 1000:.1f} ms")
+    if not results:
+        st.info("No recipes match your search yet.")
+        return
+
+    st.dataframe(pd.DataFrame([{
+        "Name": entry.name, "Spirit": entry.liquor, "Type": entry.cocktail_type,
+        "Cuisine": entry.cuisine, "Theme": entry.theme, "Image": entry.image_key is not None,
+        "Training guide": entry.has_training_guide,
+        "Created": pd.Timestamp(entry.created_at, unit="s").floor("s"),
+    } for entry in results]), hide_index=True, use_container_width=True)
+    if len(results) == st.session_state.library_limit and st.button("Load more", use_container_width=True):
+        st.session_state.library_limit += PAGE_SIZE
+        st.rerun()
+
+    names = {entry.id: entry.name for entry in results}
+    recipe_id = st.selectbox("Open a recipe", list(names), format_func=names.get)
+    st.markdown("---")
+    open_recipe(recipe_id)
+
+recipe_library()
+
+if st.sidebar.button("Create Cocktails", use_container_width=True, type="primary"):
+    switch_page("Create Cocktails")
+    st.rerun()
+if st.sidebar.button("Home", use_container_width=True, type="secondary"):
+    switch_page("Home")
+    st.rerun()
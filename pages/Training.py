@@ -1,11 +1,18 @@
 """ This will be the page to display the user's generated training guides """
 # Initial imports
+import time
 import streamlit as st
 from streamlit_extras.switch_page_button import switch_page
+from utils.training_utils import get_training_guide_prefetcher
+from utils.save_print_utils import render_training_guide_pdf
+from utils.asset_utils import get_asset_path
+from utils.session_store import get_session_store
+from utils.session_utils import COCKTAIL_SESSION_DEFAULTS, init_session_variables
+from utils.streaming_utils import StreamRenderer
 
 # Define the page config
 st.set_page_config(
-    page_title="BarKeepAI", page_icon="./resources/cocktail_icon.png", initial_sidebar_state="auto"
+    page_title="BarKeepAI", page_icon=get_asset_path("cocktail_icon"), initial_sidebar_state="auto"
 )
 
 st.success('''
@@ -17,19 +24,63 @@ st.markdown('---')
 
 if "cocktail_page" not in st.session_state:
     st.session_state.cocktail_page = "display_recipe"
-if "training_guide" not in st.session_state:
-    st.session_state.training_guide = None
+init_session_variables(st.session_state, COCKTAIL_SESSION_DEFAULTS)
+
+# Longest the page waits on a guide that is still being written before showing it as pending
+GUIDE_WAIT_SECONDS = 120
+
+def stream_prefetched_guide():
+    """ Show the training guide as it is written if the background prefetch has not finished """
+    prefetcher = get_training_guide_prefetcher()
+    guide = prefetcher.get(st.session_state.training_guide_key)
+    if (guide is None or guide.error) and st.session_state.current_cocktail:
+        st.session_state.training_guide_key = prefetcher.start(
+            st.session_state.current_cocktail, owner=st.session_state.session_id
+        )
+        guide = prefetcher.get(st.session_state.training_guide_key)
+    if guide is None:
+        return
+    placeholder = st.empty()
+    renderer = StreamRenderer(placeholder)
+    seen = 0
+    deadline = time.monotonic() + GUIDE_WAIT_SECONDS
+    # Wake only when new text arrives or the guide ends, and let the renderer coalesce updates
+    while time.monotonic() < deadline and guide.wait(seen, timeout=max(0.0, deadline - time.monotonic())):
+        chunks = guide.chunks[seen:]
+        seen += len(chunks)
+        renderer.feed("".join(chunks))
+        if guide.done:
+            break
+    placeholder.empty()
+    if guide.error or not guide.done:
+        # The next visit starts the guide again, so it is written once the models are back
+        st.info("**Your training guide is pending.**  Our guide writer is unavailable right now, "
+                "so it will be written as soon as it is back.  Check back in a few minutes.")
+        if st.button("Try again", type="primary"):
+            st.rerun()
+        st.stop()
+    else:
+        st.session_state.training_guide = get_session_store().share_text(guide.text)
 
 
 # Define the function to display the training guide for the cocktail
 def display_training_guide():
     """ Display the generated training guide for the current cocktail """
+    if not st.session_state.training_guide:
+        stream_prefetched_guide()
     if not st.session_state.training_guide:
         st.markdown("**You have not created a cocktail yet.  Please select the\
             'Create a Cocktail' button on the home page or sidebar.**")
         st.stop()
     # Display the training guide
     st.markdown(st.session_state.training_guide)
+    if st.session_state.current_cocktail:
+        st.download_button(
+            '**Download Training Guide as PDF**',
+            render_training_guide_pdf(st.session_state.current_cocktail, st.session_state.training_guide),
+            file_name=f"{st.session_state.current_cocktail.name} Training Guide.pdf",
+            mime="application/pdf", use_container_width=True
+        )
 
     # Create a button to go back to the cocktail page
     back_to_cocktail_button = st.sidebar.button(
@@ -52,11 +103,16 @@ def display_training_guide():
     new_recipe_button = st.sidebar.button('Get a new recipe', type = 'secondary', use_container_width=True)
     if new_recipe_button:
         # Clear the session state variables
+        get_training_guide_prefetcher().cancel(
+            st.session_state.training_guide_key, owner=st.session_state.session_id
+        )
         st.session_state.current_cocktail = None
         st.session_state.current_image = None
+        st.session_state.training_guide = None
+        st.session_state.training_guide_key = None
+        st.session_state.recipe_degraded = False
         # Clear the recipe and chat history
-        if st.session_state.cocktail_chat_messages:
-            st.session_state.cocktail_chat_messages = []
+        st.session_state.cocktail_chat_messages.clear()
         st.session_state.cocktail_page = "get_cocktail_info"
         switch_page('Create Cocktails')
 
@@ -0,0 +1,99 @@
+""" Tests for answering a chat page's question """
+from types import SimpleNamespace
+import pytest
+from openai import APIConnectionError
+from utils import streaming_utils
+from utils.circuit_breaker import CircuitOpenError
+from utils.streaming_utils import run_chat_turn
+
+SYSTEM_MESSAGE = {"role": "system", "content": "You are a bartender."}
+
+def chunk(content=None, finish_reason=None):
+    return SimpleNamespace(choices=[SimpleNamespace(
+        delta=SimpleNamespace(content=content), finish_reason=finish_reason
+    )])
+
+class FakeClient:
+    """ A sync client whose streamed answer is the given chunks, optionally cut off part way """
+    def __init__(self, texts, cut_off=False):
+        self.texts = texts
+        self.cut_off = cut_off
+        self.requests = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **request):
+        self.requests.append(request)
+        return self._stream()
+
+    def _stream(self):
+        for text in self.texts:
+            yield chunk(text)
+        if self.cut_off:
+            raise APIConnectionError(request=None)
+        yield chunk(finish_reason="stop")
+
+class Placeholder:
+    def __init__(self):
+        self.markdowns, self.warnings = [], []
+
+    def markdown(self, text):
+        self.markdowns.append(text)
+
+    def caption(self, text):
+        pass
+
+    def warning(self, text):
+        self.warnings.append(text)
+
+class Stopped(Exception):
+    """ Stands in for st.stop(), which does nothing outside a running app """
+
+@pytest.fixture
+def stop(monkeypatch):
+    def drop_unanswered_prompt(messages, placeholder, notice):
+        messages.pop()
+        placeholder.warning(notice)
+        raise Stopped
+    monkeypatch.setattr(streaming_utils, "drop_unanswered_prompt", drop_unanswered_prompt)
+
+def new_state(question):
+    return {"test_chat_messages": [{"role": "user", "content": question}], "test_chat_summary": None}
+
+def test_answer_is_streamed_and_added_to_the_history(monkeypatch):
+    client = FakeClient(["Stir, ", "never shake, ", "a Manhattan."])
+    monkeypatch.setattr(streaming_utils, "get_openai_client", lambda timeout=None: client)
+    state, placeholder = new_state("How do I make a Manhattan?"), Placeholder()
+    answer = run_chat_turn(state, "test_chat", SYSTEM_MESSAGE, placeholder, model="test-chat-model")
+    assert answer == "Stir, never shake, a Manhattan."
+    assert state["test_chat_messages"][-1] == {"role": "assistant", "content": answer}
+    assert state["test_chat_summary"] is not None
+    assert state["last_stream_stats"].tokens > 0
+    assert placeholder.markdowns[-1] == answer
+    request = client.requests[0]
+    assert request["model"] == "test-chat-model" and request["stream"]
+    assert request["messages"][0] == SYSTEM_MESSAGE
+
+def test_lost_stream_drops_the_unanswered_question(monkeypatch, stop):
+    client = FakeClient(["Stir, "], cut_off=True)
+    monkeypatch.setattr(streaming_utils, "get_openai_client", lambda timeout=None: client)
+    state, placeholder = new_state("How do I make a Manhattan?"), Placeholder()
+    with pytest.raises(Stopped):
+        run_chat_turn(state, "test_chat", SYSTEM_MESSAGE, placeholder, model="test-lost-model")
+    assert state["test_chat_messages"] == []
+    assert placeholder.warnings == [streaming_utils.LOST_CONNECTION_NOTICE]
+
+def test_open_circuit_answers_without_a_request(monkeypatch, stop):
+    client = FakeClient(["unused"])
+    monkeypatch.setattr(streaming_utils, "get_openai_client", lambda timeout=None: client)
+
+    class OpenBreakers:
+        def check(self, call_type, model):
+            raise CircuitOpenError(call_type, model, 12.0)
+
+    monkeypatch.setattr(streaming_utils, "get_circuit_breakers", lambda: OpenBreakers())
+    state, placeholder = new_state("Still there?"), Placeholder()
+    with pytest.raises(Stopped):
+        run_chat_turn(state, "test_chat", SYSTEM_MESSAGE, placeholder, model="test-open-model")
+    assert client.requests == []
+    assert state["test_chat_messages"] == []
+    assert "12 seconds" in placeholder.warnings[0]
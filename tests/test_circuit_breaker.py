@@ -0,0 +1,158 @@
+""" Tests for the circuit breakers and the calls the metrics feed them """
+import asyncio
+import pytest
+from utils import circuit_breaker, metrics
+from utils.circuit_breaker import (
+    BreakerSettings, BreakerState, CircuitBreaker, CircuitBreakers, CircuitOpenError, is_failure
+)
+from utils.metrics import ModelMetrics
+
+SETTINGS = BreakerSettings(window=4, min_calls=4, failure_rate=0.5, slow_call_seconds=5.0,
+                           slow_call_rate=0.75, open_seconds=30.0)
+
+class FakeClock:
+    def __init__(self, now: float = 1_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    fake = FakeClock()
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", fake)
+    return fake
+
+class StatusError(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+def open_breaker(breaker: CircuitBreaker):
+    for _ in range(2):
+        breaker.record(0.1)
+    for _ in range(2):
+        breaker.record(0.1, RuntimeError("boom"))
+
+def test_breaker_waits_for_min_calls(clock):
+    breaker = CircuitBreaker("chat", "model", SETTINGS)
+    for _ in range(3):
+        breaker.record(0.1, RuntimeError("boom"))
+    assert breaker.state is BreakerState.CLOSED
+    breaker.record(0.1, RuntimeError("boom"))
+    assert breaker.state is BreakerState.OPEN
+
+def test_open_breaker_refuses_calls_until_open_seconds(clock):
+    breaker = CircuitBreaker("chat", "model", SETTINGS)
+    open_breaker(breaker)
+    assert breaker.state is BreakerState.OPEN
+    clock.now += 10
+    with pytest.raises(CircuitOpenError) as raised:
+        breaker.check()
+    assert raised.value.retry_in == pytest.approx(20.0)
+    assert breaker.rejected == 1
+
+def test_half_open_probe_success_closes(clock):
+    breaker = CircuitBreaker("chat", "model", SETTINGS)
+    open_breaker(breaker)
+    clock.now += 30
+    assert breaker.allow()
+    assert breaker.state is BreakerState.HALF_OPEN
+    # Only the probe is let through while it is running
+    assert not breaker.allow()
+    breaker.record(0.1)
+    assert breaker.state is BreakerState.CLOSED
+    assert breaker.allow()
+
+def test_half_open_probe_failure_reopens(clock):
+    breaker = CircuitBreaker("chat", "model", SETTINGS)
+    open_breaker(breaker)
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record(0.1, RuntimeError("still down"))
+    assert breaker.state is BreakerState.OPEN
+    assert breaker.times_opened == 2
+    assert breaker.retry_in() == pytest.approx(30.0)
+
+def test_slow_probe_reopens(clock):
+    breaker = CircuitBreaker("chat", "model", SETTINGS)
+    open_breaker(breaker)
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record(SETTINGS.slow_call_seconds)
+    assert breaker.state is BreakerState.OPEN
+
+def test_lost_probe_is_given_up_on(clock):
+    breaker = CircuitBreaker("chat", "model", SETTINGS)
+    open_breaker(breaker)
+    clock.now += 30
+    assert breaker.allow()
+    clock.now += 30
+    # The first probe never reported back, so another caller probes instead
+    assert breaker.allow()
+    assert breaker.state is BreakerState.HALF_OPEN
+
+def test_slow_calls_open_the_breaker(clock):
+    breaker = CircuitBreaker("chat", "model", SETTINGS)
+    breaker.record(0.1)
+    for _ in range(3):
+        breaker.record(SETTINGS.slow_call_seconds + 1)
+    assert breaker.state is BreakerState.OPEN
+
+def test_client_errors_do_not_count_as_failures(clock):
+    assert not is_failure(None)
+    assert not is_failure(StatusError(400))
+    assert not is_failure(StatusError(404))
+    assert is_failure(StatusError(429))
+    assert is_failure(StatusError(500))
+    assert is_failure(RuntimeError("connection reset"))
+    breaker = CircuitBreaker("chat", "model", SETTINGS)
+    for _ in range(SETTINGS.window):
+        breaker.record(0.1, StatusError(400))
+    assert breaker.state is BreakerState.CLOSED
+
+def test_breakers_are_kept_per_call_type_and_model(clock):
+    breakers = CircuitBreakers({"chat": SETTINGS})
+    open_breaker(breakers.get("chat", "a"))
+    with pytest.raises(CircuitOpenError):
+        breakers.check("chat", "a")
+    breakers.check("chat", "b")
+    assert breakers.get("image", "a").settings == breakers.default_settings
+
+@pytest.fixture
+def breakers(monkeypatch, clock) -> CircuitBreakers:
+    fresh = CircuitBreakers({"chat": SETTINGS})
+    monkeypatch.setattr(metrics, "get_circuit_breakers", lambda: fresh)
+    return fresh
+
+@pytest.mark.parametrize("error", [asyncio.CancelledError(), CircuitOpenError("chat", "model", 5.0)])
+def test_cancelled_and_refused_calls_are_not_fed_to_the_breaker(breakers, error):
+    store = ModelMetrics()
+    for _ in range(SETTINGS.window):
+        with pytest.raises(type(error)):
+            with store.track("chat", "model"):
+                raise error
+    breaker = breakers.get("chat", "model")
+    assert breaker.snapshot()["recent_calls"] == 0
+    assert breaker.state is BreakerState.CLOSED
+    row = store.snapshot()[0]
+    assert row["calls"] == SETTINGS.window
+    assert row["cancelled" if isinstance(error, asyncio.CancelledError) else "errors"] == SETTINGS.window
+
+def test_failed_calls_are_fed_to_the_breaker(breakers):
+    store = ModelMetrics()
+    for _ in range(SETTINGS.window):
+        with pytest.raises(RuntimeError):
+            with store.track("chat", "model"):
+                raise RuntimeError("boom")
+    assert breakers.get("chat", "model").state is BreakerState.OPEN
+
+def test_streams_are_judged_by_first_token(breakers):
+    store = ModelMetrics()
+    for _ in range(SETTINGS.window):
+        with store.track("chat", "model") as call:
+            call.defer()
+        call.time_to_first_token = 0.1
+        # Well past slow_call_seconds in total, but the answer started quickly
+        store.record(call, SETTINGS.slow_call_seconds * 2)
+    assert breakers.get("chat", "model").snapshot()["recent_slow"] == 0
@@ -0,0 +1,42 @@
+""" Tests for the fuzzy ingredient index """
+from pathlib import Path
+import pytest
+from utils.ingredient_index import IngredientIndex
+
+INGREDIENTS_PATH = Path(__file__).resolve().parents[1] / "resources" / "new_ingredients.txt"
+
+@pytest.fixture(scope="module")
+def index() -> IngredientIndex:
+    return IngredientIndex.from_file(str(INGREDIENTS_PATH))
+
+def test_search_ranks_prefix_hits_first():
+    small = IngredientIndex(["Lime Juice", "Lemon Juice", "Limoncello", "Juice, Lime"])
+    assert set(small.search("lim", limit=2)) == {"Limoncello", "Lime Juice"}
+    assert small.search("Lime Juice")[0] == "Lime Juice"
+    assert small.search("lmie juice")[0] in ("Lime Juice", "Juice, Lime")
+
+def test_search_ignores_case_accents_and_spacing():
+    small = IngredientIndex(["Crème de Cassis", "Cream"])
+    assert small.search("  CREME   de cassis")[0] == "Crème de Cassis"
+    assert small.normalize("creme de cassis") == "Crème de Cassis"
+
+@pytest.mark.parametrize("name, expected", [
+    ("Fresh lime juice", "lime juice raw"),
+    ("Orange juice", "orange juice raw"),
+    ("grenadine", "syrups grenadine"),
+    ("maple syrup", "syrups maple"),
+    ("Egg white", "egg white dried"),
+])
+def test_normalize_matches_close_names(index, name, expected):
+    assert index.normalize(name) == expected
+
+@pytest.mark.parametrize("name", ["Simple Syrup", "xyzzy syrup", "Angostura bitters", "bourbon", ""])
+def test_normalize_rejects_names_sharing_only_a_word(index, name):
+    # Each shares a word prefix with some name, which search ranks highly but is not a match
+    assert index.normalize(name) is None
+
+def test_normalize_threshold_is_on_trigram_similarity_alone():
+    small = IngredientIndex(["syrup, apricot heavy pack"])
+    assert small.search_scored("syrup", limit=1)[0][1] > 1.0
+    assert small.normalize("syrup") is None
+    assert small.normalize("syrup", min_similarity=0.2) == "syrup, apricot heavy pack"
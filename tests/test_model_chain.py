@@ -0,0 +1,118 @@
+""" Tests for hedged requests along a model chain """
+import asyncio
+import pytest
+from utils.metrics import get_metrics
+from utils.model_chain import AllModelsFailedError, ModelStep, run_hedged
+
+CHAIN = (ModelStep("primary"), ModelStep("hedge", hedge_after=0.05), ModelStep("last", hedge_after=0.05))
+
+class FakeModels:
+    """ attempt(model) that answers after each model's delay, and records what it was asked """
+    def __init__(self, delays, results=None, errors=()):
+        self.delays = delays
+        self.results = results or {}
+        self.errors = set(errors)
+        self.started = []
+        self.cancelled = []
+
+    async def attempt(self, model):
+        self.started.append(model)
+        try:
+            await asyncio.sleep(self.delays[model])
+        except asyncio.CancelledError:
+            self.cancelled.append(model)
+            raise
+        if model in self.errors:
+            raise RuntimeError(f"{model} failed")
+        return self.results.get(model, model)
+
+def route(call_type):
+    return [(row["model"], row["outcome"]) for row in get_metrics().routes_snapshot()
+            if row["call_type"] == call_type]
+
+def test_fast_primary_wins_without_hedging():
+    models = FakeModels({"primary": 0.0, "hedge": 0.0, "last": 0.0})
+    assert asyncio.run(run_hedged("test-primary", models.attempt, CHAIN)) == "primary"
+    assert models.started == ["primary"]
+    assert route("test-primary") == [("primary", "primary")]
+
+def test_slow_primary_is_hedged_and_cancelled():
+    models = FakeModels({"primary": 1.0, "hedge": 0.0, "last": 1.0})
+    assert asyncio.run(run_hedged("test-hedge", models.attempt, CHAIN)) == "hedge"
+    assert models.started == ["primary", "hedge"]
+    assert models.cancelled == ["primary"]
+    assert route("test-hedge") == [("hedge", "hedge")]
+
+def test_each_hedge_waits_its_own_budget():
+    models = FakeModels({"primary": 1.0, "hedge": 1.0, "last": 0.0})
+    assert asyncio.run(run_hedged("test-hedge-twice", models.attempt, CHAIN)) == "last"
+    assert models.started == ["primary", "hedge", "last"]
+    assert sorted(models.cancelled) == ["hedge", "primary"]
+
+def test_failure_falls_back_at_once():
+    chain = (ModelStep("primary"), ModelStep("hedge", hedge_after=10.0))
+    models = FakeModels({"primary": 0.0, "hedge": 0.0}, errors={"primary"})
+    assert asyncio.run(asyncio.wait_for(run_hedged("test-fallback", models.attempt, chain), 1.0)) == "hedge"
+    assert route("test-fallback") == [("hedge", "fallback")]
+
+def test_none_result_counts_as_failure():
+    chain = (ModelStep("primary"), ModelStep("hedge"))
+    models = FakeModels({"primary": 0.0, "hedge": 0.0}, results={"primary": None})
+    assert asyncio.run(run_hedged("test-none", models.attempt, chain)) == "hedge"
+
+def test_all_models_failing_raises_with_the_last_error():
+    models = FakeModels({"primary": 0.0, "hedge": 0.0, "last": 0.0}, errors={"primary", "hedge", "last"})
+    with pytest.raises(AllModelsFailedError) as raised:
+        asyncio.run(run_hedged("test-all-failed", models.attempt, CHAIN))
+    assert isinstance(raised.value.__cause__, RuntimeError)
+    assert models.started == ["primary", "hedge", "last"]
+
+def test_losing_results_are_discarded():
+    discarded = []
+
+    async def discard(result):
+        discarded.append(result)
+
+    async def run():
+        answer = asyncio.Event()
+
+        async def attempt(model):
+            await answer.wait()
+            return model
+
+        # Both answer in the same wakeup once the hedge is running, so one wins and the
+        # other must be released
+        asyncio.get_running_loop().call_later(0.1, answer.set)
+        chain = (ModelStep("primary"), ModelStep("hedge", hedge_after=0.05))
+        return await run_hedged("test-discard", attempt, chain, discard=discard)
+
+    result = asyncio.run(run())
+    assert result in ("primary", "hedge")
+    assert discarded == [{"primary": "hedge", "hedge": "primary"}[result]]
+
+def test_result_finished_while_cancelling_is_discarded():
+    discarded = []
+
+    async def discard(result):
+        discarded.append(result)
+
+    async def attempt(model):
+        if model == "primary":
+            await asyncio.sleep(1.0)
+            return model
+        # Ignores cancellation long enough to return a result anyway
+        try:
+            await asyncio.sleep(1.0)
+        except asyncio.CancelledError:
+            return "late"
+        return model
+
+    async def run():
+        task = asyncio.ensure_future(run_hedged("test-cancel", attempt, CHAIN[:2], discard=discard))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert discarded == ["late"]
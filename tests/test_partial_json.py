@@ -0,0 +1,110 @@
+""" Tests for parsing a JSON object while it streams in """
+import json
+import random
+import pytest
+from utils.partial_json import PartialJsonObject
+
+RECIPE = {
+    "name": "Smoke & \"Mirrors\"",
+    "ingredients": ["2 oz Mezcal", "3/4 oz Lime, fresh", "1/2 oz Agave {1:1}"],
+    "directions": ["Shake with ice.", "Strain into a coupe \\ rocks glass."],
+    "glass": "Coupe",
+    "garnish": "Lime wheel, été style \U0001f378",
+    "fun_fact": None,
+    "description": "Line one\nline two\ttabbed, with a comma, a } and a ]",
+}
+
+NESTED = {
+    "plain": 1.5,
+    "flag": True,
+    "nested": {"list": [1, [2, 3], {"x": "]"}], "empty": {}},
+    "matrix": [[1, 2], [], [{"a": [3]}], "text, with [brackets]"],
+    "last": "end",
+}
+
+def feed_all(pieces):
+    parser = PartialJsonObject()
+    for piece in pieces:
+        parser.feed(piece)
+    return parser
+
+def chunks(text, size):
+    return [text[start:start + size] for start in range(0, len(text), size)]
+
+@pytest.mark.parametrize("value", [RECIPE, NESTED])
+@pytest.mark.parametrize("indent", [None, 2])
+def test_whole_object_matches_json_loads(value, indent):
+    text = json.dumps(value, indent=indent, ensure_ascii=False)
+    parser = feed_all([text])
+    assert parser.done
+    assert parser.fields == json.loads(text)
+    assert parser.items == {}
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 16])
+def test_any_chunking_matches_json_loads(size):
+    for value in (RECIPE, NESTED):
+        text = json.dumps(value)
+        assert feed_all(chunks(text, size)).fields == value
+
+def test_random_chunking_matches_json_loads():
+    rng = random.Random(1234)
+    for value in (RECIPE, NESTED):
+        for ensure_ascii in (True, False):
+            text = json.dumps(value, ensure_ascii=ensure_ascii, indent=rng.choice([None, 1]))
+            for _ in range(50):
+                cuts = sorted(rng.sample(range(1, len(text)), rng.randint(1, 40)))
+                pieces = [text[start:end] for start, end in zip([0] + cuts, cuts + [len(text)])]
+                parser = feed_all(pieces)
+                assert parser.done
+                assert parser.fields == value
+
+def test_escaped_quotes_and_backslashes_split_across_chunks():
+    text = json.dumps({"a": 'say \\"hi\\"', "b": "\\", "c": "\""})
+    # Split right after every backslash, where a naive scanner would lose the escape
+    pieces, start = [], 0
+    for index, char in enumerate(text):
+        if char == "\\":
+            pieces.append(text[start:index + 1])
+            start = index + 1
+    pieces.append(text[start:])
+    assert feed_all(pieces).fields == json.loads(text)
+
+def test_fields_complete_one_at_a_time():
+    text = json.dumps({"name": "Negroni", "glass": "Rocks", "garnish": "Orange"})
+    parser = PartialJsonObject()
+    parser.feed(text[:text.index("glass") - 1])
+    # The name is only known to be complete once the comma after it arrives
+    assert parser.fields == {"name": "Negroni"}
+    parser.feed(text[text.index("glass") - 1:-1])
+    assert parser.fields == {"name": "Negroni", "glass": "Rocks"}
+    assert not parser.done
+    assert parser.feed(text[-1:])
+    assert parser.done
+    assert parser.fields["garnish"] == "Orange"
+
+def test_array_items_are_reported_while_the_array_streams():
+    text = json.dumps({"name": "Daiquiri", "ingredients": ["2 oz Rum", {"item": "Lime, [fresh]"}, "Sugar"]})
+    parser = PartialJsonObject()
+    seen = []
+    for char in text:
+        if parser.feed(char):
+            seen.append(parser.snapshot())
+    assert seen[0] == {"name": "Daiquiri"}
+    assert {"name": "Daiquiri", "ingredients": ["2 oz Rum"]} in seen
+    assert {"name": "Daiquiri", "ingredients": ["2 oz Rum", {"item": "Lime, [fresh]"}]} in seen
+    assert seen[-1] == json.loads(text)
+    # Once the array closes it is a completed field rather than items in progress
+    assert parser.items == {}
+
+def test_nested_object_is_decoded_once_closed():
+    text = json.dumps({"nested": {"a": [1, {"b": "}"}]}, "after": 1})
+    parser = PartialJsonObject()
+    parser.feed(text[:text.index("after") - 3])
+    assert parser.snapshot() == {}
+    parser.feed(text[text.index("after") - 3:])
+    assert parser.fields == json.loads(text)
+
+def test_text_before_and_after_the_object_is_ignored():
+    parser = feed_all(["  \n", '{"a": ', '1}', "\n  trailing"])
+    assert parser.done
+    assert parser.fields == {"a": 1}
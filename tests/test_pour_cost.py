@@ -0,0 +1,48 @@
+""" Tests for ingredient parsing and pour costs """
+import pandas as pd
+import pytest
+from models.recipes import Cocktail
+from utils.pour_cost_utils import bottles_depleted, cost_recipes, parse_ingredients
+
+INVENTORY = pd.DataFrame({
+    "Name": ["Bourbon", "Simple Syrup"],
+    "Cost per Unit": [30.0, 6.0],
+    "Volume per Unit (ml)": [750.0, 1000.0],
+})
+
+def make_cocktail(name, ingredients):
+    return Cocktail(
+        name=name, ingredients=ingredients, directions=["Stir."], glass="Rocks", garnish="None",
+        description="A test recipe."
+    )
+
+OLD_FASHIONED = make_cocktail("Old Fashioned", ["2 oz Bourbon", "½ oz Simple Syrup", "2 dashes Angostura"])
+
+def test_parse_ingredients_normalizes_units_to_ml():
+    parsed = parse_ingredients([OLD_FASHIONED])
+    assert parsed["ingredient"].tolist() == ["Bourbon", "Simple Syrup", "Angostura"]
+    assert parsed["quantity"].tolist() == [2.0, 0.5, 2.0]
+    assert parsed["unit"].tolist() == ["oz", "oz", "dash"]
+    assert parsed["ml"].iloc[0] == pytest.approx(2 * 29.5735, rel=1e-3)
+
+def test_cost_recipes_prices_matched_ingredients():
+    row = cost_recipes([OLD_FASHIONED], INVENTORY, n_drinks=10).iloc[0]
+    expected = (2 * 30.0 / 750.0 + 0.5 * 6.0 / 1000.0) * 29.5735
+    assert row["cost_per_drink"] == pytest.approx(expected, rel=1e-3)
+    assert row["cost_for_n_drinks"] == pytest.approx(expected * 10, rel=1e-3)
+    assert row["ingredients"] == 3
+    assert row["uncosted_ingredients"] == 1
+
+def test_cost_recipes_keeps_a_row_for_recipes_without_ingredients():
+    empty = make_cocktail("Empty", [])
+    summary = cost_recipes([empty, OLD_FASHIONED, empty], INVENTORY)
+    assert summary["name"].tolist() == ["Empty", "Old Fashioned", "Empty"]
+    assert summary.loc[0, "cost_per_drink"] == 0.0
+    assert summary.loc[0, "ingredients"] == 0
+    assert cost_recipes([empty], INVENTORY).iloc[0]["uncosted_ingredients"] == 0
+
+def test_bottles_depleted_per_inventory_item():
+    depleted = bottles_depleted([OLD_FASHIONED], INVENTORY, n_drinks=100)
+    bottles = dict(zip(depleted["inventory_item"], depleted["bottles"]))
+    assert bottles["Bourbon"] == pytest.approx(200 * 29.5735 / 750.0, rel=1e-3)
+    assert set(bottles) == {"Bourbon", "Simple Syrup"}
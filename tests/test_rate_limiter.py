@@ -0,0 +1,129 @@
+""" Tests for the token buckets and the priority request scheduler """
+import asyncio
+import time
+import pytest
+from utils.rate_limiter import (
+    ModelLimits, Priority, RequestScheduler, SchedulerBusyError, TokenBucket, listen_for_queue
+)
+
+def test_token_bucket_refills_continuously_up_to_capacity():
+    bucket = TokenBucket(60)
+    bucket.updated = 100.0
+    assert bucket.wait_time(1, 100.0) == 0.0
+    bucket.take(60)
+    # One a second
+    assert bucket.wait_time(1, 100.0) == pytest.approx(1.0)
+    assert bucket.wait_time(1, 101.0) == 0.0
+    bucket.refill(1_000.0)
+    assert bucket.level == 60.0
+
+def test_token_bucket_oversized_requests_go_into_debt():
+    bucket = TokenBucket(60)
+    bucket.updated = 100.0
+    # More than the whole capacity can still be taken from a full bucket
+    assert bucket.wait_time(90, 100.0) == 0.0
+    bucket.take(90)
+    assert bucket.level == -30.0
+    # The next request waits for the debt to refill as well
+    assert bucket.wait_time(10, 100.0) == pytest.approx(40.0)
+
+def test_token_bucket_give_is_capped():
+    bucket = TokenBucket(60)
+    bucket.take(10)
+    bucket.give(100)
+    assert bucket.level == 60.0
+
+def make_scheduler(**limits) -> RequestScheduler:
+    return RequestScheduler({"model": ModelLimits(**limits)}, max_queue=4)
+
+def test_requests_are_granted_by_priority_then_arrival():
+    scheduler = make_scheduler(rpm=6000)
+    granted = []
+
+    async def request(name: str, priority: Priority):
+        await scheduler.acquire("model", priority=priority)
+        granted.append(name)
+
+    async def main():
+        # Hold the queue so every request is waiting before the first is granted
+        scheduler.backoff("model", 0.2)
+        await asyncio.gather(
+            request("batch", Priority.BATCH), request("recipe 1", Priority.RECIPE),
+            request("chat", Priority.CHAT), request("recipe 2", Priority.RECIPE),
+        )
+
+    asyncio.run(main())
+    assert granted == ["chat", "recipe 1", "recipe 2", "batch"]
+
+def test_waiting_requests_report_their_queue_position():
+    scheduler = make_scheduler(rpm=6000)
+    positions = []
+
+    async def main():
+        scheduler.backoff("model", 0.1)
+        with listen_for_queue(lambda position, eta: positions.append(position)):
+            await asyncio.gather(
+                scheduler.acquire("model", priority=Priority.RECIPE),
+                scheduler.acquire("model", priority=Priority.RECIPE),
+            )
+
+    asyncio.run(main())
+    assert 0 in positions and 1 in positions
+
+def test_token_limit_makes_requests_wait():
+    scheduler = make_scheduler(rpm=6000, tpm=600)
+    scheduler.acquire_sync("model", tokens=600)
+    # The bucket refills 10 tokens a second, far longer than the request is willing to wait
+    with pytest.raises(SchedulerBusyError):
+        scheduler.acquire_sync("model", tokens=100, max_wait=0)
+    # The request that gave up is no longer queued
+    assert scheduler.snapshot()["model"]["waiting"] == 0
+
+def test_settle_returns_unused_tokens():
+    scheduler = make_scheduler(rpm=6000, tpm=1000)
+    ticket = scheduler.acquire_sync("model", tokens=800)
+    assert scheduler.snapshot()["model"]["tokens_available"] == pytest.approx(200, abs=1)
+    scheduler.settle(ticket, 300)
+    assert ticket.tokens == 300
+    assert scheduler.snapshot()["model"]["tokens_available"] == pytest.approx(700, abs=1)
+    # Unknown usage leaves the estimate in place
+    scheduler.settle(ticket, None)
+    assert scheduler.snapshot()["model"]["tokens_available"] == pytest.approx(700, abs=1)
+
+def test_settle_charges_requests_that_used_more_than_estimated():
+    scheduler = make_scheduler(rpm=6000, tpm=1000)
+    ticket = scheduler.acquire_sync("model", tokens=100)
+    scheduler.settle(ticket, 600)
+    assert scheduler.snapshot()["model"]["tokens_available"] == pytest.approx(400, abs=1)
+
+def test_full_queue_is_rejected():
+    scheduler = RequestScheduler({"model": ModelLimits(rpm=6000)}, max_queue=1)
+
+    async def main():
+        scheduler.backoff("model", 0.2)
+        waiting = asyncio.create_task(scheduler.acquire("model"))
+        await asyncio.sleep(0)
+        with pytest.raises(SchedulerBusyError):
+            await scheduler.acquire("model")
+        await waiting
+
+    asyncio.run(main())
+
+def test_cancelled_request_leaves_the_queue_and_wakes_the_next():
+    scheduler = make_scheduler(rpm=6000)
+
+    async def main():
+        scheduler.backoff("model", 0.2)
+        head = asyncio.create_task(scheduler.acquire("model", priority=Priority.CHAT))
+        behind = asyncio.create_task(scheduler.acquire("model", priority=Priority.RECIPE))
+        await asyncio.sleep(0.05)
+        head.cancel()
+        ticket = await behind
+        assert head.cancelled()
+        return ticket
+
+    start = time.monotonic()
+    ticket = asyncio.run(main())
+    assert ticket.granted
+    assert time.monotonic() - start >= 0.2
+    assert scheduler.snapshot()["model"]["waiting"] == 0
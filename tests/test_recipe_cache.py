@@ -0,0 +1,75 @@
+""" Tests for the two-tier recipe cache """
+import pytest
+from models.recipes import Cocktail
+from utils import recipe_cache
+from utils.recipe_cache import RecipeCache, normalize_recipe_params
+
+def make_cocktail(name: str) -> Cocktail:
+    return Cocktail(
+        name=name, ingredients=["2 oz Bourbon"], directions=["Stir"], glass="Rocks",
+        garnish="Orange Twist", description="A test recipe"
+    )
+
+class FakeClock:
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake_clock = FakeClock()
+    monkeypatch.setattr(recipe_cache.time, "time", fake_clock)
+    return fake_clock
+
+@pytest.fixture
+def cache(tmp_path, clock):
+    return RecipeCache(str(tmp_path / "recipes.sqlite3"), max_variants=2, ttl_seconds=100)
+
+def test_normalize_recipe_params_folds_case_whitespace_and_empty_values():
+    assert normalize_recipe_params("Frangelico", "Craft", "Any", "None") == \
+        normalize_recipe_params(" frangelico ", "CRAFT", "", "  ")
+    assert normalize_recipe_params("Rum", "Tiki", "Thai", "summer") == "rum|tiki|thai|summer"
+
+def test_miss_then_hit(cache):
+    assert cache.get("rum|tiki||") is None
+    cache.put("rum|tiki||", make_cocktail("Mai Tai"))
+    assert cache.get("rum|tiki||").name == "Mai Tai"
+
+def test_keeps_only_the_newest_variants(cache, clock):
+    for name in ("First", "Second", "Third"):
+        cache.put("key", make_cocktail(name))
+        clock.now += 1
+    seen = {cache.get("key").name for _ in range(50)}
+    assert seen == {"Second", "Third"}
+
+def test_variants_survive_a_restart(cache, tmp_path):
+    cache.put("key", make_cocktail("Stored"))
+    reopened = RecipeCache(str(tmp_path / "recipes.sqlite3"), max_variants=2, ttl_seconds=100)
+    assert reopened.get("key").name == "Stored"
+
+def test_expired_variants_are_not_served(cache, clock, tmp_path):
+    cache.put("key", make_cocktail("Old"))
+    clock.now += 60
+    cache.put("key", make_cocktail("New"))
+    clock.now += 50
+    # The first variant is past its TTL, in memory and on disk
+    assert {cache.get("key").name for _ in range(20)} == {"New"}
+    reopened = RecipeCache(str(tmp_path / "recipes.sqlite3"), max_variants=2, ttl_seconds=100)
+    assert {reopened.get("key").name for _ in range(20)} == {"New"}
+    clock.now += 100
+    assert cache.get("key") is None
+
+def test_memory_tier_is_bounded(tmp_path, clock):
+    cache = RecipeCache(str(tmp_path / "recipes.sqlite3"), max_memory_keys=2)
+    for key in ("a", "b", "c"):
+        cache.put(key, make_cocktail(key))
+    assert list(cache._memory) == ["b", "c"]
+    # The evicted key is still served from disk
+    assert cache.get("a").name == "a"
+
+def test_clear(cache):
+    cache.put("key", make_cocktail("Gone"))
+    cache.clear()
+    assert cache.get("key") is None
@@ -0,0 +1,50 @@
+""" Tests for serving or seeding requests from similar stored recipes """
+import pytest
+from models.recipes import Cocktail
+from utils import cocktail_utils, recipe_index
+from utils.cocktail_utils import _stored_cocktail, get_recipe_hash
+from utils.recipe_cache import RecipeCache
+from utils.recipe_index import INSTANT_MATCH_SCORE, RecipeIndex, find_similar_recipe
+from utils.recipe_library import RecipeLibrary
+
+TIKI_RUM = Cocktail(
+    name="Jungle Bird Redux", ingredients=["2 oz Rum"], directions=["Shake."], glass="Tiki mug",
+    garnish="Pineapple", description="A tiki rum sour."
+)
+
+@pytest.fixture
+def stored(tmp_path, monkeypatch):
+    """ A library and index holding one Rum / Craft / Any / tiki recipe """
+    library = RecipeLibrary(str(tmp_path / "library.sqlite3"))
+    index = RecipeIndex()
+    index.ready.set()
+    monkeypatch.setattr(recipe_index, "get_recipe_library", lambda: library)
+    monkeypatch.setattr(recipe_index, "get_recipe_index", lambda: index)
+    cache = RecipeCache(str(tmp_path / "recipes.sqlite3"))
+    monkeypatch.setattr(cocktail_utils, "get_recipe_cache", lambda: cache)
+    library.save(TIKI_RUM, "Rum", "Craft", "Any", "tiki")
+    library.flush()
+    index.add_cocktail(TIKI_RUM, get_recipe_hash(TIKI_RUM), "Rum", "Craft", "Any", "tiki")
+    return library
+
+def test_reworded_request_is_served_instantly(stored):
+    cocktail, similar = _stored_cocktail(" rum", "CRAFT", "any", "Tiki", fresh=False)
+    assert cocktail == TIKI_RUM
+    assert similar is None
+
+def test_cuisine_mismatch_is_seeded_not_served(stored):
+    similar = find_similar_recipe("Rum", "Craft", "Mexican", "tiki")
+    # The shared theme alone clears the instant threshold
+    assert similar.score >= INSTANT_MATCH_SCORE
+    assert not similar.same_type_and_cuisine
+    cocktail, seed = _stored_cocktail("Rum", "Craft", "Mexican", "tiki", fresh=False)
+    assert cocktail is None
+    assert seed.cocktail == TIKI_RUM
+
+def test_type_mismatch_is_seeded_not_served(stored):
+    cocktail, seed = _stored_cocktail("Rum", "Classic", "Any", "tiki", fresh=False)
+    assert cocktail is None
+    assert seed is not None and seed.cocktail == TIKI_RUM
+
+def test_other_spirits_are_never_matched(stored):
+    assert _stored_cocktail("Gin", "Craft", "Any", "tiki", fresh=False) == (None, None)
@@ -0,0 +1,38 @@
+""" Tests for storing and searching the recipe library """
+import pytest
+from models.recipes import Cocktail
+from utils.recipe_library import RecipeLibrary
+
+def make_cocktail(name, directions="Stir with ice."):
+    return Cocktail(
+        name=name, ingredients=["2 oz Gin"], directions=[directions], glass="Coupe",
+        garnish="Lemon twist", description="A test recipe."
+    )
+
+@pytest.fixture
+def library(tmp_path) -> RecipeLibrary:
+    return RecipeLibrary(str(tmp_path / "library.sqlite3"))
+
+def test_search_ranks_every_match_not_just_the_newest(library):
+    # The oldest recipe is the best match, with the word in its name
+    library.save(make_cocktail("Smoky Negroni"), "Gin", "Craft", "Italian", "smoky")
+    for i in range(1_200):
+        library.save(make_cocktail(f"Drink {i}", "Top with a smoky rinse."), "Gin", "Craft", "Any", "summer")
+    library.flush()
+    results = library.search("smoky", limit=5)
+    assert len(results) == 5
+    assert results[0].name == "Smoky Negroni"
+
+def test_search_filters_by_liquor_and_matches_prefixes(library):
+    library.save(make_cocktail("Rum Punch"), "Rum", "Classic", "Caribbean", "tiki")
+    library.save(make_cocktail("Gin Punch"), "Gin", "Classic", "English", "garden")
+    library.flush()
+    assert {entry.name for entry in library.search("punc")} == {"Rum Punch", "Gin Punch"}
+    assert [entry.name for entry in library.search("punch", liquor="Rum")] == ["Rum Punch"]
+
+def test_browsing_lists_the_newest_first_up_to_the_limit(library):
+    for i in range(5):
+        library.save(make_cocktail(f"Drink {i}"), "Gin")
+    library.flush()
+    assert [entry.name for entry in library.search(limit=3)] == ["Drink 4", "Drink 3", "Drink 2"]
+    assert len(library.search(limit=10)) == 5
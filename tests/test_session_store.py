@@ -0,0 +1,63 @@
+""" Tests for spilling idle chat histories and sharing texts across sessions """
+import threading
+import pytest
+from utils.session_store import ChatHistory, SessionStore
+
+def make_history(n_messages=20):
+    return ChatHistory("chat", [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"Message {i} " + "x" * 200}
+        for i in range(n_messages)
+    ])
+
+@pytest.fixture
+def store(tmp_path) -> SessionStore:
+    return SessionStore(budget_bytes=1_000, spill_dir=str(tmp_path), min_idle_seconds=0.0, max_shared_texts=2)
+
+def test_idle_history_is_spilled_and_reloads_intact(store):
+    idle, active = make_history(), make_history()
+    expected = list(idle)
+    store.attach("idle-session", {"chat_messages": idle})
+    store.attach("active-session", {"chat_messages": active})
+    freed = store.enforce_budget(keep="active-session")
+    assert freed > 0
+    assert idle.spilled and not active.spilled
+    assert store.spills == 1
+    # Reading the history back loads it from disk unchanged
+    assert list(idle) == expected
+    assert not idle.spilled and idle.nbytes == freed
+
+def test_busy_and_empty_histories_are_not_counted_as_spills(store):
+    busy, empty = make_history(), ChatHistory()
+    store.attach("busy-session", {"chat_messages": busy, "other_messages": empty})
+    held, release = threading.Event(), threading.Event()
+
+    def hold_lock():
+        # Stands in for the session's script reading its history
+        with busy._lock:
+            held.set()
+            release.wait()
+
+    thread = threading.Thread(target=hold_lock)
+    thread.start()
+    held.wait()
+    try:
+        assert store.enforce_budget() == 0
+    finally:
+        release.set()
+        thread.join()
+    assert not busy.spilled
+    assert store.spills == 0
+
+def test_recently_used_histories_are_kept(tmp_path):
+    store = SessionStore(budget_bytes=1_000, spill_dir=str(tmp_path), min_idle_seconds=60.0)
+    history = make_history()
+    store.attach("session", {"chat_messages": history})
+    assert store.enforce_budget() == 0
+    assert not history.spilled
+
+def test_share_text_returns_one_copy_and_stays_bounded(store):
+    first = "".join(["guide ", "one"])
+    assert store.share_text("guide one") is store.share_text(first)
+    store.share_text("guide two")
+    store.share_text("guide three")
+    assert store.report()["shared_texts"] == 2
@@ -0,0 +1,76 @@
+""" Tests for streaming a recipe with a backup from the next model """
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+import pytest
+from pydantic import ValidationError
+from models.recipes import Cocktail
+from utils import cocktail_utils
+from utils.cocktail_utils import stream_cocktail
+from utils.model_chain import ModelStep
+
+BACKUP_RECIPE = Cocktail(
+    name="Backup Daiquiri", ingredients=["2 oz Rum", "1 oz Lime"], directions=["Shake."], glass="Coupe",
+    garnish="Lime wheel", description="Written by the backup model."
+)
+
+# A recipe cut off part way, as when the model hits its token limit
+TRUNCATED = json.dumps({"name": "Cut Short", "ingredients": ["2 oz Rum"], "directions": ["Shake."]})[:-1]
+
+class FakeStream:
+    """ A started recipe stream that yields its texts and then ends """
+    def __init__(self, texts):
+        self.call = SimpleNamespace(model="primary", start=time.perf_counter())
+        self._texts = texts
+
+    async def texts(self):
+        for text in self._texts:
+            await asyncio.sleep(0.01)
+            yield text
+
+@pytest.fixture
+def recipe_models(monkeypatch):
+    """ Stubs out the stored recipes and the models, returning the backup's calls """
+    backup_calls = []
+
+    async def parse_cocktail(model, messages, priority):
+        backup_calls.append(model)
+        await asyncio.sleep(0.1)
+        return BACKUP_RECIPE
+
+    monkeypatch.setattr(cocktail_utils, "_stored_cocktail", lambda *args: (None, None))
+    monkeypatch.setattr(cocktail_utils, "_remember_cocktail", lambda *args: None)
+    monkeypatch.setattr(cocktail_utils, "_parse_cocktail", parse_cocktail)
+    return backup_calls
+
+def use_stream(monkeypatch, texts, backup_after):
+    async def run_hedged(call_type, attempt, chain, discard):
+        return FakeStream(texts)
+
+    chain = (ModelStep("primary"), ModelStep("backup", hedge_after=backup_after))
+    monkeypatch.setattr(cocktail_utils, "run_hedged", run_hedged)
+    monkeypatch.setattr(cocktail_utils, "get_model_chain", lambda call_type: chain)
+
+async def collect(stream):
+    return [progress async for progress in stream]
+
+def test_truncated_stream_waits_for_the_backup(monkeypatch, recipe_models):
+    use_stream(monkeypatch, [TRUNCATED[:20], TRUNCATED[20:]], backup_after=0.0)
+    progress = asyncio.run(collect(stream_cocktail("Rum", "Classic", "Cuban", "summer")))
+    assert recipe_models == ["backup"]
+    # The fields streamed before the cut are still shown, then replaced by the backup
+    assert progress[0].fields["name"] == "Cut Short"
+    assert progress[-1].cocktail == BACKUP_RECIPE
+
+def test_truncated_stream_without_a_backup_raises(monkeypatch, recipe_models):
+    use_stream(monkeypatch, [TRUNCATED], backup_after=None)
+    with pytest.raises(ValidationError):
+        asyncio.run(collect(stream_cocktail("Rum", "Classic", "Cuban", "summer")))
+    assert recipe_models == []
+
+def test_finished_stream_wins_over_a_slower_backup(monkeypatch, recipe_models):
+    text = BACKUP_RECIPE.model_copy(update={"name": "Streamed Daiquiri"}).model_dump_json(exclude_none=True)
+    use_stream(monkeypatch, [text[:30], text[30:]], backup_after=0.0)
+    progress = asyncio.run(collect(stream_cocktail("Rum", "Classic", "Cuban", "summer")))
+    assert progress[-1].cocktail.name == "Streamed Daiquiri"
@@ -0,0 +1,24 @@
+""" Tests for reading a prefetched training guide while it is written """
+import threading
+import time
+from utils.training_utils import PrefetchedGuide
+
+def test_wait_returns_when_a_chunk_arrives():
+    guide = PrefetchedGuide("hash")
+    threading.Timer(0.05, guide.add, args=("Shake ",)).start()
+    start = time.monotonic()
+    assert guide.wait(0, timeout=5.0)
+    assert time.monotonic() - start < 1.0
+    assert guide.text == "Shake "
+    # Already past the chunks seen, so it waits for the next one
+    assert not guide.wait(1, timeout=0.05)
+
+def test_wait_returns_when_the_guide_ends():
+    guide = PrefetchedGuide("hash")
+    guide.add("Stir")
+    threading.Timer(0.05, guide.mark_done, args=("boom",)).start()
+    assert guide.wait(1, timeout=5.0)
+    assert guide.done
+    assert guide.error == "boom"
+    # A finished guide never blocks
+    assert guide.wait(1, timeout=None)
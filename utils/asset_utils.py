@@ -0,0 +1,84 @@
+""" Build step and cached loader for the static page images in resources/
+
+Run "python -m utils.asset_utils" to (re)build the optimized variants ahead of
+a deploy.  Pages build any missing variant lazily on first use.
+"""
+import os
+import logging
+import argparse
+import tempfile
+from functools import lru_cache
+from PIL import Image, features
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+RESOURCES_DIR = "./resources"
+OPTIMIZED_DIR = os.path.join(RESOURCES_DIR, "optimized")
+
+# Asset name -> (source file in resources/, longest edge in pixels)
+# Hero images fill a half-width column on the home page, so 640px covers 2x displays
+ASSET_VARIANTS = {
+    "cocktail_hero": ("cocktail_pic.png", 640),
+    "bartenders_hero": ("bartenders.png", 640),
+    "mixologist_avatar": ("mixologist1.png", 96),
+    "cocktail_icon": ("cocktail_pic.png", 64),
+    # Shown in place of a cocktail image that could not be generated
+    "cocktail_placeholder": ("cocktail_pic.png", 512),
+    "bartenders_icon": ("bartenders.png", 64),
+}
+
+_IMAGE_FORMAT = "WEBP" if features.check("webp") else "PNG"
+
+def get_asset_path(name: str) -> str:
+    """ Get the path of an optimized asset, building it if needed """
+    source_name, _ = ASSET_VARIANTS[name]
+    source_path = os.path.join(RESOURCES_DIR, source_name)
+    asset_path = os.path.join(OPTIMIZED_DIR, f"{name}.{_IMAGE_FORMAT.lower()}")
+    if (not os.path.exists(asset_path)
+            or os.path.getmtime(asset_path) < os.path.getmtime(source_path)):
+        build_asset(name)
+    return asset_path
+
+def build_asset(name: str) -> str:
+    """ Build a single optimized asset from its source image """
+    source_name, size = ASSET_VARIANTS[name]
+    source_path = os.path.join(RESOURCES_DIR, source_name)
+    asset_path = os.path.join(OPTIMIZED_DIR, f"{name}.{_IMAGE_FORMAT.lower()}")
+    os.makedirs(OPTIMIZED_DIR, exist_ok=True)
+    with Image.open(source_path) as image:
+        image.thumbnail((size, size), Image.LANCZOS)
+        # A temp file per call, since sessions on other threads may build the same asset
+        fd, tmp_path = tempfile.mkstemp(dir=OPTIMIZED_DIR, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                if _IMAGE_FORMAT == "WEBP":
+                    image.save(f, format="WEBP", quality=82, method=6)
+                else:
+                    image.save(f, format="PNG", optimize=True)
+            os.replace(tmp_path, asset_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    logger.debug("Built asset %s (%d bytes)", asset_path, os.path.getsize(asset_path))
+    return asset_path
+
+def build_assets(force: bool = False):
+    """ Build every optimized asset, skipping those that are up to date """
+    for name in ASSET_VARIANTS:
+        if force:
+            build_asset(name)
+        else:
+            get_asset_path(name)
+
+@lru_cache(maxsize=None)
+def load_asset(name: str) -> bytes:
+    """ Load an optimized asset once per process so every session shares the same bytes """
+    with open(get_asset_path(name), "rb") as f:
+        return f.read()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the optimized page images.")
+    parser.add_argument("--force", action="store_true", help="Rebuild assets that are up to date")
+    build_assets(force=parser.parse_args().force)
@@ -0,0 +1,108 @@
+""" Batch cocktail generation for clearing out several bottles at once """
+import io
+import json
+import time
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import AsyncIterator, Iterable, List, Optional
+import pandas as pd
+from models.recipes import Cocktail
+from utils.cocktail_utils import create_cocktail
+from utils.rate_limiter import Priority
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class BatchItem:
+    """ A single recipe request within a batch """
+    liquor: str
+    cocktail_type: str
+    cuisine: str
+    theme: str
+    variant: int = 0
+
+@dataclass
+class BatchResult:
+    """ The outcome of a single recipe request within a batch """
+    item: BatchItem
+    cocktail: Optional[Cocktail] = None
+    error: Optional[str] = None
+    elapsed: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        """ Whether the request produced a recipe """
+        return self.cocktail is not None
+
+def build_batch_items(
+    liquors: Iterable[str], recipes_per_item: int = 1, cocktail_type: str = "Craft",
+    cuisine: str = "Any", theme: str = "None"
+) -> List[BatchItem]:
+    """ Build the recipe requests for every liquor in the batch """
+    return [
+        BatchItem(liquor, cocktail_type, cuisine, theme, variant)
+        for liquor in liquors
+        for variant in range(recipes_per_item)
+    ]
+
+async def _generate_item(
+    item: BatchItem, semaphore: asyncio.Semaphore, fresh: bool
+) -> BatchResult:
+    """ Generate the recipe for a single batch item under the concurrency limit """
+    async with semaphore:
+        start = time.perf_counter()
+        try:
+            # Only the first variant may come from the cache, the rest need new recipes
+            cocktail = await create_cocktail(
+                liqour=item.liquor, type=item.cocktail_type, cuisine=item.cuisine,
+                theme=item.theme, fresh=fresh or item.variant > 0, priority=Priority.BATCH
+            )
+            error = None if cocktail else "No recipe was returned"
+        except Exception as e:
+            logger.error("Error generating batch recipe for %s: %s", item.liquor, e)
+            cocktail, error = None, str(e)
+        return BatchResult(item, cocktail, error, time.perf_counter() - start)
+
+async def generate_batch(
+    items: List[BatchItem], concurrency: int = 5, fresh: bool = False
+) -> AsyncIterator[BatchResult]:
+    """ Generate recipes for every item with at most `concurrency` requests in flight,
+    yielding each result as soon as it completes.  Failed items are yielded with an
+    error instead of aborting the batch. """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    tasks = [asyncio.create_task(_generate_item(item, semaphore, fresh)) for item in items]
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            yield await next_result
+    finally:
+        for task in tasks:
+            task.cancel()
+
+def batch_results_to_json(results: Iterable[BatchResult]) -> str:
+    """ Export the successful batch recipes as a json list """
+    return json.dumps([
+        {"liquor": result.item.liquor, **result.cocktail.model_dump()}
+        for result in results if result.ok
+    ], indent=2)
+
+def batch_results_to_csv(results: Iterable[BatchResult]) -> str:
+    """ Export the successful batch recipes as a csv menu sheet """
+    rows = [
+        {
+            "Liquor": result.item.liquor,
+            "Name": result.cocktail.name,
+            "Ingredients": "; ".join(result.cocktail.ingredients),
+            "Directions": " ".join(result.cocktail.directions),
+            "Glass": result.cocktail.glass,
+            "Garnish": result.cocktail.garnish,
+            "Description": result.cocktail.description,
+            "Fun Fact": result.cocktail.fun_fact or "",
+        }
+        for result in results if result.ok
+    ]
+    buffer = io.StringIO()
+    pd.DataFrame(rows).to_csv(buffer, index=False)
+    return buffer.getvalue()
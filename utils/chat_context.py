@@ -0,0 +1,189 @@
+""" Token-budgeted chat context with a rolling summary of older turns """
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+from openai import OpenAIError
+from dependencies import OPENAI_TIMEOUTS, get_openai_client
+from utils.circuit_breaker import CircuitOpenError, get_circuit_breakers
+
+try:
+    import tiktoken
+except ImportError:  # Fall back to a character based estimate
+    tiktoken = None
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Tokens the chat format adds around every message
+_MESSAGE_OVERHEAD_TOKENS = 4
+
+@lru_cache(maxsize=None)
+def _get_encoding():
+    """ Get the tokenizer used by the gpt-4o family, if tiktoken is installed """
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as e:  # The encoding download can fail offline
+        logger.warning("Falling back to estimated token counts: %s", e)
+        return None
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    """ Count the tokens in a piece of text, locally """
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text))
+
+def count_message_tokens(messages: List[Dict[str, str]]) -> int:
+    """ Count the prompt tokens for a list of chat messages """
+    return sum(count_tokens(message["content"] or "") + _MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+def _fingerprint(messages: List[Dict[str, str]]) -> str:
+    """ Stable hash of a run of chat messages """
+    digest = hashlib.sha256()
+    for message in messages:
+        digest.update(message["role"].encode())
+        digest.update(b"\0")
+        digest.update((message["content"] or "").encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+@dataclass(frozen=True)
+class RollingSummary:
+    """ Summary of the first folded_count messages of a conversation """
+    folded_count: int = 0
+    text: str = ""
+    fingerprint: str = ""
+
+class ChatContextManager:
+    """ Builds the messages for each chat request within a fixed prompt token budget.
+    Recent turns are sent verbatim, and turns that no longer fit are folded into a
+    rolling summary so prompt size stays flat however long the conversation runs. """
+    def __init__(
+        self, max_prompt_tokens: int = 3000, summary_max_tokens: int = 300,
+        min_recent_messages: int = 2, fold_batch: int = 6, summary_model: str = "gpt-4o-mini"
+    ):
+        self.max_prompt_tokens = max_prompt_tokens
+        self.summary_max_tokens = summary_max_tokens
+        self.min_recent_messages = min_recent_messages
+        self.fold_batch = fold_batch
+        self.summary_model = summary_model
+        self._summary_cache: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _summary_message(self, summary: RollingSummary) -> List[Dict[str, str]]:
+        """ The system message carrying the summary, if there is one """
+        if not summary.text:
+            return []
+        return [{
+            "role": "system",
+            "content": f"Summary of the earlier conversation with the user: {summary.text}"
+        }]
+
+    def _window_start(self, history: List[Dict[str, str]], start: int, budget: int) -> int:
+        """ Index of the oldest message, at or after start, that fits in the budget when
+        walking back from the newest message """
+        used = 0
+        index = len(history)
+        while index > start:
+            message_tokens = count_message_tokens([history[index - 1]])
+            if used + message_tokens > budget and len(history) - index >= self.min_recent_messages:
+                break
+            used += message_tokens
+            index -= 1
+        return index
+
+    def _summarize(self, previous: str, messages: List[Dict[str, str]]) -> str:
+        """ Fold messages into the previous summary, reusing any identical earlier fold """
+        cache_key = _fingerprint([{"role": "summary", "content": previous}] + messages)
+        with self._lock:
+            if cache_key in self._summary_cache:
+                self._summary_cache.move_to_end(cache_key)
+                return self._summary_cache[cache_key]
+        transcript = "\n".join(f'{m["role"]}: {m["content"]}' for m in messages)
+        # Imported here since the scheduler and metrics count tokens with this module
+        from utils.metrics import track_call
+        from utils.rate_limiter import Priority, get_request_scheduler
+        get_circuit_breakers().check("chat_summary", self.summary_model)
+        scheduler = get_request_scheduler()
+        ticket = scheduler.acquire_sync(
+            self.summary_model,
+            count_tokens(transcript) + count_tokens(previous) + self.summary_max_tokens + 100,
+            Priority.CHAT
+        )
+        with track_call("chat_summary", self.summary_model, queued=ticket.waited) as call:
+            response = get_openai_client(timeout=OPENAI_TIMEOUTS["summary"]).chat.completions.create(
+                model=self.summary_model,
+                messages=[{
+                    "role": "system",
+                    "content": f"""Update the running summary of a conversation between a bar
+                    professional and a master mixologist.  Keep every fact, preference, recipe
+                    detail and open question that later answers may depend on, and be concise.
+                    Current summary: {previous or "(none)"}
+                    New messages:
+                    {transcript}"""
+                }],
+                temperature=0.2,
+                max_tokens=self.summary_max_tokens,
+            )
+            call.set_usage(response.usage)
+        scheduler.settle(ticket, response.usage.total_tokens if response.usage else None)
+        summary_text = response.choices[0].message.content or previous
+        with self._lock:
+            self._summary_cache[cache_key] = summary_text
+            while len(self._summary_cache) > 512:
+                self._summary_cache.popitem(last=False)
+        return summary_text
+
+    def build_messages(
+        self, system_message: Dict[str, str], history: List[Dict[str, str]],
+        summary: Optional[RollingSummary] = None
+    ) -> Tuple[List[Dict[str, str]], RollingSummary]:
+        """ Build the messages for the next request from the system message and the full
+        user / assistant history.  Returns the messages and the updated summary, which the
+        caller keeps for the next turn. """
+        summary = summary or RollingSummary()
+        # Start over if the history no longer begins with what the summary covers
+        if (summary.folded_count > len(history)
+                or _fingerprint(history[:summary.folded_count]) != summary.fingerprint):
+            summary = RollingSummary(fingerprint=_fingerprint([]))
+
+        fixed_tokens = count_message_tokens([system_message])
+        budget = self.max_prompt_tokens - fixed_tokens - self.summary_max_tokens
+        start = self._window_start(history, summary.folded_count, budget)
+        if start > summary.folded_count:
+            # Fold at least fold_batch messages at a time so summaries are not redone every turn
+            fold_end = min(
+                max(start, summary.folded_count + self.fold_batch),
+                len(history) - self.min_recent_messages
+            )
+            fold_end = max(fold_end, start)
+            try:
+                summary_text = self._summarize(summary.text, history[summary.folded_count:fold_end])
+            except (OpenAIError, CircuitOpenError) as e:
+                logger.error("Error summarizing chat history, dropping older turns: %s", e)
+                summary_text = summary.text
+            summary = RollingSummary(
+                folded_count=fold_end, text=summary_text,
+                fingerprint=_fingerprint(history[:fold_end])
+            )
+            start = fold_end
+
+        messages = [system_message] + self._summary_message(summary) + history[start:]
+        logger.debug(
+            "Chat context: %d of %d messages verbatim, %d tokens",
+            len(history) - start, len(history), count_message_tokens(messages)
+        )
+        return messages, summary
+
+@lru_cache(maxsize=None)
+def get_chat_context_manager() -> ChatContextManager:
+    """ Get the process-wide chat context manager, so summaries are shared across sessions """
+    return ChatContextManager()
@@ -0,0 +1,222 @@
+""" Circuit breakers per call type and model, so a degraded OpenAI endpoint fails fast
+instead of holding a script thread for a full timeout on every request.
+
+Every finished model call is recorded against its breaker.  Once enough of the recent
+calls failed, or were slow to answer, the breaker opens and calls are refused at once
+with CircuitOpenError, which the pages turn into degraded results.  After open_seconds
+a single probe call is let through: if it succeeds the breaker closes again, otherwise
+it stays open.  Set BARGURU_CIRCUIT_BREAKERS to override the settings per call type, e.g.
+{"image": {"failure_rate": 0.3, "open_seconds": 120}}
+"""
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass, fields, replace
+from enum import Enum
+from functools import lru_cache
+from typing import Deque, Dict, List, Optional, Tuple
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+class BreakerState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+@dataclass(frozen=True)
+class BreakerSettings:
+    """ When a breaker opens and for how long.  A call counts as slow when its first
+    token, or its whole answer for calls that do not stream, takes slow_call_seconds. """
+    window: int = 20
+    min_calls: int = 5
+    failure_rate: float = 0.5
+    slow_call_seconds: float = 30.0
+    slow_call_rate: float = 0.8
+    open_seconds: float = 30.0
+
+DEFAULT_BREAKER_SETTINGS: Dict[str, BreakerSettings] = {
+    "recipe": BreakerSettings(slow_call_seconds=30.0),
+    "image": BreakerSettings(window=10, min_calls=3, slow_call_seconds=60.0, open_seconds=60.0),
+    "training": BreakerSettings(slow_call_seconds=20.0),
+    "chat": BreakerSettings(slow_call_seconds=10.0, open_seconds=20.0),
+    "chat_summary": BreakerSettings(slow_call_seconds=15.0),
+}
+
+# Client errors are our own request's fault, not a sign the endpoint is unwell
+_HEALTHY_STATUS_CODES = frozenset(range(400, 500)) - {408, 409, 429}
+
+class CircuitOpenError(RuntimeError):
+    """ Raised instead of making a call while its breaker is open """
+    def __init__(self, call_type: str, model: str, retry_in: float):
+        super().__init__(
+            f"{call_type} calls to {model} are paused after repeated failures, "
+            f"retrying in {max(1, round(retry_in))}s"
+        )
+        self.call_type = call_type
+        self.model = model
+        self.retry_in = retry_in
+
+def is_failure(error: Optional[BaseException]) -> bool:
+    """ Whether a call's error counts against its endpoint's health """
+    if error is None:
+        return False
+    return getattr(error, "status_code", None) not in _HEALTHY_STATUS_CODES
+
+class CircuitBreaker:
+    """ Closed, open or half open breaker for one call type and model, judged on a
+    sliding window of its most recent calls """
+    def __init__(self, call_type: str, model: str, settings: BreakerSettings):
+        self.call_type = call_type
+        self.model = model
+        self.settings = settings
+        self.state = BreakerState.CLOSED
+        # (failed, slow) for each of the most recent calls
+        self._outcomes: Deque[Tuple[bool, bool]] = deque(maxlen=settings.window)
+        self._opened_at = 0.0
+        self._probe_started: Optional[float] = None
+        self.times_opened = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def retry_in(self, now: Optional[float] = None) -> float:
+        """ Seconds until the next probe is let through, 0 if calls are allowed """
+        now = time.monotonic() if now is None else now
+        if self.state is BreakerState.CLOSED:
+            return 0.0
+        if self.state is BreakerState.OPEN:
+            return max(0.0, self._opened_at + self.settings.open_seconds - now)
+        if self._probe_started is None:
+            return 0.0
+        # A probe that never reported back is given up on after open_seconds
+        return max(0.0, self._probe_started + self.settings.open_seconds - now)
+
+    def allow(self) -> bool:
+        """ Whether a call may be made now.  Once an open breaker has waited out
+        open_seconds, the next caller is let through as the probe. """
+        now = time.monotonic()
+        with self._lock:
+            if self.state is BreakerState.CLOSED:
+                return True
+            if self.retry_in(now) > 0:
+                self.rejected += 1
+                return False
+            if self.state is BreakerState.OPEN:
+                self.state = BreakerState.HALF_OPEN
+                logger.info("Probing %s calls to %s", self.call_type, self.model)
+            self._probe_started = now
+            return True
+
+    def check(self):
+        """ Raise CircuitOpenError unless a call may be made now """
+        if not self.allow():
+            raise CircuitOpenError(self.call_type, self.model, self.retry_in())
+
+    def record(self, latency: float, error: Optional[BaseException] = None):
+        """ Count a finished call, opening or closing the breaker as its health changes """
+        failed = is_failure(error)
+        slow = latency >= self.settings.slow_call_seconds
+        with self._lock:
+            if self.state is BreakerState.HALF_OPEN:
+                if failed or slow:
+                    self._open("the probe call failed" if failed else "the probe call was slow")
+                else:
+                    self.state = BreakerState.CLOSED
+                    self._outcomes.clear()
+                    self._probe_started = None
+                    logger.info("%s calls to %s have recovered", self.call_type, self.model)
+                return
+            if self.state is BreakerState.OPEN:
+                return  # A call started before the breaker opened
+            self._outcomes.append((failed, slow))
+            if len(self._outcomes) < self.settings.min_calls:
+                return
+            failure_rate = sum(f for f, _ in self._outcomes) / len(self._outcomes)
+            slow_rate = sum(s for _, s in self._outcomes) / len(self._outcomes)
+            if failure_rate >= self.settings.failure_rate:
+                self._open(f"{failure_rate:.0%} of recent calls failed")
+            elif slow_rate >= self.settings.slow_call_rate:
+                self._open(f"{slow_rate:.0%} of recent calls were slow")
+
+    def _open(self, reason: str):
+        """ Refuse calls for open_seconds.  Call with the lock held. """
+        self.state = BreakerState.OPEN
+        self._opened_at = time.monotonic()
+        self._probe_started = None
+        self._outcomes.clear()
+        self.times_opened += 1
+        logger.warning(
+            "Pausing %s calls to %s for %.0fs: %s", self.call_type, self.model,
+            self.settings.open_seconds, reason
+        )
+
+    def snapshot(self) -> Dict:
+        """ The breaker's state, for display """
+        with self._lock:
+            outcomes = list(self._outcomes)
+            return {
+                "call_type": self.call_type, "model": self.model, "state": self.state.value,
+                "retry_in": round(self.retry_in(), 1),
+                "recent_calls": len(outcomes),
+                "recent_failures": sum(f for f, _ in outcomes),
+                "recent_slow": sum(s for _, s in outcomes),
+                "times_opened": self.times_opened, "rejected": self.rejected,
+            }
+
+class CircuitBreakers:
+    """ The breakers of every call type and model, created on first use """
+    def __init__(
+        self, settings: Optional[Dict[str, BreakerSettings]] = None,
+        default_settings: BreakerSettings = BreakerSettings()
+    ):
+        self.settings = dict(DEFAULT_BREAKER_SETTINGS if settings is None else settings)
+        self.default_settings = default_settings
+        self._breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, call_type: str, model: str) -> CircuitBreaker:
+        breaker = self._breakers.get((call_type, model))
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get((call_type, model))
+                if breaker is None:
+                    breaker = self._breakers[(call_type, model)] = CircuitBreaker(
+                        call_type, model, self.settings.get(call_type, self.default_settings)
+                    )
+        return breaker
+
+    def check(self, call_type: str, model: str):
+        """ Raise CircuitOpenError unless a call_type call to model may be made now """
+        self.get(call_type, model).check()
+
+    def record(self, call_type: str, model: str, latency: float, error: Optional[BaseException] = None):
+        """ Count a finished call against its breaker """
+        self.get(call_type, model).record(latency, error)
+
+    def snapshot(self) -> List[Dict]:
+        """ One row per breaker """
+        with self._lock:
+            breakers = sorted(self._breakers.items())
+        return [breaker.snapshot() for _, breaker in breakers]
+
+def _settings_from_env() -> Dict[str, BreakerSettings]:
+    """ Default settings, overridden per call type by BARGURU_CIRCUIT_BREAKERS """
+    settings = dict(DEFAULT_BREAKER_SETTINGS)
+    overrides = os.getenv("BARGURU_CIRCUIT_BREAKERS")
+    if overrides:
+        names = {field.name for field in fields(BreakerSettings)}
+        for call_type, values in json.loads(overrides).items():
+            settings[call_type] = replace(
+                settings.get(call_type, BreakerSettings()),
+                **{name: value for name, value in values.items() if name in names}
+            )
+    return settings
+
+@lru_cache(maxsize=None)
+def get_circuit_breakers() -> CircuitBreakers:
+    """ Get the process-wide circuit breakers shared by every session """
+    return CircuitBreakers(_settings_from_env())
@@ -0,0 +1,42 @@
+""" The choices offered when creating a cocktail, shared by the pages and the warm-up job """
+
+# Commnonly used spirits that the user can choose from
+SPIRITS = [
+    # Basic spirits
+    "Vodka", "Gin", "Rum", "Tequila", "Mezcal", "Brandy", "Whiskey", "Scotch",
+    "Bourbon", "Rye Whiskey", "Irish Whiskey", "Canadian Whisky", "Japanese Whisky",
+    "Cognac", "Armagnac", "Calvados", "Pisco", "Grappa", "Sake", "Soju", "Shochu",
+
+    # Liqueurs & Cordials
+    "Amaretto", "Baileys Irish Cream", "Benedictine", "Chartreuse (Green)",
+    "Chartreuse (Yellow)", "Cointreau", "Drambuie", "Frangelico", "Galliano",
+    "Grand Marnier", "Jägermeister", "Kahlua", "Limoncello", "Sambuca",
+    "Southern Comfort", "St. Germain (Elderflower Liqueur)", "Tia Maria",
+    "Chambord", "Aperol", "Campari", "Fernet Branca", "Pimm's No. 1",
+
+    # Vermouths & Amaro
+    "Sweet Vermouth", "Dry Vermouth", "Red Vermouth", "White Vermouth", "Amaro Montenegro",
+    "Amaro Nonino", "Averna", "Cynar", "Ramazzotti", "Zucca", "Amaro Lucano",
+
+    # Flavored Spirits
+    "Absinthe", "Anisette", "Aquavit", "Arak", "Bitters", "Ouzo", "Schnapps",
+    "Flavored Vodka", "Spiced Rum", "Peach Schnapps", "Peppermint Schnapps",
+
+    # Other
+    "Moonshine", "Everclear", "Fireball", "Malibu (Coconut Rum)",
+    "Margarita Mix", "Bloody Mary Mix", "Other"
+]
+
+COCKTAIL_TYPES = ["Classic", "Craft", "Standard"]
+
+# Cuisines a cocktail can be paired with
+CUISINES = [
+    'Any', 'American', 'Mexican', 'Italian', 'French', 'Chinese', 'Japanese', 'Thai', 'Indian',
+    'Greek', 'Spanish', 'Korean', 'Vietnamese', 'Mediterranean', 'Middle Eastern', 'Caribbean',
+    'British', 'German', 'Irish', 'African', 'Moroccan', 'Nordic', 'Eastern European',
+    'Jewish', 'South American', 'Central American', 'Australian',
+    'New Zealand', 'Pacific Islands', 'Canadian', 'Other'
+]
+
+# The theme the create page starts with
+DEFAULT_THEME = "None"
@@ -1,19 +1,87 @@
 """ Cocktail helper functions """
+import time
+import asyncio
+import hashlib
 import logging
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List, Optional, Type
 from openai import OpenAIError
+from pydantic import BaseModel
 from models.recipes import Cocktail
-from dependencies import get_openai_client
-
-# Load the OpenAI client
-client = get_openai_client()
+from dependencies import OPENAI_TIMEOUTS, get_async_openai_client
+from utils.circuit_breaker import get_circuit_breakers
+from utils.recipe_cache import get_recipe_cache, normalize_recipe_params
+from utils.metrics import track_call
+from utils.model_chain import get_model_chain, run_hedged
+from utils.partial_json import PartialJsonObject
+from utils.rate_limiter import Priority, estimate_request_tokens, get_request_scheduler
+from utils.render_utils import render_recipe
+from utils.streaming_utils import ChatStream, open_chat_stream
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
 logging.getLogger("openai").setLevel(logging.ERROR)
 logger = logging.getLogger(__name__)
 
-async def create_cocktail(liqour : str, type: str, cuisine: str, theme: str):
-    """ Create a cocktail recipe """
+# Typical size of a structured recipe response, charged against the tokens per minute limit
+_RECIPE_OUTPUT_TOKENS = 600
+# Cap on a streamed recipe, well above a typical one so the JSON is not cut short
+_RECIPE_MAX_TOKENS = 1000
+
+def _strict_response_format(model: Type[BaseModel]) -> Dict[str, Any]:
+    """ The strict JSON schema response format parse() sends for a flat model, for
+    streaming the structured output.  Strict mode needs every property required and no
+    others allowed, so optional fields lose their null default and are always written. """
+    schema = model.model_json_schema()
+    for prop in schema["properties"].values():
+        if "default" in prop and prop["default"] is None:
+            del prop["default"]
+    schema["required"] = list(schema["properties"])
+    schema["additionalProperties"] = False
+    return {"type": "json_schema", "json_schema": {"name": model.__name__, "schema": schema, "strict": True}}
+
+_COCKTAIL_RESPONSE_FORMAT = _strict_response_format(Cocktail)
+
+async def _parse_cocktail(model: str, messages, priority: Priority) -> Optional[Cocktail]:
+    """ Ask one model for a recipe in the Cocktail schema """
+    get_circuit_breakers().check("recipe", model)
+    scheduler = get_request_scheduler()
+    ticket = await scheduler.acquire(
+        model, estimate_request_tokens(messages, _RECIPE_OUTPUT_TOKENS), priority
+    )
+    client = get_async_openai_client(timeout=OPENAI_TIMEOUTS["recipe"])
+    with track_call("recipe", model, queued=ticket.waited) as call:
+        completion = await client.beta.chat.completions.parse(
+            model=model,
+            messages=messages,
+            response_format=Cocktail,
+        )
+        call.set_usage(completion.usage)
+    scheduler.settle(ticket, completion.usage.total_tokens if completion.usage else None)
+    return completion.choices[0].message.parsed
+
+def _stored_cocktail(liqour: str, type: str, cuisine: str, theme: str, fresh: bool):
+    """ A recipe that can be served without calling a model, if there is one, and the
+    most similar stored recipe to give the model as an example otherwise """
+    # Imported here since the library uses get_recipe_hash from this module
+    from utils.recipe_index import INSTANT_MATCH_SCORE, find_similar_recipe
+    cache = get_recipe_cache()
+    cache_key = normalize_recipe_params(liqour, type, cuisine, theme)
+    if not fresh:
+        cached_cocktail = cache.get(cache_key)
+        if cached_cocktail:
+            logger.debug("Recipe cache hit: %s", cache_key)
+            return cached_cocktail, None
+    similar = find_similar_recipe(liqour, type, cuisine, theme)
+    if (similar is not None and not fresh and similar.score >= INSTANT_MATCH_SCORE
+            and similar.same_type_and_cuisine):
+        logger.debug("Serving a similar stored recipe (%.2f) for %s", similar.score, cache_key)
+        cache.put(cache_key, similar.cocktail)
+        return similar.cocktail, None
+    return None, similar
+
+def _recipe_messages(liqour: str, type: str, cuisine: str, theme: str, similar) -> List[Dict[str, str]]:
+    """ Build the prompt for a new recipe, with a similar stored recipe as an example """
     messages = [
         {
             "role": "system",
@@ -23,15 +91,51 @@ async def create_cocktail(liqour : str, type: str, cuisine: str, theme: str):
             innovative, and creative recipe that fits their parameters and the provided schema."""
         }
     ]
+    if similar is not None:
+        messages.append({
+            "role": "system",
+            "content": f"""Here is a recipe we created for a similar request.  Match its level of
+            detail, but create a different cocktail:
+            {similar.cocktail.model_dump_json(exclude_none=True)}"""
+        })
+    return messages
+
+def _remember_cocktail(
+    cocktail: Cocktail, liqour: str, type: str, cuisine: str, theme: str, save: bool = True
+):
+    """ Keep a new recipe in the cache and the similarity index, and unless save is unset
+    in the library """
+    # Imported here since the library uses get_recipe_hash from this module
+    from utils.recipe_library import get_recipe_library
+    from utils.recipe_index import get_recipe_index
+    get_recipe_cache().put(normalize_recipe_params(liqour, type, cuisine, theme), cocktail)
+    if save:
+        get_recipe_library().save(cocktail, liqour, type, cuisine, theme)
+    get_recipe_index().add_cocktail(cocktail, get_recipe_hash(cocktail), liqour, type, cuisine, theme)
+
+async def create_cocktail(
+    liqour : str, type: str, cuisine: str, theme: str, fresh: bool = False,
+    priority: Priority = Priority.RECIPE, save: bool = True
+):
+    """ Create a cocktail recipe.  Identical requests are served from the recipe
+    cache unless fresh is set, in which case a new variant is generated.  Requests
+    wait their turn in the shared scheduler at the given priority, and a slow or failed
+    model is backed up by the next one in the recipe model chain.  A stored recipe made
+    for a near-identical request is served instead of calling the model, and a less
+    similar one is given to the model as an example.  New recipes are saved to the
+    library unless save is unset, for callers that save them with their image. """
+    stored_cocktail, similar = _stored_cocktail(liqour, type, cuisine, theme, fresh)
+    if stored_cocktail is not None:
+        return stored_cocktail
+    messages = _recipe_messages(liqour, type, cuisine, theme, similar)
     try:
         logger.debug("Creating cocktail recipe")
-        completion = client.beta.chat.completions.parse(
-            model="gpt-4o-2024-08-06",
-            messages=messages,
-            response_format=Cocktail,
+        cocktail_response = await run_hedged(
+            "recipe", lambda model: _parse_cocktail(model, messages, priority)
         )
-        cocktail_response = completion.choices[0].message.parsed
         logger.debug("Cocktail Response: %s", cocktail_response)
+        if cocktail_response:
+            _remember_cocktail(cocktail_response, liqour, type, cuisine, theme, save)
         return cocktail_response
 
     except OpenAIError as e:
@@ -44,19 +148,106 @@ async def create_cocktail(liqour : str, type: str, cuisine: str, theme: str):
 
     return None  # Return None or a default response if all models fail
 
-async def convert_recipe_to_text(recipe: Cocktail) -> str:
-    """ Convert a recipe to text """
-    recipe_text = f'''{recipe.name}
+@dataclass
+class RecipeProgress:
+    """ What is known of a recipe while it streams: the completed fields, plus the items
+    of the ingredients or directions completed so far, and the recipe once it is done """
+    fields: Dict[str, Any]
+    cocktail: Optional[Cocktail] = None
+
+async def stream_cocktail(
+    liqour : str, type: str, cuisine: str, theme: str, fresh: bool = False,
+    priority: Priority = Priority.RECIPE, save: bool = True
+) -> AsyncIterator[RecipeProgress]:
+    """ Like create_cocktail, but streams the structured output and yields the recipe's
+    progress each time a field or list item completes, so it can be shown long before
+    the whole recipe is written.  The last progress carries the validated recipe.  Raises
+    if no model could write it.
 
-    Ingredients:
-    {recipe.ingredients}
+    The models are raced on their first token.  A stream that started quickly but has not
+    finished within the next model's hedge_after is backed up by a whole recipe from that
+    model, and whichever is done first is used, so the last progress may carry a
+    different recipe from the fields streamed before it. """
+    stored_cocktail, similar = _stored_cocktail(liqour, type, cuisine, theme, fresh)
+    if stored_cocktail is not None:
+        yield RecipeProgress(stored_cocktail.model_dump(), stored_cocktail)
+        return
+    messages = _recipe_messages(liqour, type, cuisine, theme, similar)
+    chain = get_model_chain("recipe")
+    stream = await run_hedged(
+        "recipe", lambda model: open_chat_stream(
+            "recipe", model, messages, priority, _RECIPE_MAX_TOKENS,
+            response_format=_COCKTAIL_RESPONSE_FORMAT
+        ),
+        chain=chain, discard=ChatStream.aclose
+    )
+    # The next model in the chain backs up a stream that is slow to finish
+    index = [step.model for step in chain].index(stream.call.model) + 1
+    backup_step = chain[index] if index < len(chain) else None
+    backup_at = None
+    if backup_step is not None and backup_step.hedge_after is not None:
+        backup_at = stream.call.start + backup_step.hedge_after
+    parser = PartialJsonObject()
+    texts = stream.texts()
+    next_text: Optional[asyncio.Future] = asyncio.ensure_future(anext(texts))
+    backup: Optional["asyncio.Task[Optional[Cocktail]]"] = None
+    stream_error: Optional[BaseException] = None
+    cocktail = None
+    try:
+        while cocktail is None:
+            waiting = [task for task in (next_text, backup) if task is not None and not task.done()]
+            if not waiting:
+                raise stream_error
+            timeout = None
+            if backup is None and backup_at is not None:
+                timeout = max(0.0, backup_at - time.perf_counter())
+            done, _ = await asyncio.wait(waiting, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                logger.info(
+                    "Recipe from %s still streaming after %.1fs, also asking %s", stream.call.model,
+                    time.perf_counter() - stream.call.start, backup_step.model
+                )
+                backup = asyncio.create_task(_parse_cocktail(backup_step.model, messages, priority))
+                continue
+            if next_text in done:
+                try:
+                    try:
+                        text = next_text.result()
+                    except StopAsyncIteration:
+                        # A truncated or malformed recipe fails like a broken stream, so the backup can still win
+                        cocktail = Cocktail.model_validate(parser.fields)
+                        continue
+                except Exception as e:
+                    if backup is None or backup.done():
+                        raise
+                    logger.warning("Recipe stream from %s failed: %s", stream.call.model, e)
+                    stream_error, next_text = e, None
+                else:
+                    if parser.feed(text):
+                        yield RecipeProgress(parser.snapshot())
+                    next_text = asyncio.ensure_future(anext(texts))
+            if backup in done:
+                if backup.exception() is None and backup.result() is not None:
+                    cocktail = backup.result()
+                else:
+                    logger.warning(
+                        "Backup recipe from %s failed: %s", backup_step.model, backup.exception() or "no result"
+                    )
+    finally:
+        for task in (next_text, backup):
+            if task is not None:
+                task.cancel()
+        # The stream cannot be closed while a read of it is still being cancelled
+        if next_text is not None:
+            await asyncio.gather(next_text, return_exceptions=True)
+        await texts.aclose()
+    _remember_cocktail(cocktail, liqour, type, cuisine, theme, save)
+    yield RecipeProgress(cocktail.model_dump(), cocktail)
 
-    Directions:
-    {recipe.directions}
+async def convert_recipe_to_text(recipe: Cocktail) -> str:
+    """ Convert a recipe to text """
+    return render_recipe(recipe, "text")
 
-    Garnish: {recipe.garnish}
-    Glass: {recipe.glass}
-    Description: {recipe.description}
-    Fun Fact: {recipe.fun_fact}
-    '''
-    return recipe_text
+def get_recipe_hash(recipe: Cocktail) -> str:
+    """ Stable key for a recipe, used to store things generated from it """
+    return hashlib.sha256(recipe.model_dump_json(exclude_none=True).encode()).hexdigest()
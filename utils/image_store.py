@@ -0,0 +1,110 @@
+""" Content-addressed on-disk store for generated cocktail images """
+import io
+import os
+import hashlib
+import logging
+import tempfile
+from functools import lru_cache
+from typing import Optional, Sequence
+import requests
+from requests.adapters import HTTPAdapter
+from PIL import Image, features
+from dependencies import get_cache_dir
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Width of the pre-rendered thumbnail shown in the recipe page column
+DISPLAY_SIZE = 512
+_DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+class ImageStore:
+    """ Stores each image once under the sha256 of its source bytes, along with
+    pre-rendered thumbnails, so that sessions only need to keep the key. """
+    def __init__(
+        self, root: str, thumbnail_sizes: Sequence[int] = (DISPLAY_SIZE,), quality: int = 85
+    ):
+        self.root = root
+        self.thumbnail_sizes = tuple(thumbnail_sizes)
+        self.quality = quality
+        self.image_format = "WEBP" if features.check("webp") else "PNG"
+        self.extension = self.image_format.lower()
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, key: str, size: Optional[int] = None) -> str:
+        """ Get the file path of an image, or of one of its thumbnails """
+        suffix = f"_{size}" if size else ""
+        return os.path.join(self.root, key[:2], f"{key}{suffix}.{self.extension}")
+
+    def exists(self, key: str) -> bool:
+        """ Check whether an image is in the store """
+        return os.path.exists(self.path(key))
+
+    def display_path(self, key: Optional[str], size: int = DISPLAY_SIZE) -> Optional[str]:
+        """ Get the best available path to display an image, or None if it is gone """
+        if not key:
+            return None
+        for candidate in (self.path(key, size), self.path(key)):
+            if os.path.exists(candidate):
+                return candidate
+        return None
+
+    def _write(self, path: str, image: Image.Image):
+        """ Encode an image and move it into place atomically """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                if self.image_format == "WEBP":
+                    image.save(f, format="WEBP", quality=self.quality, method=4)
+                else:
+                    image.save(f, format="PNG", optimize=True)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def put_bytes(self, data: bytes, key: Optional[str] = None) -> str:
+        """ Add an encoded image to the store and return its key """
+        key = key or hashlib.sha256(data).hexdigest()
+        if self.exists(key):
+            return key
+        with Image.open(io.BytesIO(data)) as image:
+            image.load()
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+            for size in self.thumbnail_sizes:
+                if size < max(image.size):
+                    thumbnail = image.copy()
+                    thumbnail.thumbnail((size, size), Image.LANCZOS)
+                    self._write(self.path(key, size), thumbnail)
+            # Write the full image last so exists() implies the thumbnails are there
+            self._write(self.path(key), image)
+        return key
+
+    def put_url(self, url: str, session: Optional[requests.Session] = None) -> str:
+        """ Stream an image from a url into the store and return its key """
+        session = session or get_http_session()
+        digest = hashlib.sha256()
+        buffer = io.BytesIO()
+        with session.get(url, stream=True, timeout=30) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=_DOWNLOAD_CHUNK_SIZE):
+                digest.update(chunk)
+                buffer.write(chunk)
+        return self.put_bytes(buffer.getvalue(), key=digest.hexdigest())
+
+@lru_cache(maxsize=None)
+def get_http_session() -> requests.Session:
+    """ Get a connection-pooled session for downloading generated images """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=2)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+@lru_cache(maxsize=None)
+def get_image_store() -> ImageStore:
+    """ Get the process-wide image store shared by all sessions """
+    return ImageStore(os.path.join(get_cache_dir(), "images"))
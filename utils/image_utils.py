@@ -1,24 +1,30 @@
 """ Service Utilities for Image Generation """
-from PIL import Image
-import requests
-from dependencies import get_openai_client
+import asyncio
+from dependencies import OPENAI_TIMEOUTS, get_async_openai_client
+from utils.circuit_breaker import get_circuit_breakers
+from utils.image_store import get_image_store
+from utils.metrics import track_call
+from utils.rate_limiter import Priority, get_request_scheduler
 
-# Load the OpenAI client
-client = get_openai_client()
-
-async def generate_image(description : str):
-    """ Generate an image from the given image request. """
-    # Generate the image
-    response = client.images.generate(
-        prompt=description,
-        model="dall-e-3",
-        size="1024x1024",
-        quality="standard",
-        n=1
-    )
+async def generate_image(description : str, priority: Priority = Priority.RECIPE) -> str:
+    """ Generate an image from the given image request and return its image store key. """
+    # Fail fast while the image endpoint is down rather than waiting out its timeout
+    get_circuit_breakers().check("image", "dall-e-3")
+    # Generate the image once the shared scheduler allows another image request
+    ticket = await get_request_scheduler().acquire("dall-e-3", priority=priority)
+    client = get_async_openai_client(timeout=OPENAI_TIMEOUTS["image"])
+    with track_call("image", "dall-e-3", queued=ticket.waited) as call:
+        response = await client.images.generate(
+            prompt=description,
+            model="dall-e-3",
+            size="1024x1024",
+            quality="standard",
+            n=1
+        )
+        call.images = len(response.data)
     image_url = response.data[0].url
 
-    # Convert the image url to an image
-    image = Image.open(requests.get(image_url, stream=True).raw)
+    # Stream the image into the store off the event loop so the recipe's other calls keep running
+    image_key = await asyncio.to_thread(get_image_store().put_url, image_url)
 
-    return image
+    return image_key
@@ -0,0 +1,153 @@
+""" In-memory fuzzy search index over the ingredient names in resources/new_ingredients.txt """
+import bisect
+import itertools
+import logging
+import unicodedata
+from collections import defaultdict
+from functools import lru_cache
+from typing import List, Optional, Tuple
+import numpy as np
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+DEFAULT_INGREDIENTS_PATH = "./resources/new_ingredients.txt"
+
+# Rank bonuses so that exact and prefix hits always sort above purely fuzzy ones
+_EXACT_BONUS = 3.0
+_PREFIX_BONUS = 2.0
+_TOKEN_PREFIX_BONUS = 1.0
+
+def normalize_ingredient_text(text: str) -> str:
+    """ Lower case, strip accents and collapse whitespace so lookups are forgiving """
+    decomposed = unicodedata.normalize("NFKD", str(text))
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(stripped.casefold().split())
+
+def _trigrams(text: str) -> List[str]:
+    """ Distinct character trigrams of a normalized string, padded to weight word starts """
+    padded = f"  {text} "
+    return list({padded[i:i + 3] for i in range(len(padded) - 2)})
+
+class IngredientIndex:
+    """ Sorted prefix index plus a trigram inverted index over ingredient names.
+    Queries only touch the posting lists of their own trigrams, never the full list. """
+    def __init__(self, names: List[str]):
+        unique_names = {}
+        for name in names:
+            normalized = normalize_ingredient_text(name)
+            if normalized and normalized not in unique_names:
+                unique_names[normalized] = " ".join(name.split())
+        self.names = list(unique_names.values())
+        self.normalized = list(unique_names.keys())
+
+        # Prefix index on full names and on every word, as sorted (key, id) pairs
+        self._name_keys = sorted((text, i) for i, text in enumerate(self.normalized))
+        self._token_keys = sorted(
+            (token, i) for i, text in enumerate(self.normalized) for token in set(text.split())
+        )
+
+        # Trigram inverted index with the trigram count of every name for scoring
+        postings = defaultdict(list)
+        trigram_counts = np.zeros(len(self.normalized), dtype=np.float32)
+        for i, text in enumerate(self.normalized):
+            grams = _trigrams(text)
+            trigram_counts[i] = len(grams)
+            for gram in grams:
+                postings[gram].append(i)
+        self._postings = {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+        self._trigram_counts = trigram_counts
+
+    @classmethod
+    def from_file(cls, path: str = DEFAULT_INGREDIENTS_PATH) -> "IngredientIndex":
+        """ Build the index from a file with one ingredient name per line """
+        with open(path, encoding="utf-8") as f:
+            return cls([line.strip() for line in f if line.strip()])
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @staticmethod
+    def _prefix_ids(keys: List[Tuple[str, int]], prefix: str, limit: int) -> List[int]:
+        """ Ids whose key starts with the prefix, found by binary search """
+        start = bisect.bisect_left(keys, (prefix, -1))
+        ids = []
+        for key, i in itertools.islice(keys, start, start + limit):
+            if not key.startswith(prefix):
+                break
+            ids.append(i)
+        return ids
+
+    def search_scored(self, query: str, limit: int = 10) -> List[Tuple[str, float]]:
+        """ Ranked (name, score) matches for a query.  Scores above 1 are exact or prefix hits,
+        the fractional part is the trigram similarity. """
+        text = normalize_ingredient_text(query)
+        if not text or not self.names:
+            return []
+
+        query_grams, hits = self._trigram_hits(text)
+        candidates = np.flatnonzero(hits)
+        if len(candidates) > limit * 4:
+            top = np.argpartition(-self._similarity(hits, candidates, query_grams), limit * 4)
+            candidates = candidates[top[:limit * 4]]
+
+        # Boost prefix matches on the whole name and on individual words
+        bonuses = dict.fromkeys(candidates.tolist(), 0.0)
+        for i in self._prefix_ids(self._token_keys, text.split()[-1], limit * 4):
+            bonuses[i] = max(bonuses.get(i, 0.0), _TOKEN_PREFIX_BONUS)
+        for i in self._prefix_ids(self._name_keys, text, limit):
+            bonuses[i] = _EXACT_BONUS if self.normalized[i] == text else _PREFIX_BONUS
+
+        ids = np.fromiter(bonuses.keys(), dtype=np.int64, count=len(bonuses))
+        scores = self._similarity(hits, ids, query_grams) + np.fromiter(
+            bonuses.values(), dtype=np.float32, count=len(bonuses)
+        )
+        ranked = sorted(
+            zip(ids.tolist(), scores.tolist()), key=lambda item: (-item[1], len(self.names[item[0]]))
+        )
+        return [(self.names[i], score) for i, score in ranked[:limit]]
+
+    def _trigram_hits(self, text: str) -> Tuple[List[str], np.ndarray]:
+        """ The query's trigrams and how many of them each name shares, accumulated only
+        over the query's posting lists """
+        query_grams = _trigrams(text)
+        posting_lists = [self._postings[g] for g in query_grams if g in self._postings]
+        hits = np.bincount(
+            np.concatenate(posting_lists) if posting_lists else np.empty(0, dtype=np.int32),
+            minlength=len(self.names)
+        )
+        return query_grams, hits
+
+    def _similarity(self, hits: np.ndarray, ids: np.ndarray, query_grams: List[str]) -> np.ndarray:
+        """ Dice coefficient between the query trigrams and each name's trigrams """
+        return 2.0 * hits[ids] / (len(query_grams) + self._trigram_counts[ids])
+
+    def search(self, query: str, limit: int = 10) -> List[str]:
+        """ Ranked ingredient names matching a partially typed query """
+        return [name for name, _ in self.search_scored(query, limit)]
+
+    def normalize(self, name: str, min_similarity: float = 0.6) -> Optional[str]:
+        """ Map a free-form ingredient name to the most similar canonical name in the
+        index, or None if no name's trigram similarity reaches min_similarity.  Unlike
+        search, prefix hits get no bonus, since a shared first word is not a match. """
+        text = normalize_ingredient_text(name)
+        if not text or not self.names:
+            return None
+        query_grams, hits = self._trigram_hits(text)
+        candidates = np.flatnonzero(hits)
+        if not len(candidates):
+            return None
+        similarity = self._similarity(hits, candidates, query_grams)
+        best = max(
+            range(len(candidates)),
+            key=lambda k: (similarity[k], -len(self.names[candidates[k]]))
+        )
+        return self.names[candidates[best]] if similarity[best] >= min_similarity else None
+
+@lru_cache(maxsize=None)
+def get_ingredient_index(path: str = DEFAULT_INGREDIENTS_PATH) -> IngredientIndex:
+    """ Get the process-wide ingredient index, built once and shared by all sessions """
+    index = IngredientIndex.from_file(path)
+    logger.debug("Built ingredient index with %d names", len(index))
+    return index
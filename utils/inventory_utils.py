@@ -0,0 +1,119 @@
+""" Inventory helper functions """
+import os
+import logging
+import unicodedata
+from functools import lru_cache
+from typing import IO, List, Union
+import numpy as np
+import pandas as pd
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+DEFAULT_INVENTORY_PATH = "./resources/inventory.csv"
+INVENTORY_COLUMNS = ["Name", "Quantity", "Volume per Unit (ml)", "Cost per Unit"]
+NUMERIC_COLUMNS = ["Quantity", "Volume per Unit (ml)", "Cost per Unit"]
+# Key in DataFrame.attrs for the names of rows with numbers that could not be read
+INVALID_ROWS_ATTR = "invalid_rows"
+
+def _to_number(column: pd.Series) -> pd.Series:
+    """ Parse a numeric column, allowing currency symbols and thousands separators such as
+    "$1,012.00".  Values that still are not numbers become NaN. """
+    if pd.api.types.is_numeric_dtype(column):
+        return column.astype(float)
+    cleaned = column.astype(str).str.replace(r"[\s$€£,]", "", regex=True)
+    return pd.to_numeric(cleaned, errors="coerce")
+
+def load_inventory(source: Union[str, IO] = DEFAULT_INVENTORY_PATH) -> pd.DataFrame:
+    """ Load an inventory csv with the same columns as resources/inventory.csv.  Numbers
+    that cannot be read are counted as 0 and the names of their rows are listed in
+    inventory.attrs["invalid_rows"].  A file on disk is only read again once it changes. """
+    if isinstance(source, str):
+        return _load_inventory_file(source, os.path.getmtime(source)).copy()
+    return _read_inventory(source)
+
+@lru_cache(maxsize=8)
+def _load_inventory_file(path: str, mtime: float) -> pd.DataFrame:
+    """ Read an inventory file, cached by its modification time """
+    return _read_inventory(path)
+
+def _read_inventory(source: Union[str, IO]) -> pd.DataFrame:
+    """ Read and clean an inventory csv """
+    inventory = pd.read_csv(source)
+    inventory.columns = [column.strip() for column in inventory.columns]
+    missing_columns = [column for column in INVENTORY_COLUMNS if column not in inventory.columns]
+    if missing_columns:
+        raise ValueError(f"Inventory is missing columns: {', '.join(missing_columns)}")
+    inventory["Name"] = inventory["Name"].astype(str).str.strip()
+    inventory = inventory[inventory["Name"] != ""].reset_index(drop=True)
+    numbers = pd.DataFrame({column: _to_number(inventory[column]) for column in NUMERIC_COLUMNS})
+    invalid = numbers.isna().any(axis=1)
+    if invalid.any():
+        logger.warning("Inventory rows with unreadable numbers: %d", int(invalid.sum()))
+    inventory[NUMERIC_COLUMNS] = numbers.fillna(0.0)
+    inventory.attrs[INVALID_ROWS_ATTR] = inventory.loc[invalid, "Name"].tolist()
+    return inventory
+
+def aggregate_locations(inventory: pd.DataFrame) -> pd.DataFrame:
+    """ Collapse a multi-location inventory (one row per item and location) into one row per item """
+    if "Location" not in inventory.columns or not inventory["Name"].duplicated().any():
+        return inventory
+    quantity = inventory["Quantity"].to_numpy(dtype=float)
+    capital = quantity * inventory["Cost per Unit"].to_numpy(dtype=float)
+    volume = quantity * inventory["Volume per Unit (ml)"].to_numpy(dtype=float)
+    grouped = inventory.assign(_capital=capital, _volume=volume).groupby("Name", sort=False).agg(
+        Quantity=("Quantity", "sum"), _capital=("_capital", "sum"), _volume=("_volume", "sum")
+    )
+    quantity = grouped["Quantity"].to_numpy(dtype=float)
+    # Weighted averages per unit, guarding against items that are out of stock everywhere
+    with np.errstate(divide="ignore", invalid="ignore"):
+        grouped["Volume per Unit (ml)"] = np.where(quantity > 0, grouped["_volume"] / quantity, 0.0)
+        grouped["Cost per Unit"] = np.where(quantity > 0, grouped["_capital"] / quantity, 0.0)
+    return grouped.drop(columns=["_capital", "_volume"]).reset_index()
+
+def rank_dead_stock(
+    inventory: pd.DataFrame, capital_weight: float = 0.7, volume_weight: float = 0.3
+) -> pd.DataFrame:
+    """ Rank inventory by what is costing the most to sit on the shelf.  Adds the capital
+    tied up, the total volume on hand and a 0-1 priority score blending the two, and
+    returns the items sorted by that score. """
+    inventory = aggregate_locations(inventory)
+    quantity = pd.to_numeric(inventory["Quantity"], errors="coerce").fillna(0).to_numpy(dtype=float)
+    volume_per_unit = pd.to_numeric(
+        inventory["Volume per Unit (ml)"], errors="coerce"
+    ).fillna(0).to_numpy(dtype=float)
+    cost_per_unit = pd.to_numeric(
+        inventory["Cost per Unit"], errors="coerce"
+    ).fillna(0).to_numpy(dtype=float)
+    quantity = np.clip(quantity, 0, None)
+
+    capital = quantity * cost_per_unit
+    volume = quantity * volume_per_unit
+    capital_max = capital.max(initial=0.0)
+    volume_max = volume.max(initial=0.0)
+    score = (
+        capital_weight * (capital / capital_max if capital_max > 0 else np.zeros_like(capital))
+        + volume_weight * (volume / volume_max if volume_max > 0 else np.zeros_like(volume))
+    ) / ((capital_weight + volume_weight) or 1.0)
+
+    order = np.argsort(-score, kind="stable")
+    ranked = inventory.iloc[order].reset_index(drop=True)
+    ranked["Capital Tied Up"] = capital[order]
+    ranked["Volume on Hand (ml)"] = volume[order]
+    ranked["Priority Score"] = score[order]
+    return ranked
+
+def _fold_name(name: str) -> str:
+    """ Case and accent insensitive form of a name, so "Kahlúa" matches "Kahlua" """
+    decomposed = unicodedata.normalize("NFKD", name)
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold().strip()
+
+def prioritize_spirits(spirits: List[str], ranked_inventory: pd.DataFrame) -> List[str]:
+    """ Order a spirit selector so stocked items come first by priority score, followed by
+    the remaining spirits in their original order, keeping "Other" last """
+    prioritized = ranked_inventory["Name"].tolist()
+    seen = {_fold_name(name) for name in prioritized}
+    remaining = [s for s in spirits if _fold_name(s) not in seen and s != "Other"]
+    tail = ["Other"] if "Other" in spirits else []
+    return prioritized + remaining + tail
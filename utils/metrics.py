@@ -0,0 +1,372 @@
+""" In-process latency, token and cost metrics for every model call.
+
+Each call is recorded into fixed-bucket histograms keyed by call type and model, so
+recording is a bisect and a few increments under a lock.  Set BARGURU_METRICS_PORT
+to also serve the metrics at http://127.0.0.1:<port>/metrics (Prometheus text) and
+/metrics.json.
+"""
+import os
+import json
+import time
+import bisect
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from utils.chat_context import count_tokens
+from utils.circuit_breaker import CircuitOpenError, get_circuit_breakers
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Dollars per million prompt and completion tokens
+TOKEN_PRICES = {
+    "gpt-4o-2024-08-06": (2.50, 10.00),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+}
+# Dollars per standard 1024x1024 image
+IMAGE_PRICES = {
+    "dall-e-3": 0.04,
+}
+
+# Bucket upper bounds in seconds, 15% apart from 1ms to about 5 minutes
+_BUCKET_BOUNDS = [0.001 * 1.15 ** i for i in range(91)]
+
+def estimate_cost(model: str, prompt_tokens: int = 0, completion_tokens: int = 0, images: int = 0) -> float:
+    """ Estimated dollars for a call """
+    prompt_price, completion_price = TOKEN_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000 \
+        + images * IMAGE_PRICES.get(model, 0.0)
+
+class Histogram:
+    """ Counts of observations in fixed, exponentially sized buckets """
+    def __init__(self):
+        self.counts = [0] * (len(_BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(_BUCKET_BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """ Upper bound of the bucket holding the given fraction of observations """
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                return _BUCKET_BOUNDS[min(index, len(_BUCKET_BOUNDS) - 1)]
+        return _BUCKET_BOUNDS[-1]
+
+@dataclass
+class CallStats:
+    """ Everything recorded for one call type and model """
+    latency: Histogram
+    first_token: Histogram
+    queued: Histogram
+    calls: int = 0
+    errors: int = 0
+    cancelled: int = 0
+    retries: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    images: int = 0
+    cost: float = 0.0
+
+    @classmethod
+    def empty(cls) -> "CallStats":
+        return cls(Histogram(), Histogram(), Histogram())
+
+class CallRecord:
+    """ Measurements for a single model call, filled in while it runs """
+    def __init__(self, metrics: "ModelMetrics", call_type: str, model: str,
+                 prompt_tokens: int = 0, queued: float = 0.0):
+        self.metrics = metrics
+        self.call_type = call_type
+        self.model = model
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = 0
+        self.images = 0
+        self.queued = queued
+        self.http_responses = 0
+        self.time_to_first_token: Optional[float] = None
+        self.start = time.perf_counter()
+        self.streaming = False
+        self.finished = False
+
+    def mark_first_token(self):
+        """ Note that the first streamed token arrived, if it has not already """
+        if self.time_to_first_token is None:
+            self.time_to_first_token = time.perf_counter() - self.start
+
+    def set_usage(self, usage):
+        """ Take the token counts from an API response's usage, if it has one """
+        if usage is not None:
+            self.prompt_tokens = usage.prompt_tokens or 0
+            self.completion_tokens = usage.completion_tokens or 0
+
+    def defer(self):
+        """ Leave recording to finish(), for calls that outlive the tracking block """
+        self.streaming = True
+
+    def stream(self, response: Iterable) -> Iterator:
+        """ Pass a streamed chat completion through, timing its first token and counting
+        its output.  The call is recorded when the final chunk arrives. """
+        self.defer()
+        return self._stream(response)
+
+    def _stream(self, response: Iterable) -> Iterator:
+        text: List[str] = []
+        error = None
+        try:
+            for chunk in response:
+                choice = chunk.choices[0] if chunk.choices else None
+                if choice is not None and choice.delta is not None and choice.delta.content:
+                    self.mark_first_token()
+                    text.append(choice.delta.content)
+                if choice is not None and choice.finish_reason is not None:
+                    self.completion_tokens = count_tokens("".join(text))
+                    self.finish()
+                yield chunk
+        except GeneratorExit:  # The reader stopped early, which is not a failed call
+            raise
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            if not self.finished:
+                self.completion_tokens = count_tokens("".join(text)) if text else 0
+                self.finish(error)
+
+    def finish(self, error: Optional[BaseException] = None):
+        """ Record the call, once """
+        if self.finished:
+            return
+        self.finished = True
+        self.metrics.record(self, time.perf_counter() - self.start, error)
+
+# The call in progress in this context, so the HTTP layer can count retries against it
+_current_call: ContextVar[Optional[CallRecord]] = ContextVar("current_call", default=None)
+
+def note_http_response():
+    """ Count an HTTP response for the call in progress; every response past the first
+    is an SDK retry """
+    call = _current_call.get()
+    if call is not None:
+        call.http_responses += 1
+
+class ModelMetrics:
+    """ Process-wide store of call metrics """
+    def __init__(self):
+        self._stats: Dict[Tuple[str, str], CallStats] = {}
+        # (call type, model, how it won) -> answers served and their total latency
+        self._routes: Dict[Tuple[str, str, str], List[float]] = {}
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+    @contextmanager
+    def track(self, call_type: str, model: str, prompt_tokens: int = 0, queued: float = 0.0):
+        """ Time the model call made inside the block.  If the block hands a stream to
+        record.stream(), or calls record.defer(), the call is recorded by finish() instead. """
+        record = CallRecord(self, call_type, model, prompt_tokens, queued)
+        token = _current_call.set(record)
+        try:
+            yield record
+        except BaseException as e:
+            record.finish(e)
+            raise
+        finally:
+            _current_call.reset(token)
+        if not record.streaming:
+            record.finish()
+
+    def record(self, call: CallRecord, elapsed: float, error: Optional[BaseException] = None):
+        """ Add a finished call to the histograms """
+        cost = estimate_cost(call.model, call.prompt_tokens, call.completion_tokens, call.images)
+        with self._lock:
+            stats = self._stats.get((call.call_type, call.model))
+            if stats is None:
+                stats = self._stats[(call.call_type, call.model)] = CallStats.empty()
+            stats.calls += 1
+            stats.latency.observe(elapsed)
+            stats.queued.observe(call.queued)
+            if call.time_to_first_token is not None:
+                stats.first_token.observe(call.time_to_first_token)
+            if isinstance(error, asyncio.CancelledError):
+                stats.cancelled += 1  # Cancelled on purpose, e.g. the losing side of a hedge
+            elif error is not None:
+                stats.errors += 1
+            stats.retries += max(0, call.http_responses - 1)
+            stats.prompt_tokens += call.prompt_tokens
+            stats.completion_tokens += call.completion_tokens
+            stats.images += call.images
+            stats.cost += cost
+        # Feed the call's health to its breaker, judging streams by their first token
+        if not isinstance(error, (asyncio.CancelledError, CircuitOpenError)):
+            get_circuit_breakers().record(
+                call.call_type, call.model,
+                call.time_to_first_token if call.time_to_first_token is not None else elapsed, error
+            )
+        logger.debug(
+            "%s call to %s took %.2fs (first token %s, %d+%d tokens, $%.4f%s)",
+            call.call_type, call.model, elapsed,
+            f"{call.time_to_first_token:.2f}s" if call.time_to_first_token is not None else "n/a",
+            call.prompt_tokens, call.completion_tokens, cost, ", failed" if error else ""
+        )
+
+    def snapshot(self) -> List[Dict]:
+        """ One row per call type and model, with percentiles in seconds """
+        with self._lock:
+            rows = []
+            for (call_type, model), stats in sorted(self._stats.items()):
+                rows.append({
+                    "call_type": call_type,
+                    "model": model,
+                    "calls": stats.calls,
+                    "errors": stats.errors,
+                    "cancelled": stats.cancelled,
+                    "retries": stats.retries,
+                    "p50": stats.latency.percentile(0.50),
+                    "p90": stats.latency.percentile(0.90),
+                    "p99": stats.latency.percentile(0.99),
+                    "mean": stats.latency.total / stats.calls if stats.calls else None,
+                    "first_token_p50": stats.first_token.percentile(0.50),
+                    "first_token_p99": stats.first_token.percentile(0.99),
+                    "queued_p99": stats.queued.percentile(0.99),
+                    "prompt_tokens": stats.prompt_tokens,
+                    "completion_tokens": stats.completion_tokens,
+                    "images": stats.images,
+                    "cost": round(stats.cost, 4),
+                })
+            return rows
+
+    def record_route(self, call_type: str, model: str, outcome: str, elapsed: float):
+        """ Note which model in a chain answered, and whether as the "primary" request, a
+        "hedge" started because the primary was slow, or a "fallback" after a failure """
+        with self._lock:
+            route = self._routes.setdefault((call_type, model, outcome), [0, 0.0])
+            route[0] += 1
+            route[1] += elapsed
+        if outcome != "primary":
+            logger.info("%s answered by %s (%s) after %.2fs", call_type, model, outcome, elapsed)
+
+    def routes_snapshot(self) -> List[Dict]:
+        """ One row per call type, model and outcome """
+        with self._lock:
+            return [
+                {"call_type": call_type, "model": model, "outcome": outcome, "answers": count,
+                 "mean": total / count if count else None}
+                for (call_type, model, outcome), (count, total) in sorted(self._routes.items())
+            ]
+
+    def to_json(self) -> str:
+        """ The snapshot as JSON, for export """
+        return json.dumps({
+            "started": self.started, "exported": time.time(), "calls": self.snapshot(),
+            "routes": self.routes_snapshot(), "circuit_breakers": get_circuit_breakers().snapshot(),
+        }, indent=2)
+
+    def to_prometheus(self) -> str:
+        """ The histograms and counters in the Prometheus text format """
+        lines = []
+        with self._lock:
+            items = sorted(self._stats.items())
+            for name, attribute in (("latency", "latency"), ("first_token", "first_token"),
+                                    ("queued", "queued")):
+                metric = f"barguru_model_call_{name}_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                for (call_type, model), stats in items:
+                    histogram: Histogram = getattr(stats, attribute)
+                    labels = f'call_type="{call_type}",model="{model}"'
+                    cumulative = 0
+                    for bound, bucket_count in zip(_BUCKET_BOUNDS, histogram.counts):
+                        cumulative += bucket_count
+                        if bucket_count:
+                            lines.append(f'{metric}_bucket{{{labels},le="{bound:.4f}"}} {cumulative}')
+                    lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                    lines.append(f"{metric}_sum{{{labels}}} {histogram.total:.6f}")
+                    lines.append(f"{metric}_count{{{labels}}} {histogram.count}")
+            for counter in ("calls", "errors", "cancelled", "retries", "prompt_tokens",
+                            "completion_tokens", "images", "cost"):
+                metric = f"barguru_model_{counter}_total"
+                lines.append(f"# TYPE {metric} counter")
+                for (call_type, model), stats in items:
+                    lines.append(
+                        f'{metric}{{call_type="{call_type}",model="{model}"}} {getattr(stats, counter)}'
+                    )
+            lines.append("# TYPE barguru_model_route_answers_total counter")
+            for (call_type, model, outcome), (count, _) in sorted(self._routes.items()):
+                lines.append(
+                    f'barguru_model_route_answers_total{{call_type="{call_type}",model="{model}",'
+                    f'outcome="{outcome}"}} {count}'
+                )
+        lines.append("# TYPE barguru_circuit_open gauge")
+        for breaker in get_circuit_breakers().snapshot():
+            lines.append(
+                f'barguru_circuit_open{{call_type="{breaker["call_type"]}",model="{breaker["model"]}"}} '
+                f'{int(breaker["state"] != "closed")}'
+            )
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        """ Forget everything recorded so far """
+        with self._lock:
+            self._stats.clear()
+            self._routes.clear()
+            self.started = time.time()
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """ Serves the process metrics """
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, content_type = get_metrics().to_prometheus(), "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body, content_type = get_metrics().to_json(), "application/json"
+        else:
+            self.send_error(404)
+            return
+        data = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """ Serve /metrics and /metrics.json on a background thread """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info("Serving model call metrics on http://%s:%d/metrics", host, port)
+    return server
+
+@lru_cache(maxsize=None)
+def get_metrics() -> ModelMetrics:
+    """ Get the process-wide metrics store, starting the metrics endpoint if
+    BARGURU_METRICS_PORT is set """
+    metrics = ModelMetrics()
+    port = os.getenv("BARGURU_METRICS_PORT")
+    if port:
+        try:
+            start_metrics_server(int(port))
+        except OSError as e:
+            logger.warning("Could not start the metrics endpoint on port %s: %s", port, e)
+    return metrics
+
+def track_call(call_type: str, model: str, prompt_tokens: int = 0, queued: float = 0.0):
+    """ Shorthand for get_metrics().track(...) """
+    return get_metrics().track(call_type, model, prompt_tokens, queued)
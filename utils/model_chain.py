@@ -0,0 +1,129 @@
+""" Model fallback chains with hedged requests, to cut the tail latency of slow calls.
+
+Each call type has a chain of models.  The first is asked straight away.  If it has not
+answered within the next model's hedge_after seconds, the next model is asked as well,
+and if a model fails the next one is asked at once.  The first good answer wins and the
+other requests are cancelled.  Which model won, and how, is recorded in the metrics so
+the budgets can be tuned.  Set BARGURU_MODEL_CHAINS to override the chains, e.g.
+{"recipe": [{"model": "gpt-4o-2024-08-06"}, {"model": "gpt-4o-mini", "hedge_after": 8}]}
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, replace
+from functools import lru_cache
+from typing import Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+from utils.metrics import get_metrics
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+@dataclass(frozen=True)
+class ModelStep:
+    """ A model in a chain.  hedge_after is how long the model before it gets before this
+    one is asked too; None means this model is only asked if the one before it fails. """
+    model: str
+    hedge_after: Optional[float] = None
+
+DEFAULT_MODEL_CHAINS: Dict[str, Tuple[ModelStep, ...]] = {
+    "recipe": (ModelStep("gpt-4o-2024-08-06"), ModelStep("gpt-4o-mini", hedge_after=12.0)),
+    "training": (ModelStep("gpt-4o-mini"), ModelStep("gpt-4o", hedge_after=10.0)),
+}
+
+class AllModelsFailedError(RuntimeError):
+    """ Every model in a chain failed or returned nothing """
+
+@lru_cache(maxsize=None)
+def get_model_chains() -> Dict[str, Tuple[ModelStep, ...]]:
+    """ The default chains, overridden per call type by BARGURU_MODEL_CHAINS """
+    chains = dict(DEFAULT_MODEL_CHAINS)
+    overrides = os.getenv("BARGURU_MODEL_CHAINS")
+    if overrides:
+        for call_type, steps in json.loads(overrides).items():
+            chains[call_type] = tuple(
+                ModelStep(step["model"], step.get("hedge_after") if index else None)
+                for index, step in enumerate(steps)
+            )
+    return chains
+
+def get_model_chain(call_type: str, hedge: bool = True) -> Tuple[ModelStep, ...]:
+    """ The chain for a call type.  Without hedge, the later models are only asked when the
+    one before them fails, for speculative work that should not pay for a second call. """
+    chain = get_model_chains()[call_type]
+    if hedge:
+        return chain
+    return tuple(replace(step, hedge_after=None) for step in chain)
+
+async def run_hedged(
+    call_type: str, attempt: Callable[[str], Awaitable[Optional[T]]],
+    chain: Optional[Tuple[ModelStep, ...]] = None,
+    discard: Optional[Callable[[T], Awaitable[None]]] = None
+) -> T:
+    """ Run attempt(model) along the chain for call_type and return the first result that
+    is not None.  Requests still running are cancelled; discard is awaited for any other
+    result that arrived at the same moment, to release what it holds. """
+    chain = chain or get_model_chain(call_type)
+    start = time.perf_counter()
+    running: Dict[asyncio.Task, Tuple[int, str]] = {}
+    next_step = 0
+    last_launch = start
+    last_error: Optional[BaseException] = None
+
+    def launch(reason: str):
+        nonlocal next_step, last_launch
+        step = chain[next_step]
+        running[asyncio.create_task(attempt(step.model))] = (next_step, reason)
+        next_step += 1
+        last_launch = time.perf_counter()
+
+    launch("primary")
+    try:
+        while running:
+            timeout = None
+            if next_step < len(chain) and chain[next_step].hedge_after is not None:
+                timeout = max(0.0, chain[next_step].hedge_after - (time.perf_counter() - last_launch))
+            done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                logger.info(
+                    "No %s answer after %.1fs, also asking %s", call_type,
+                    time.perf_counter() - last_launch, chain[next_step].model
+                )
+                launch("hedge")
+                continue
+            winner = None
+            for task in done:
+                index, reason = running.pop(task)
+                if task.exception() is not None or task.result() is None:
+                    last_error = task.exception() or last_error
+                    logger.warning("%s call to %s failed: %s", call_type, chain[index].model,
+                                   task.exception() or "no result")
+                elif winner is None:
+                    winner = (task.result(), index, reason)
+                elif discard is not None:
+                    await discard(task.result())
+            if winner is not None:
+                result, index, reason = winner
+                get_metrics().record_route(
+                    call_type, chain[index].model, reason, time.perf_counter() - start
+                )
+                return result
+            # A model failed, so the next one is asked without waiting out its budget
+            if next_step < len(chain):
+                launch("fallback")
+    finally:
+        for task in running:
+            task.cancel()
+        if running:
+            results = await asyncio.gather(*running, return_exceptions=True)
+            if discard is not None:
+                for result in results:
+                    if result is not None and not isinstance(result, BaseException):
+                        await discard(result)
+    raise AllModelsFailedError(
+        f"Every model for {call_type} failed: {', '.join(step.model for step in chain)}"
+    ) from last_error
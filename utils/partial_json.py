@@ -0,0 +1,138 @@
+""" Incremental parsing of a JSON object while it streams in, so each of its fields can
+be used as soon as its value is complete rather than once the whole object has arrived """
+import re
+import json
+from typing import Any, Dict, List, Optional
+
+_WHITESPACE = " \t\r\n"
+_STRING_SPECIAL = re.compile(r'["\\]')
+
+class PartialJsonObject:
+    """ Scans a streamed JSON object once, as each piece is fed in.  A top level field is
+    decoded as soon as its value ends, and the items of a top level array are decoded one
+    at a time while the rest of the array is still streaming. """
+    def __init__(self):
+        self.text = ""
+        # Completed top level fields
+        self.fields: Dict[str, Any] = {}
+        # Completed items of the top level array still streaming, if there is one
+        self.items: Dict[str, List[Any]] = {}
+        self.done = False
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        # "key", "key_string", "colon", "value" or "in_value", for the top level object
+        self._expect = "key"
+        self._key_start = 0
+        self._key: Optional[str] = None
+        self._value_start = 0
+        self._item_start: Optional[int] = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        """ Everything known so far: the completed fields, and the completed items of an
+        array that is still streaming """
+        return {**{key: list(items) for key, items in self.items.items()}, **self.fields}
+
+    def feed(self, text: str) -> bool:
+        """ Add the next piece of the object.  Returns whether a field or array item was
+        completed by it. """
+        self.text += text
+        completed = False
+        buffer = self.text
+        index = self._pos
+        while index < len(buffer):
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                    index += 1
+                    continue
+                # Jump straight to the next quote or backslash, strings are most of the text
+                match = _STRING_SPECIAL.search(buffer, index)
+                if match is None:
+                    break
+                index = match.start()
+                if buffer[index] == "\\":
+                    self._escape = True
+                else:
+                    self._in_string = False
+                    if self._expect == "key_string":
+                        self._key = json.loads(buffer[self._key_start:index + 1])
+                        self._expect = "colon"
+                index += 1
+                continue
+            char = buffer[index]
+            if char in _WHITESPACE or self.done:
+                pass
+            elif self._depth == 0:
+                if char == "{":
+                    self._depth = 1
+            elif self._depth == 1:
+                completed |= self._top_level(char, index)
+            else:
+                completed |= self._nested(char, index)
+            index += 1
+        self._pos = len(buffer)
+        return completed
+
+    def _top_level(self, char: str, index: int) -> bool:
+        """ Handle a character of the top level object """
+        if self._expect == "key":
+            if char == '"':
+                self._in_string = True
+                self._key_start = index
+                self._expect = "key_string"
+            elif char == "}":
+                self.done = True
+            return False
+        if self._expect == "colon":
+            if char == ":":
+                self._expect = "value"
+            return False
+        if self._expect == "value":
+            self._value_start = index
+            self._expect = "in_value"
+            if char == "[":
+                self.items[self._key] = []
+                self._item_start = None
+                self._depth = 2
+            elif char == "{":
+                self._depth = 2
+            elif char == '"':
+                self._in_string = True
+            return False
+        # The value ends at the next comma or closing brace at the top level
+        if char not in ",}":
+            return False
+        self.fields[self._key] = json.loads(self.text[self._value_start:index])
+        self.items.pop(self._key, None)
+        self._expect = "key"
+        if char == "}":
+            self.done = True
+        return True
+
+    def _nested(self, char: str, index: int) -> bool:
+        """ Handle a character inside a top level array or object """
+        in_array = self._depth == 2 and self._key in self.items
+        completed = False
+        if in_array and self._item_start is None and char not in ",]":
+            self._item_start = index
+        if char == '"':
+            self._in_string = True
+        elif char in "[{":
+            self._depth += 1
+        elif char in "]}":
+            self._depth -= 1
+            if in_array and self._item_start is not None:
+                completed = self._finish_item(index)
+        elif char == "," and in_array:
+            completed = self._finish_item(index)
+        return completed
+
+    def _finish_item(self, end: int) -> bool:
+        """ Decode the array item that ends before end """
+        if self._item_start is None:
+            return False
+        self.items[self._key].append(json.loads(self.text[self._item_start:end]))
+        self._item_start = None
+        return True
@@ -0,0 +1,171 @@
+""" Concurrent orchestration of the recipe, image and training guide calls """
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+from models.recipes import Cocktail
+from utils.cocktail_utils import create_cocktail, get_recipe_hash, stream_cocktail
+from utils.image_store import get_image_store
+from utils.image_utils import generate_image
+from utils.rate_limiter import Priority
+from utils.recipe_index import find_fallback_recipe
+from utils.recipe_library import get_recipe_library
+from utils.training_utils import create_training_guide
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+@dataclass
+class CocktailPipelineResult:
+    """ Everything generated for a single cocktail request """
+    cocktail: Optional[Cocktail] = None
+    image_key: Optional[str] = None
+    training_guide: Optional[str] = None
+    # Set when the models were unavailable and a stored recipe was served instead
+    degraded: bool = False
+
+# Fields the image prompt is built from, so the image can start once these have streamed in
+IMAGE_PROMPT_FIELDS = ("name", "garnish", "glass")
+
+def build_image_prompt(cocktail: Union[Cocktail, Dict[str, Any]]) -> str:
+    """ Build the image generation prompt for a cocktail, or for the fields of one that
+    is still streaming """
+    fields = cocktail if isinstance(cocktail, dict) else cocktail.model_dump(include=set(IMAGE_PROMPT_FIELDS))
+    return f'''Hyper-realistic photograph of a cocktail named {fields["name"]}
+    garnished with {fields["garnish"]} in a {fields["glass"]} glass.'''
+
+# Request parameters a recipe is stored with: liquor, cocktail type, cuisine and theme
+RecipeRequest = Tuple[str, str, str, str]
+
+def _needs_save(stored: Dict[str, Any], request: RecipeRequest, pipeline_result: CocktailPipelineResult) -> bool:
+    """ Whether the library is missing the recipe, its request or anything generated for it """
+    if not stored:
+        return True
+    stored_request = (stored["liquor"], stored["cocktail_type"], stored["cuisine"], stored["theme"])
+    return (
+        any(value and value != stored_value for value, stored_value in zip(request, stored_request))
+        or pipeline_result.image_key not in (None, stored.get("image_key"))
+        or pipeline_result.training_guide not in (None, stored.get("training_guide"))
+    )
+
+async def create_cocktail_assets(
+    cocktail: Cocktail, include_training_guide: bool = False, priority: Priority = Priority.RECIPE,
+    image: Optional["asyncio.Task[str]"] = None, request: Optional[RecipeRequest] = None
+) -> CocktailPipelineResult:
+    """ Generate the image, and optionally the training guide, for a cocktail
+    concurrently.  Anything already stored in the recipe library for it, for example
+    by the warm-up job, is reused.  image is an image generation already started for the
+    cocktail, if any.  A failure in one branch does not discard the other.  With the
+    request the recipe was made for, the recipe is then saved to the library along with
+    its image and guide, unless the library already has all of them. """
+    stored = await asyncio.to_thread(get_recipe_library().get_by_hash, get_recipe_hash(cocktail)) or {}
+    pipeline_result = CocktailPipelineResult(cocktail=cocktail)
+    if stored.get("image_key") and get_image_store().exists(stored["image_key"]):
+        pipeline_result.image_key = stored["image_key"]
+    if include_training_guide and stored.get("training_guide"):
+        pipeline_result.training_guide = stored["training_guide"]
+
+    tasks = {}
+    if pipeline_result.image_key is None:
+        tasks["image"] = image or generate_image(build_image_prompt(cocktail), priority=priority)
+    elif image is not None:
+        image.cancel()
+    if include_training_guide and pipeline_result.training_guide is None:
+        tasks["training_guide"] = create_training_guide(cocktail, priority=priority)
+    results = dict(zip(tasks, await asyncio.gather(*tasks.values(), return_exceptions=True)))
+
+    image_key = results.get("image")
+    if isinstance(image_key, Exception):
+        logger.error("Error generating image: %s", image_key)
+    elif image_key is not None:
+        pipeline_result.image_key = image_key
+    training_guide = results.get("training_guide")
+    if isinstance(training_guide, Exception):
+        logger.error("Error creating training guide: %s", training_guide)
+    elif training_guide is not None:
+        pipeline_result.training_guide = training_guide
+    if request is not None and _needs_save(stored, request, pipeline_result):
+        get_recipe_library().save(
+            cocktail, *request, image_key=pipeline_result.image_key,
+            training_guide=pipeline_result.training_guide
+        )
+    return pipeline_result
+
+async def serve_stored_recipe(
+    liquor: str, cocktail_type: str, cuisine: str, theme: str
+) -> CocktailPipelineResult:
+    """ The closest recipe in the library, with whatever image and training guide were
+    stored with it, for when the recipe models are unavailable.  Makes no model calls. """
+    fallback = await asyncio.to_thread(find_fallback_recipe, liquor, cocktail_type, cuisine, theme)
+    if fallback is None:
+        return CocktailPipelineResult()
+    stored = await asyncio.to_thread(get_recipe_library().get_by_hash, fallback.recipe_hash) or {}
+    image_key = stored.get("image_key")
+    logger.warning("Serving stored recipe %s while the recipe models are unavailable", fallback.recipe_hash)
+    return CocktailPipelineResult(
+        cocktail=fallback.cocktail,
+        image_key=image_key if image_key and get_image_store().exists(image_key) else None,
+        training_guide=stored.get("training_guide"), degraded=True
+    )
+
+async def run_cocktail_pipeline(
+    liquor: str, cocktail_type: str, cuisine: str, theme: str,
+    include_training_guide: bool = False, fresh: bool = False, priority: Priority = Priority.RECIPE,
+    degrade: bool = False
+) -> CocktailPipelineResult:
+    """ Create a cocktail and fan out to its image and training guide as soon
+    as the recipe arrives, so the total wait is the recipe call plus the
+    slowest follow-up call rather than the sum of all of them.  The recipe is saved to
+    the library once, with its image and guide.  With degrade set, a stored recipe is
+    served if no new one could be created. """
+    cocktail = await create_cocktail(
+        liqour=liquor, type=cocktail_type, cuisine=cuisine, theme=theme, fresh=fresh,
+        priority=priority, save=False
+    )
+    if not cocktail:
+        if degrade:
+            return await serve_stored_recipe(liquor, cocktail_type, cuisine, theme)
+        return CocktailPipelineResult()
+    return await create_cocktail_assets(
+        cocktail, include_training_guide, priority, request=(liquor, cocktail_type, cuisine, theme)
+    )
+
+async def stream_cocktail_pipeline(
+    liquor: str, cocktail_type: str, cuisine: str, theme: str,
+    include_training_guide: bool = False, fresh: bool = False, priority: Priority = Priority.RECIPE,
+    degrade: bool = False, on_progress: Optional[Callable[[Dict[str, Any]], None]] = None
+) -> CocktailPipelineResult:
+    """ Like run_cocktail_pipeline, but streams the recipe.  on_progress is called with
+    the fields known so far each time one completes, and the image is started as soon as
+    the name, garnish and glass are known instead of once the whole recipe is in. """
+    cocktail = None
+    image = None
+    image_prompt = None
+    try:
+        async for progress in stream_cocktail(
+            liquor, cocktail_type, cuisine, theme, fresh=fresh, priority=priority, save=False
+        ):
+            if on_progress is not None:
+                on_progress(progress.fields)
+            # A recipe served whole from the cache may already have an image stored
+            if (image is None and progress.cocktail is None
+                    and all(progress.fields.get(field) for field in IMAGE_PROMPT_FIELDS)):
+                image_prompt = build_image_prompt(progress.fields)
+                image = asyncio.create_task(generate_image(image_prompt, priority=priority))
+            cocktail = progress.cocktail
+    except Exception as e:
+        logger.error("Error creating cocktail: %s", e)
+    # A backup model may have finished first with a different recipe than the one streamed
+    if image is not None and cocktail is not None and build_image_prompt(cocktail) != image_prompt:
+        image.cancel()
+        image = None
+    if cocktail is None:
+        if image is not None:
+            image.cancel()
+        if degrade:
+            return await serve_stored_recipe(liquor, cocktail_type, cuisine, theme)
+        return CocktailPipelineResult()
+    return await create_cocktail_assets(
+        cocktail, include_training_guide, priority, image, request=(liquor, cocktail_type, cuisine, theme)
+    )
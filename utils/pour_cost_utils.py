@@ -0,0 +1,191 @@
+""" Batch ingredient parsing and pour cost calculations for generated recipes """
+import logging
+import re
+from functools import lru_cache
+from typing import Dict, Iterable, Optional, Tuple
+import numpy as np
+import pandas as pd
+from models.recipes import Cocktail
+from utils.inventory_utils import load_inventory
+from utils.ingredient_index import normalize_ingredient_text
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Canonical unit -> milliliters, None for units that are counts rather than volumes
+UNIT_TO_ML = {
+    "oz": 29.5735, "ml": 1.0, "cl": 10.0, "l": 1000.0, "dash": 0.92, "drop": 0.05,
+    "tsp": 4.93, "tbsp": 14.79, "barspoon": 5.0, "cup": 236.59, "shot": 44.36,
+    "jigger": 44.36, "pony": 29.57, "splash": 5.9, "part": 29.5735,
+    "slice": None, "wedge": None, "twist": None, "sprig": None, "leaf": None, "piece": None,
+    "pinch": None, "whole": None,
+}
+
+# Spelling variants of each canonical unit
+UNIT_ALIASES = {
+    "oz": ["oz", "oz.", "ounce", "ounces", "fl oz", "fl. oz", "fl. oz."],
+    "ml": ["ml", "milliliter", "milliliters", "millilitre", "millilitres"],
+    "cl": ["cl", "centiliter", "centiliters", "centilitre", "centilitres"],
+    "l": ["l", "liter", "liters", "litre", "litres"],
+    "dash": ["dash", "dashes"],
+    "drop": ["drop", "drops"],
+    "tsp": ["tsp", "tsp.", "teaspoon", "teaspoons"],
+    "tbsp": ["tbsp", "tbsp.", "tablespoon", "tablespoons"],
+    "barspoon": ["barspoon", "barspoons", "bar spoon", "bar spoons"],
+    "cup": ["cup", "cups"],
+    "shot": ["shot", "shots"],
+    "jigger": ["jigger", "jiggers"],
+    "pony": ["pony", "ponies"],
+    "splash": ["splash", "splashes"],
+    "part": ["part", "parts"],
+    "slice": ["slice", "slices"],
+    "wedge": ["wedge", "wedges"],
+    "twist": ["twist", "twists"],
+    "sprig": ["sprig", "sprigs"],
+    "leaf": ["leaf", "leaves"],
+    "piece": ["piece", "pieces"],
+    "pinch": ["pinch", "pinches"],
+    "whole": ["whole"],
+}
+_ALIAS_TO_UNIT = {alias: unit for unit, aliases in UNIT_ALIASES.items() for alias in aliases}
+
+_UNICODE_FRACTIONS = {"½": " 1/2", "⅓": " 1/3", "⅔": " 2/3", "¼": " 1/4", "¾": " 3/4", "⅛": " 1/8"}
+_UNIT_PATTERN = "|".join(
+    re.escape(alias) for alias in sorted(_ALIAS_TO_UNIT, key=len, reverse=True)
+)
+# One pattern applied to every ingredient string of the batch at once by Series.str.extract
+INGREDIENT_PATTERN = re.compile(
+    r"^\s*(?:(?P<whole>\d+(?:\.\d+)?)(?!\s*/))?\s*(?:(?P<num>\d+)\s*/\s*(?P<den>\d+))?"
+    r"(?:\s*(?:-|to)\s*\d+(?:\.\d+)?(?:\s*/\s*\d+)?)?"
+    rf"\s*(?:(?P<unit>{_UNIT_PATTERN})(?![a-z]))?\.?\s*(?:of\s+)?(?P<ingredient>.*?)\s*$",
+    re.IGNORECASE
+)
+
+def parse_ingredients(cocktails: Iterable[Cocktail]) -> pd.DataFrame:
+    """ Parse the ingredient strings of many recipes into one table with a row per ingredient
+    and the columns recipe, name, raw, quantity, unit, ml and ingredient """
+    cocktails = list(cocktails)
+    recipe_ids = np.repeat(
+        np.arange(len(cocktails)), [len(cocktail.ingredients) for cocktail in cocktails]
+    )
+    raw = pd.Series(
+        [ingredient for cocktail in cocktails for ingredient in cocktail.ingredients], dtype=object
+    )
+    if raw.empty:
+        return pd.DataFrame(columns=["recipe", "name", "raw", "quantity", "unit", "ml", "ingredient"])
+
+    text = raw.astype(str)
+    for fraction, replacement in _UNICODE_FRACTIONS.items():
+        text = text.str.replace(fraction, replacement, regex=False)
+    parts = text.str.extract(INGREDIENT_PATTERN)
+
+    whole = pd.to_numeric(parts["whole"], errors="coerce").to_numpy(dtype=float)
+    numerator = pd.to_numeric(parts["num"], errors="coerce").to_numpy(dtype=float)
+    denominator = pd.to_numeric(parts["den"], errors="coerce").to_numpy(dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fraction = np.where(denominator > 0, numerator / denominator, np.nan)
+    has_quantity = ~(np.isnan(whole) & np.isnan(fraction))
+    quantity = np.where(has_quantity, np.nan_to_num(whole) + np.nan_to_num(fraction), np.nan)
+
+    unit = parts["unit"].str.lower().str.strip().map(_ALIAS_TO_UNIT)
+    ml_per_unit = unit.map(UNIT_TO_ML).astype(float).to_numpy()
+    ingredient = parts["ingredient"].str.strip(" ,.-").str.replace(
+        r"\s*\(.*?\)\s*", " ", regex=True
+    ).str.strip()
+
+    return pd.DataFrame({
+        "recipe": recipe_ids,
+        "name": [cocktails[i].name for i in recipe_ids],
+        "raw": raw,
+        "quantity": quantity,
+        "unit": unit,
+        "ml": quantity * ml_per_unit,
+        "ingredient": ingredient.where(ingredient != "", raw),
+    })
+
+# Combining marks left behind by NFKD, stripped so "Kahlúa" matches "Kahlua"
+_COMBINING_MARKS = "[\u0300-\u036f\u1ab0-\u1aff\u1dc0-\u1dff\u20d0-\u20ff\ufe20-\ufe2f]"
+
+def _normalize_ingredients(text: pd.Series) -> pd.Series:
+    """ normalize_ingredient_text() applied to a whole column at once """
+    return (
+        text.astype(str).str.normalize("NFKD").str.replace(_COMBINING_MARKS, "", regex=True)
+        .str.casefold().str.replace(r"\s+", " ", regex=True).str.strip()
+    )
+
+@lru_cache(maxsize=16)
+def _inventory_matcher(inventory_names: Tuple[str, ...]) -> Tuple["re.Pattern[str]", Dict[str, str]]:
+    """ One whole word alternation of every inventory name, longest first so "Sloe Gin" wins
+    over "Gin", and the inventory name for each normalized name in that order.  Compiled
+    once per inventory rather than once per call. """
+    names: Dict[str, str] = {}
+    for name in sorted(inventory_names, key=len, reverse=True):
+        names.setdefault(normalize_ingredient_text(name), name)
+    alternation = "|".join(re.escape(normalized) for normalized in names if normalized)
+    return re.compile(rf"\b(?:{alternation or '(?!)'})\b"), names
+
+def match_inventory(ingredients: pd.Series, inventory: pd.DataFrame) -> pd.Series:
+    """ Match parsed ingredient names to inventory item names.  Every distinct ingredient
+    is searched in one pass for the longest inventory name it contains as whole words. """
+    pattern, names = _inventory_matcher(tuple(inventory["Name"].astype(str)))
+    distinct = pd.Series(ingredients.dropna().unique(), dtype=object)
+    found = _normalize_ingredients(distinct).str.findall(pattern).explode().dropna()
+    # The longest, then first listed, of the inventory names found in each ingredient
+    rank = {normalized: index for index, normalized in enumerate(names)}
+    best = found.map(rank).groupby(level=0).min()
+    ordered_names = list(names.values())
+    matches = pd.Series(
+        [ordered_names[index] for index in best.to_numpy(dtype=int)],
+        index=distinct.to_numpy()[best.index.to_numpy(dtype=int)], dtype=object
+    )
+    return ingredients.map(matches)
+
+def cost_ingredients(parsed: pd.DataFrame, inventory: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    """ Add the matching inventory item, cost per ml and pour cost to parsed ingredients """
+    inventory = load_inventory() if inventory is None else inventory
+    costed = parsed.copy()
+    costed["inventory_item"] = match_inventory(costed["ingredient"], inventory)
+
+    unit_cost = inventory.drop_duplicates("Name").set_index("Name")
+    volume = unit_cost["Volume per Unit (ml)"].astype(float)
+    cost_per_ml = (unit_cost["Cost per Unit"].astype(float) / volume.where(volume > 0)).rename("cost_per_ml")
+    costed["cost_per_ml"] = costed["inventory_item"].map(cost_per_ml).astype(float)
+    costed["bottle_ml"] = costed["inventory_item"].map(volume).astype(float)
+    costed["pour_cost"] = costed["ml"].to_numpy(dtype=float) * costed["cost_per_ml"].to_numpy(dtype=float)
+    return costed
+
+def cost_recipes(
+    cocktails: Iterable[Cocktail], inventory: Optional[pd.DataFrame] = None, n_drinks: int = 1
+) -> pd.DataFrame:
+    """ Price many recipes at once.  Returns one row per recipe with the cost per drink from
+    inventory-matched ingredients, how many ingredients could not be costed, and the cost of
+    n_drinks.  A recipe without ingredients gets a row with nothing costed. """
+    cocktails = list(cocktails)
+    costed = cost_ingredients(parse_ingredients(cocktails), inventory)
+    costed["uncosted"] = np.isnan(costed["pour_cost"].to_numpy(dtype=float))
+    totals = costed.groupby("recipe", sort=True).agg(
+        cost_per_drink=("pour_cost", "sum"),
+        ingredients=("raw", "size"),
+        uncosted_ingredients=("uncosted", "sum"),
+    ).reindex(range(len(cocktails)), fill_value=0)
+    summary = pd.DataFrame({
+        "recipe": np.arange(len(cocktails)),
+        "name": [cocktail.name for cocktail in cocktails],
+        "cost_per_drink": totals["cost_per_drink"].to_numpy(dtype=float),
+        "ingredients": totals["ingredients"].to_numpy(dtype=int),
+        "uncosted_ingredients": totals["uncosted_ingredients"].to_numpy(dtype=int),
+    })
+    summary["cost_for_n_drinks"] = summary["cost_per_drink"] * n_drinks
+    return summary
+
+def bottles_depleted(
+    cocktails: Iterable[Cocktail], inventory: Optional[pd.DataFrame] = None, n_drinks: int = 1
+) -> pd.DataFrame:
+    """ How many bottles of each inventory item n_drinks of every recipe use up """
+    costed = cost_ingredients(parse_ingredients(cocktails), inventory)
+    costed = costed[costed["inventory_item"].notna() & costed["ml"].notna()]
+    costed = costed.assign(
+        bottles=costed["ml"].to_numpy(dtype=float) * n_drinks / costed["bottle_ml"].to_numpy(dtype=float)
+    )
+    return costed.groupby(["recipe", "name", "inventory_item"], sort=True)["bottles"].sum().reset_index()
@@ -0,0 +1,338 @@
+""" Process-wide rate limiting and priority scheduling for model requests.  Every
+Streamlit session shares one scheduler, so the server as a whole stays within each
+model's requests and tokens per minute instead of discovering the limits through 429s. """
+import os
+import json
+import time
+import heapq
+import asyncio
+import itertools
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from enum import IntEnum
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional
+from utils.chat_context import count_message_tokens
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Longest a waiting request sleeps before re-checking its place in the queue
+_POLL_INTERVAL = 1.0
+
+class Priority(IntEnum):
+    """ Scheduling classes, lower values are served first """
+    CHAT = 0
+    RECIPE = 1
+    BATCH = 2
+
+@dataclass(frozen=True)
+class ModelLimits:
+    """ Requests and tokens per minute allowed for a model.  tpm is None for
+    endpoints, like image generation, that are only limited by request count. """
+    rpm: int
+    tpm: Optional[int] = None
+
+DEFAULT_MODEL_LIMITS = {
+    "gpt-4o-2024-08-06": ModelLimits(rpm=500, tpm=30_000),
+    "gpt-4o": ModelLimits(rpm=500, tpm=30_000),
+    "gpt-4o-mini": ModelLimits(rpm=500, tpm=200_000),
+    "dall-e-3": ModelLimits(rpm=5),
+}
+
+class SchedulerBusyError(RuntimeError):
+    """ Raised when a model's queue is full, or a request waited longer than allowed """
+
+# Called with the queue position and estimated wait in seconds while a request waits
+QueueListener = Callable[[int, float], None]
+_queue_listener: ContextVar[Optional[QueueListener]] = ContextVar("queue_listener", default=None)
+
+@contextmanager
+def listen_for_queue(listener: QueueListener):
+    """ Report the queue position of every request made inside the block, including
+    requests made by tasks it starts, to listener """
+    token = _queue_listener.set(listener)
+    try:
+        yield
+    finally:
+        _queue_listener.reset(token)
+
+def format_queue_position(position: int, eta: float) -> str:
+    """ Describe a waiting request's place in line for the UI """
+    seconds = max(1, round(eta))
+    if position == 0:
+        return f"You're next in line, starting in about {seconds}s"
+    ahead = "request" if position == 1 else "requests"
+    return f"{position} {ahead} ahead of you, about {seconds}s to go"
+
+def estimate_request_tokens(messages: List[Dict[str, str]], max_output_tokens: int) -> int:
+    """ Tokens a chat request counts against the tokens per minute limit """
+    return count_message_tokens(messages) + max_output_tokens
+
+class TokenBucket:
+    """ Refills continuously up to a per minute capacity.  Oversized requests may take
+    the level negative, which makes later requests wait for the debt to refill. """
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        """ Add what has accumulated since the last update """
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """ Seconds until amount can be taken """
+        self.refill(now)
+        needed = min(amount, self.capacity)
+        return 0.0 if self.level >= needed else (needed - self.level) / self.rate
+
+    def take(self, amount: float):
+        """ Spend amount """
+        self.level -= amount
+
+    def give(self, amount: float):
+        """ Return amount that was over-charged """
+        self.level = min(self.capacity, self.level + amount)
+
+@dataclass(order=True)
+class Ticket:
+    """ A request's place in a model's queue """
+    priority: int
+    sequence: int
+    model: str = field(compare=False)
+    tokens: int = field(compare=False, default=0)
+    granted: bool = field(compare=False, default=False)
+    enqueued_at: float = field(compare=False, default_factory=time.monotonic)
+    granted_at: Optional[float] = field(compare=False, default=None)
+    wake: Optional[Callable[[], None]] = field(compare=False, default=None, repr=False)
+
+    @property
+    def waited(self) -> float:
+        """ Seconds spent in the queue, so far if it is still waiting """
+        return (self.granted_at or time.monotonic()) - self.enqueued_at
+
+class _ModelState:
+    """ Buckets and waiting requests for one model """
+    def __init__(self, limits: ModelLimits):
+        self.limits = limits
+        self.requests = TokenBucket(limits.rpm)
+        self.tokens = TokenBucket(limits.tpm) if limits.tpm else None
+        self.queue: List[Ticket] = []
+        self.paused_until = 0.0
+
+class RequestScheduler:
+    """ Token buckets for requests and tokens per minute in front of a priority queue
+    per model.  Requests are granted strictly in priority order, then arrival order, so
+    chat is served before recipes and recipes before batch jobs.  Works from sync code
+    and from any event loop, since Streamlit runs each rerun on its own loop. """
+    def __init__(
+        self, limits: Optional[Dict[str, ModelLimits]] = None,
+        default_limits: ModelLimits = ModelLimits(rpm=500, tpm=30_000), max_queue: int = 64
+    ):
+        self.limits = dict(DEFAULT_MODEL_LIMITS if limits is None else limits)
+        self.default_limits = default_limits
+        self.max_queue = max_queue
+        self._models: Dict[str, _ModelState] = {}
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def _state(self, model: str) -> _ModelState:
+        """ Get the state for a model, creating it on first use.  Call with the lock held. """
+        state = self._models.get(model)
+        if state is None:
+            state = self._models[model] = _ModelState(self.limits.get(model, self.default_limits))
+        return state
+
+    def _enqueue(self, model: str, tokens: int, priority: Priority) -> Ticket:
+        with self._lock:
+            state = self._state(model)
+            if len(state.queue) >= self.max_queue:
+                raise SchedulerBusyError(
+                    f"{model} has {len(state.queue)} requests waiting, please try again shortly"
+                )
+            ticket = Ticket(int(priority), next(self._sequence), model, max(0, int(tokens)))
+            heapq.heappush(state.queue, ticket)
+            return ticket
+
+    def _wake_head(self, state: _ModelState):
+        """ Let the request now at the front of the queue check the buckets.  Call with the lock held. """
+        if state.queue and state.queue[0].wake is not None:
+            state.queue[0].wake()
+
+    def _try_grant(self, ticket: Ticket) -> Optional[float]:
+        """ Grant the ticket if it is at the front of its queue and the buckets allow.
+        Returns 0 once granted, the seconds to wait if it is at the front, or None if
+        other requests are ahead of it. """
+        with self._lock:
+            state = self._models[ticket.model]
+            if state.queue[0] is not ticket:
+                return None
+            now = time.monotonic()
+            wait = max(state.paused_until - now, state.requests.wait_time(1, now))
+            if state.tokens is not None:
+                wait = max(wait, state.tokens.wait_time(ticket.tokens, now))
+            if wait > 0:
+                return wait
+            state.requests.take(1)
+            if state.tokens is not None:
+                state.tokens.take(ticket.tokens)
+            heapq.heappop(state.queue)
+            ticket.granted = True
+            ticket.granted_at = now
+            self._wake_head(state)
+            return 0.0
+
+    def _cancel(self, ticket: Ticket):
+        """ Remove a ticket that gave up waiting """
+        with self._lock:
+            state = self._models[ticket.model]
+            if ticket in state.queue:
+                was_head = state.queue[0] is ticket
+                state.queue.remove(ticket)
+                heapq.heapify(state.queue)
+                if was_head:
+                    self._wake_head(state)
+
+    def position(self, ticket: Ticket) -> int:
+        """ Number of requests ahead of the ticket in its queue """
+        with self._lock:
+            return sum(1 for other in self._models[ticket.model].queue if other < ticket)
+
+    def _estimated_wait(self, ticket: Ticket, position: int, head_wait: Optional[float]) -> float:
+        """ Rough seconds until the ticket is granted """
+        rpm = self._models[ticket.model].limits.rpm
+        return (head_wait or 0.0) + position * 60.0 / rpm
+
+    def _report(self, ticket: Ticket, wait: Optional[float], listener: Optional[QueueListener]):
+        """ Tell the listener where the ticket stands """
+        if listener is None:
+            return
+        position = self.position(ticket)
+        try:
+            listener(position, self._estimated_wait(ticket, position, wait))
+        except Exception as e:
+            logger.warning("Queue listener failed: %s", e)
+
+    def _check_max_wait(self, ticket: Ticket, max_wait: Optional[float]):
+        if max_wait is not None and ticket.waited > max_wait:
+            raise SchedulerBusyError(
+                f"Waited {ticket.waited:.0f}s for {ticket.model}, please try again shortly"
+            )
+
+    async def acquire(
+        self, model: str, tokens: int = 0, priority: Priority = Priority.RECIPE,
+        max_wait: Optional[float] = None
+    ) -> Ticket:
+        """ Wait on the running event loop until a request to model may be sent """
+        ticket = self._enqueue(model, tokens, priority)
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+
+        def wake():
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:  # The waiting loop has already closed
+                pass
+
+        ticket.wake = wake
+        listener = _queue_listener.get()
+        try:
+            while True:
+                event.clear()
+                wait = self._try_grant(ticket)
+                if wait == 0:
+                    break
+                self._check_max_wait(ticket, max_wait)
+                self._report(ticket, wait, listener)
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=min(wait or _POLL_INTERVAL, _POLL_INTERVAL))
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            self._cancel(ticket)
+            raise
+        if ticket.waited > 0.5:
+            logger.debug("Waited %.2fs for %s at priority %s", ticket.waited, model, priority.name)
+        return ticket
+
+    def acquire_sync(
+        self, model: str, tokens: int = 0, priority: Priority = Priority.CHAT,
+        max_wait: Optional[float] = None
+    ) -> Ticket:
+        """ Block the calling thread until a request to model may be sent """
+        ticket = self._enqueue(model, tokens, priority)
+        event = threading.Event()
+        ticket.wake = event.set
+        listener = _queue_listener.get()
+        try:
+            while True:
+                event.clear()
+                wait = self._try_grant(ticket)
+                if wait == 0:
+                    break
+                self._check_max_wait(ticket, max_wait)
+                self._report(ticket, wait, listener)
+                event.wait(min(wait or _POLL_INTERVAL, _POLL_INTERVAL))
+        except BaseException:
+            self._cancel(ticket)
+            raise
+        return ticket
+
+    def settle(self, ticket: Ticket, used_tokens: Optional[int]):
+        """ Correct the tokens a granted request was charged once its real usage is known """
+        if used_tokens is None or not ticket.granted:
+            return
+        with self._lock:
+            state = self._models[ticket.model]
+            if state.tokens is not None:
+                state.tokens.give(ticket.tokens - used_tokens)
+            ticket.tokens = used_tokens
+
+    def backoff(self, model: str, seconds: float):
+        """ Hold every request to model after the API reports it is over its limit """
+        with self._lock:
+            state = self._state(model)
+            state.paused_until = max(state.paused_until, time.monotonic() + seconds)
+        logger.warning("Rate limited on %s, pausing requests for %.1fs", model, seconds)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """ Queue depth and bucket levels per model, for display """
+        now = time.monotonic()
+        with self._lock:
+            report = {}
+            for model, state in self._models.items():
+                state.requests.refill(now)
+                if state.tokens is not None:
+                    state.tokens.refill(now)
+                report[model] = {
+                    "waiting": len(state.queue),
+                    "waiting_chat": sum(1 for t in state.queue if t.priority == Priority.CHAT),
+                    "requests_available": round(state.requests.level, 1),
+                    "tokens_available": round(state.tokens.level) if state.tokens else None,
+                    "paused_for": round(max(0.0, state.paused_until - now), 1),
+                }
+            return report
+
+def _limits_from_env() -> Dict[str, ModelLimits]:
+    """ Default limits, overridden by BARGURU_RATE_LIMITS, a JSON object such as
+    {"gpt-4o-mini": {"rpm": 5000, "tpm": 2000000}} """
+    limits = dict(DEFAULT_MODEL_LIMITS)
+    overrides = os.getenv("BARGURU_RATE_LIMITS")
+    if overrides:
+        for model, values in json.loads(overrides).items():
+            limits[model] = ModelLimits(rpm=int(values["rpm"]), tpm=values.get("tpm"))
+    return limits
+
+@lru_cache(maxsize=None)
+def get_request_scheduler() -> RequestScheduler:
+    """ Get the process-wide request scheduler shared by every session """
+    return RequestScheduler(
+        _limits_from_env(), max_queue=int(os.getenv("BARGURU_MAX_QUEUED_REQUESTS", "64"))
+    )
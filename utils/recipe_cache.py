@@ -0,0 +1,146 @@
+""" Two-tier cache for generated cocktail recipes """
+import os
+import random
+import sqlite3
+import threading
+import time
+import logging
+from collections import OrderedDict
+from functools import lru_cache
+from typing import List, Optional, Tuple
+from models.recipes import Cocktail
+from dependencies import get_cache_dir
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Values that all mean "no preference" for the optional parameters
+_EMPTY_VALUES = {"", "any", "none", "n/a", "na", "no", "no theme", "null"}
+
+def _normalize_value(value: Optional[str], optional: bool = False) -> str:
+    """ Case fold and collapse whitespace in a single request parameter """
+    normalized = " ".join(str(value or "").casefold().split())
+    if optional and normalized in _EMPTY_VALUES:
+        return ""
+    return normalized
+
+def normalize_recipe_params(liquor: str, cocktail_type: str, cuisine: str, theme: str) -> str:
+    """ Build the cache key for a cocktail request, so that "Frangelico / Craft / Any / None"
+    and " frangelico / craft / any /  " share the same recipes """
+    return "|".join([
+        _normalize_value(liquor),
+        _normalize_value(cocktail_type),
+        _normalize_value(cuisine, optional=True),
+        _normalize_value(theme, optional=True),
+    ])
+
+class RecipeCache:
+    """ In-process LRU in front of an on-disk SQLite store of serialized cocktails.
+    Each key keeps up to max_variants recipes and a hit returns one of them at random. """
+    def __init__(
+        self, db_path: str, max_variants: int = 3, ttl_seconds: float = 7 * 24 * 3600,
+        max_memory_keys: int = 256, max_disk_rows: int = 5000
+    ):
+        self.db_path = db_path
+        self.max_variants = max_variants
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_keys = max_memory_keys
+        self.max_disk_rows = max_disk_rows
+        self._memory: "OrderedDict[str, List[Tuple[float, Cocktail]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS recipe_cache (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                cache_key TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                cocktail_json TEXT NOT NULL
+            )"""
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_recipe_cache_key ON recipe_cache (cache_key, created_at)"
+        )
+        self._conn.commit()
+
+    def _remember(self, key: str, variants: List[Tuple[float, Cocktail]]):
+        """ Store the variants for a key in the LRU, evicting the coldest key """
+        self._memory[key] = variants
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_keys:
+            self._memory.popitem(last=False)
+
+    def _load_variants(self, key: str, now: float) -> List[Tuple[float, Cocktail]]:
+        """ Load the unexpired variants for a key from disk """
+        rows = self._conn.execute(
+            "SELECT created_at, cocktail_json FROM recipe_cache WHERE cache_key = ? AND created_at >= ?"
+            " ORDER BY created_at DESC LIMIT ?",
+            (key, now - self.ttl_seconds, self.max_variants)
+        ).fetchall()
+        variants = []
+        for created_at, cocktail_json in rows:
+            try:
+                variants.append((created_at, Cocktail.model_validate_json(cocktail_json)))
+            except ValueError as e:
+                logger.warning("Dropping unreadable cached recipe for %s: %s", key, e)
+        return variants
+
+    def get(self, key: str) -> Optional[Cocktail]:
+        """ Return a cached recipe for the key, or None on a miss """
+        now = time.time()
+        with self._lock:
+            variants = self._memory.get(key)
+            if variants is None:
+                variants = self._load_variants(key, now)
+            variants = [v for v in variants if now - v[0] <= self.ttl_seconds]
+            if not variants:
+                self._memory.pop(key, None)
+                return None
+            self._remember(key, variants)
+            return random.choice(variants)[1]
+
+    def put(self, key: str, cocktail: Cocktail):
+        """ Add a recipe as a new variant for the key """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO recipe_cache (cache_key, created_at, cocktail_json) VALUES (?, ?, ?)",
+                (key, now, cocktail.model_dump_json(exclude_none=True))
+            )
+            # Keep only the newest variants for this key
+            self._conn.execute(
+                "DELETE FROM recipe_cache WHERE cache_key = ? AND id NOT IN ("
+                "SELECT id FROM recipe_cache WHERE cache_key = ? ORDER BY created_at DESC LIMIT ?)",
+                (key, key, self.max_variants)
+            )
+            # Expire stale rows and bound the total size of the store
+            self._conn.execute(
+                "DELETE FROM recipe_cache WHERE created_at < ?", (now - self.ttl_seconds,)
+            )
+            self._conn.execute(
+                "DELETE FROM recipe_cache WHERE id NOT IN ("
+                "SELECT id FROM recipe_cache ORDER BY created_at DESC LIMIT ?)",
+                (self.max_disk_rows,)
+            )
+            self._conn.commit()
+            if key in self._memory:
+                variants = [(now, cocktail)] + self._memory[key]
+            else:
+                variants = self._load_variants(key, now)
+            self._remember(key, variants[:self.max_variants])
+
+    def clear(self):
+        """ Remove every cached recipe """
+        with self._lock:
+            self._conn.execute("DELETE FROM recipe_cache")
+            self._conn.commit()
+            self._memory.clear()
+
+@lru_cache(maxsize=None)
+def get_recipe_cache() -> RecipeCache:
+    """ Get the process-wide recipe cache shared by all sessions """
+    return RecipeCache(
+        db_path=os.path.join(get_cache_dir(), "recipes.sqlite3"),
+        max_variants=int(os.getenv("BARGURU_RECIPE_CACHE_VARIANTS", "3")),
+        ttl_seconds=float(os.getenv("BARGURU_RECIPE_CACHE_TTL", str(7 * 24 * 3600))),
+    )
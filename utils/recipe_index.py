@@ -0,0 +1,235 @@
+""" Local similarity search over stored recipes and the requests that produced them """
+import re
+import zlib
+import logging
+import threading
+from array import array
+from collections import Counter
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from models.recipes import Cocktail
+from utils.recipe_cache import normalize_recipe_params
+from utils.recipe_library import get_recipe_library
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Requests at least this similar to a stored one, made for the same type and cuisine, are
+# answered with the stored recipe.  The theme alone can reach this score, hence the check.
+INSTANT_MATCH_SCORE = 0.7
+# Requests at least this similar get the stored recipe as an example in the prompt
+SEED_MATCH_SCORE = 0.5
+
+# Weight of each field in the combined vector.  Requests are only compared with recipes
+# made for the same spirit; of the rest, the theme says most about what was asked for and
+# the recipe text only breaks ties.
+_FIELD_WEIGHTS = {"type": 1.0, "cuisine": 1.0, "theme": 1.5, "text": 0.5}
+_HASH_BITS = 22
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+_STOP_WORDS = frozenset(
+    "a an and the of in on with for to from by is it its this that as at or be are was".split()
+)
+
+def _feature(field: str, token: str) -> int:
+    """ Hash a field and token to a feature id, stable across processes """
+    return zlib.crc32(f"{field}:{token}".encode()) & ((1 << _HASH_BITS) - 1)
+
+def _words(text: str) -> List[str]:
+    return [word for word in _WORD.findall(text.casefold()) if word not in _STOP_WORDS]
+
+def _trigrams(text: str) -> List[str]:
+    """ Character trigrams of each word, so "tiki" is close to "tikis" and "tikki" """
+    grams = []
+    for word in text.split():
+        padded = f" {word} "
+        grams.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+def vectorize(cocktail_type: str, cuisine: str, theme: str, text: str = "") -> Dict[int, float]:
+    """ Unit-length hashed vector for a request, plus the text of its recipe if there is
+    one.  Each field is normalized on its own before weighting so a long description
+    cannot drown out the theme.  Parameters must already be normalized. """
+    fields = {
+        "type": [cocktail_type] if cocktail_type else [],
+        "cuisine": _words(cuisine),
+        "theme": _words(theme) + [f"#{gram}" for gram in _trigrams(theme)],
+        # Requests have no recipe text, so their cuisine and theme stand in for it
+        "text": _words(f"{cuisine} {theme} {text}"),
+    }
+    vector: Dict[int, float] = {}
+    for field, tokens in fields.items():
+        if not tokens:
+            continue
+        counts = Counter(_feature(field, token) for token in tokens)
+        norm = sum(count * count for count in counts.values()) ** 0.5
+        for feature, count in counts.items():
+            vector[feature] = vector.get(feature, 0.0) + _FIELD_WEIGHTS[field] * count / norm
+    total = sum(value * value for value in vector.values()) ** 0.5
+    return {feature: value / total for feature, value in vector.items()} if total else {}
+
+@dataclass(frozen=True)
+class SimilarRecipe:
+    """ A stored recipe and how similar its request was to the one being made """
+    recipe_hash: str
+    score: float
+    cocktail: Cocktail
+    # Whether it was made for the same normalized cocktail type and cuisine
+    same_type_and_cuisine: bool = False
+
+class _Shard:
+    """ The recipes made for one spirit: feature -> compact arrays of recipe ids and weights """
+    __slots__ = ("recipe_hashes", "ids", "weights")
+
+    def __init__(self):
+        self.recipe_hashes: List[str] = []
+        self.ids: Dict[int, array] = {}
+        self.weights: Dict[int, array] = {}
+
+class RecipeIndex:
+    """ Inverted index of hashed request vectors, one shard per spirit.  A search is a
+    weighted bincount over the postings of the query's few features in its spirit's
+    shard: cosine similarity against every recipe for that spirit without touching the
+    ones that share nothing with the query. """
+    def __init__(self):
+        self._shards: Dict[str, _Shard] = {}
+        self._known = set()
+        self._lock = threading.Lock()
+        self.ready = threading.Event()
+
+    def __len__(self) -> int:
+        return len(self._known)
+
+    def add(
+        self, recipe_hash: str, liquor: str, cocktail_type: str, cuisine: str, theme: str,
+        text: str = ""
+    ) -> bool:
+        """ Index a recipe under the request that produced it.  Returns False if the
+        recipe is already indexed. """
+        liquor, cocktail_type, cuisine, theme = normalize_recipe_params(
+            liquor, cocktail_type, cuisine, theme
+        ).split("|")
+        vector = vectorize(cocktail_type, cuisine, theme, text)
+        with self._lock:
+            if recipe_hash in self._known:
+                return False
+            self._known.add(recipe_hash)
+            shard = self._shards.get(liquor)
+            if shard is None:
+                shard = self._shards[liquor] = _Shard()
+            recipe_id = len(shard.recipe_hashes)
+            shard.recipe_hashes.append(recipe_hash)
+            for feature, weight in vector.items():
+                ids = shard.ids.get(feature)
+                if ids is None:
+                    ids = shard.ids[feature] = array("i")
+                    shard.weights[feature] = array("f")
+                ids.append(recipe_id)
+                shard.weights[feature].append(weight)
+        return True
+
+    def add_cocktail(self, cocktail: Cocktail, recipe_hash: str, liquor: str, cocktail_type: str,
+                     cuisine: str, theme: str) -> bool:
+        """ Index a freshly generated recipe """
+        return self.add(
+            recipe_hash, liquor, cocktail_type, cuisine, theme,
+            f"{cocktail.name} {cocktail.description or ''}"
+        )
+
+    def add_documents(self, documents: Iterable[Tuple[str, ...]]) -> int:
+        """ Index (recipe_hash, liquor, cocktail_type, cuisine, theme, name, description)
+        rows, as read from the recipe library """
+        added = 0
+        for recipe_hash, liquor, cocktail_type, cuisine, theme, name, description in documents:
+            added += self.add(recipe_hash, liquor, cocktail_type, cuisine, theme, f"{name} {description}")
+        return added
+
+    def search(
+        self, liquor: str, cocktail_type: str, cuisine: str, theme: str, k: int = 5
+    ) -> List[Tuple[str, float]]:
+        """ The k recipes for the same spirit whose requests are most similar, as
+        (recipe_hash, cosine score) pairs, best first """
+        liquor, cocktail_type, cuisine, theme = normalize_recipe_params(
+            liquor, cocktail_type, cuisine, theme
+        ).split("|")
+        query = vectorize(cocktail_type, cuisine, theme)
+        with self._lock:
+            shard = self._shards.get(liquor)
+            if shard is None:
+                return []
+            features = [feature for feature in query if feature in shard.ids]
+            if not features:
+                return []
+            # Copies, so add() can keep growing the arrays once the lock is released
+            ids = np.concatenate([np.frombuffer(shard.ids[f], dtype=np.int32) for f in features])
+            weights = np.concatenate([
+                np.frombuffer(shard.weights[f], dtype=np.float32) * query[f] for f in features
+            ])
+            recipe_hashes = shard.recipe_hashes
+        scores = np.bincount(ids, weights=weights)
+        top = np.flatnonzero(scores) if len(scores) <= k else np.argpartition(-scores, k)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(recipe_hashes[i], float(scores[i])) for i in top if scores[i] > 0]
+
+def find_similar_recipe(
+    liquor: str, cocktail_type: str, cuisine: str, theme: str, exclude=()
+) -> Optional[SimilarRecipe]:
+    """ The stored recipe whose request best matches this one, if any is similar enough
+    to be useful as an example """
+    index = get_recipe_index()
+    if not index.ready.is_set():
+        return None
+    library = get_recipe_library()
+    request_shape = normalize_recipe_params("", cocktail_type, cuisine, "")
+    for recipe_hash, score in index.search(liquor, cocktail_type, cuisine, theme):
+        if score < SEED_MATCH_SCORE:
+            break
+        if recipe_hash in exclude:
+            continue
+        stored = library.get_by_hash(recipe_hash)
+        # A recipe saved moments ago may not be written yet
+        if stored is not None:
+            stored_shape = normalize_recipe_params("", stored["cocktail_type"], stored["cuisine"], "")
+            return SimilarRecipe(recipe_hash, score, stored["cocktail"], stored_shape == request_shape)
+    return None
+
+def find_fallback_recipe(
+    liquor: str, cocktail_type: str, cuisine: str, theme: str
+) -> Optional[SimilarRecipe]:
+    """ The closest stored recipe however loosely it matches, to serve while the recipe
+    models are unavailable: the most similar one for the spirit, else the newest one for
+    the spirit, else the newest one of all """
+    index = get_recipe_index()
+    library = get_recipe_library()
+    if index.ready.is_set():
+        for recipe_hash, score in index.search(liquor, cocktail_type, cuisine, theme):
+            stored = library.get_by_hash(recipe_hash)
+            if stored is not None:
+                return SimilarRecipe(recipe_hash, score, stored["cocktail"])
+    for entries in (library.search(liquor=liquor, limit=1), library.search(limit=1)):
+        if entries:
+            stored = library.get(entries[0].id)
+            if stored is not None:
+                return SimilarRecipe(entries[0].recipe_hash, 0.0, stored["cocktail"])
+    return None
+
+def _build_index(index: RecipeIndex):
+    """ Index everything already in the recipe library """
+    try:
+        added = index.add_documents(get_recipe_library().iter_documents())
+        logger.info("Indexed %d stored recipes for similarity search", added)
+    except Exception as e:
+        logger.error("Error indexing the recipe library: %s", e)
+    finally:
+        index.ready.set()
+
+@lru_cache(maxsize=None)
+def get_recipe_index() -> RecipeIndex:
+    """ Get the process-wide recipe index.  Stored recipes are indexed on a background
+    thread; until that finishes, searches find nothing and requests go to the model. """
+    index = RecipeIndex()
+    threading.Thread(target=_build_index, args=(index,), name="recipe-index-build", daemon=True).start()
+    return index
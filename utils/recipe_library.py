@@ -0,0 +1,292 @@
+""" Persistent, searchable library of every generated recipe """
+import os
+import re
+import time
+import queue
+import atexit
+import sqlite3
+import logging
+import threading
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional, Tuple
+from models.recipes import Cocktail
+from dependencies import get_cache_dir
+from utils.cocktail_utils import get_recipe_hash
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS recipes (
+        id INTEGER PRIMARY KEY,
+        recipe_hash TEXT NOT NULL UNIQUE,
+        name TEXT NOT NULL,
+        ingredients TEXT NOT NULL,
+        directions TEXT NOT NULL,
+        description TEXT NOT NULL,
+        liquor TEXT NOT NULL DEFAULT '',
+        cocktail_type TEXT NOT NULL DEFAULT '',
+        cuisine TEXT NOT NULL DEFAULT '',
+        theme TEXT NOT NULL DEFAULT '',
+        cocktail_json TEXT NOT NULL,
+        image_key TEXT,
+        training_guide TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    )""",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS recipes_fts USING fts5(
+        name, ingredients, directions, description, liquor, cocktail_type, cuisine, theme,
+        content='recipes', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )""",
+    "CREATE INDEX IF NOT EXISTS recipes_liquor ON recipes (liquor COLLATE NOCASE, id)",
+    # Keep the full-text index in step with the table
+    """CREATE TRIGGER IF NOT EXISTS recipes_ai AFTER INSERT ON recipes BEGIN
+        INSERT INTO recipes_fts (rowid, name, ingredients, directions, description,
+            liquor, cocktail_type, cuisine, theme)
+        VALUES (new.id, new.name, new.ingredients, new.directions, new.description,
+            new.liquor, new.cocktail_type, new.cuisine, new.theme);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS recipes_ad AFTER DELETE ON recipes BEGIN
+        INSERT INTO recipes_fts (recipes_fts, rowid, name, ingredients, directions, description,
+            liquor, cocktail_type, cuisine, theme)
+        VALUES ('delete', old.id, old.name, old.ingredients, old.directions, old.description,
+            old.liquor, old.cocktail_type, old.cuisine, old.theme);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS recipes_au AFTER UPDATE OF name, ingredients, directions,
+        description, liquor, cocktail_type, cuisine, theme ON recipes BEGIN
+        INSERT INTO recipes_fts (recipes_fts, rowid, name, ingredients, directions, description,
+            liquor, cocktail_type, cuisine, theme)
+        VALUES ('delete', old.id, old.name, old.ingredients, old.directions, old.description,
+            old.liquor, old.cocktail_type, old.cuisine, old.theme);
+        INSERT INTO recipes_fts (rowid, name, ingredients, directions, description,
+            liquor, cocktail_type, cuisine, theme)
+        VALUES (new.id, new.name, new.ingredients, new.directions, new.description,
+            new.liquor, new.cocktail_type, new.cuisine, new.theme);
+    END""",
+]
+
+# New recipes add everything, later saves of the same recipe only fill in what they know
+_UPSERT = """
+    INSERT INTO recipes (recipe_hash, name, ingredients, directions, description, liquor,
+        cocktail_type, cuisine, theme, cocktail_json, image_key, training_guide, created_at, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (recipe_hash) DO UPDATE SET
+        liquor = CASE WHEN excluded.liquor != '' THEN excluded.liquor ELSE liquor END,
+        cocktail_type = CASE WHEN excluded.cocktail_type != '' THEN excluded.cocktail_type ELSE cocktail_type END,
+        cuisine = CASE WHEN excluded.cuisine != '' THEN excluded.cuisine ELSE cuisine END,
+        theme = CASE WHEN excluded.theme != '' THEN excluded.theme ELSE theme END,
+        image_key = COALESCE(excluded.image_key, image_key),
+        training_guide = COALESCE(excluded.training_guide, training_guide),
+        updated_at = excluded.updated_at
+"""
+
+_SUMMARY_COLUMNS = "r.id, r.recipe_hash, r.name, r.liquor, r.cocktail_type, r.cuisine, r.theme, " \
+    "r.image_key, r.training_guide IS NOT NULL, r.created_at"
+
+# Name matches count for more than matches in the directions
+_BM25_RANK = "bm25(10.0, 4.0, 1.0, 2.0, 3.0, 1.0, 1.0, 2.0)"
+
+_QUERY_TERM = re.compile(r"\w+", re.UNICODE)
+
+def build_match_query(text: str, liquor: Optional[str] = None) -> Optional[str]:
+    """ Turn free text into an FTS5 query that matches every word, treating the last
+    word as a prefix so results appear while the user is still typing.  A liquor limits
+    the matches to recipes made with it. """
+    terms = _QUERY_TERM.findall(text)
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += "*"
+    liquor_terms = _QUERY_TERM.findall(liquor or "")
+    if liquor_terms:
+        quoted.append(f'liquor : "{" ".join(liquor_terms)}"')
+    return " ".join(quoted)
+
+@dataclass(frozen=True)
+class LibraryEntry:
+    """ A stored recipe's searchable details, without the recipe itself """
+    id: int
+    recipe_hash: str
+    name: str
+    liquor: str
+    cocktail_type: str
+    cuisine: str
+    theme: str
+    image_key: Optional[str]
+    has_training_guide: bool
+    created_at: float
+
+@dataclass(frozen=True)
+class _PendingSave:
+    """ A save waiting for the background writer """
+    cocktail: Cocktail
+    params: Tuple[str, str, str, str]
+    image_key: Optional[str]
+    training_guide: Optional[str]
+    saved_at: float
+
+class RecipeLibrary:
+    """ Every generated recipe, its request parameters, image key and training guide in
+    SQLite, with an FTS5 index over the text.  Saves are queued and written in batches by
+    a background thread, so the request path never waits on disk.  Reads use their own
+    connection, which WAL mode lets run alongside the writer. """
+    def __init__(self, db_path: str, batch_size: int = 200, flush_interval: float = 0.5):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+        with self._conn:
+            for statement in _SCHEMA:
+                self._conn.execute(statement)
+        self._queue: "queue.Queue[_PendingSave]" = queue.Queue()
+        threading.Thread(target=self._write_loop, name="recipe-library-writer", daemon=True).start()
+        atexit.register(self.flush, 5.0)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def save(
+        self, cocktail: Cocktail, liquor: str = "", cocktail_type: str = "", cuisine: str = "",
+        theme: str = "", image_key: Optional[str] = None, training_guide: Optional[str] = None
+    ):
+        """ Queue a recipe to be stored.  Saving a recipe again adds any parameters, image
+        or training guide it did not have before. """
+        self._queue.put(_PendingSave(
+            cocktail, (liquor or "", cocktail_type or "", cuisine or "", theme or ""),
+            image_key, training_guide, time.time()
+        ))
+
+    def _row(self, pending: _PendingSave) -> tuple:
+        cocktail = pending.cocktail
+        return (
+            get_recipe_hash(cocktail), cocktail.name, "\n".join(cocktail.ingredients),
+            "\n".join(cocktail.directions), cocktail.description or "", *pending.params,
+            cocktail.model_dump_json(exclude_none=True), pending.image_key, pending.training_guide,
+            pending.saved_at, pending.saved_at,
+        )
+
+    def _write_loop(self):
+        """ Write queued saves, up to batch_size per transaction """
+        writer = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                with writer:
+                    writer.executemany(_UPSERT, [self._row(pending) for pending in batch])
+                logger.debug("Saved %d recipes to the library", len(batch))
+            except sqlite3.Error as e:
+                logger.error("Error saving %d recipes to the library: %s", len(batch), e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def flush(self, timeout: Optional[float] = None):
+        """ Wait for queued saves to be written """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                logger.warning("Gave up waiting for %d library saves", self._queue.unfinished_tasks)
+                return
+            time.sleep(0.01)
+
+    def search(
+        self, text: str = "", limit: int = 50, liquor: Optional[str] = None
+    ) -> List[LibraryEntry]:
+        """ The limit best recipes matching every word of text, best first, or the newest
+        recipes when text is empty.  Raise the limit to show more. """
+        match = build_match_query(text, liquor)
+        if match is None:
+            where, params = "", []
+            if liquor:
+                where = "WHERE r.liquor = ? COLLATE NOCASE"
+                params.append(liquor)
+            sql = f"SELECT {_SUMMARY_COLUMNS} FROM recipes r {where} ORDER BY r.id DESC LIMIT ?"
+            params.append(limit)
+        else:
+            # Every match is ranked, and FTS5 keeps only the best limit while it scores them
+            sql = f"SELECT {_SUMMARY_COLUMNS} FROM (" \
+                "SELECT rowid, rank FROM recipes_fts WHERE recipes_fts MATCH ? AND rank MATCH ? " \
+                "ORDER BY rank LIMIT ?" \
+                ") m JOIN recipes r ON r.id = m.rowid ORDER BY m.rank"
+            params = [match, _BM25_RANK, limit]
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [LibraryEntry(*row[:8], bool(row[8]), row[9]) for row in rows]
+
+    def get(self, recipe_id: int) -> Optional[Dict]:
+        """ The full stored recipe, with its parameters, image key and training guide """
+        return self._get_where("id", recipe_id)
+
+    def get_by_hash(self, recipe_hash: str) -> Optional[Dict]:
+        """ Like get(), by recipe hash """
+        return self._get_where("recipe_hash", recipe_hash)
+
+    def _get_where(self, column: str, value) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT cocktail_json, liquor, cocktail_type, cuisine, theme, image_key, training_guide"
+                f" FROM recipes WHERE {column} = ?", (value,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "cocktail": Cocktail.model_validate_json(row[0]), "liquor": row[1],
+            "cocktail_type": row[2], "cuisine": row[3], "theme": row[4],
+            "image_key": row[5], "training_guide": row[6],
+        }
+
+    def iter_documents(self, batch_size: int = 5000) -> Iterator[Tuple[str, ...]]:
+        """ (recipe_hash, liquor, cocktail_type, cuisine, theme, name, description) for
+        every stored recipe, oldest first, read in batches so writers are not held up """
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT id, recipe_hash, liquor, cocktail_type, cuisine, theme, name, description"
+                    " FROM recipes WHERE id > ? ORDER BY id LIMIT ?", (last_id, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            for row in rows:
+                yield row[1:]
+
+    def get_training_guide(self, recipe_hash: str) -> Optional[str]:
+        """ The stored training guide for a recipe, if one was generated before """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT training_guide FROM recipes WHERE recipe_hash = ?", (recipe_hash,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def count(self) -> int:
+        """ Number of stored recipes """
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM recipes").fetchone()[0]
+
+    def liquors(self) -> List[str]:
+        """ Every liquor recipes have been created for """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT liquor FROM recipes WHERE liquor != '' ORDER BY liquor COLLATE NOCASE"
+            ).fetchall()
+        return [row[0] for row in rows]
+
+@lru_cache(maxsize=None)
+def get_recipe_library() -> RecipeLibrary:
+    """ Get the process-wide recipe library shared by all sessions """
+    return RecipeLibrary(
+        os.getenv("BARGURU_LIBRARY_PATH") or os.path.join(get_cache_dir(), "library.sqlite3")
+    )
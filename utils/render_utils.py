@@ -0,0 +1,170 @@
+""" Precompiled templates for rendering recipes as html, markdown, text and print layouts """
+import re
+from typing import Iterable, List
+from jinja2 import Environment, StrictUndefined
+from markupsafe import Markup
+from models.recipes import Cocktail
+
+RECIPE_FORMATS = ("html", "markdown", "text", "print")
+
+# $ included since Streamlit renders text between two dollar signs as LaTeX
+_MARKDOWN_SPECIAL = re.compile(r"([\\`*_\[\]<>#|~$])")
+
+def markdown_escape(value) -> str:
+    """ Escape characters that markdown would otherwise treat as formatting """
+    return _MARKDOWN_SPECIAL.sub(r"\\\1", str(value or ""))
+
+_STYLE = """
+body { font-family: Arial, Helvetica, sans-serif; }
+h1 { font-size: 36px; color: #1d3557; }
+h2 { font-size: 24px; color: #e63946; }
+p, ul, ol { font-size: 18px; }
+"""
+
+_PRINT_STYLE = """
+@page { size: letter; margin: 0.75in; }
+body { font-family: Georgia, 'Times New Roman', serif; color: #000; }
+.recipe { page-break-after: always; break-after: page; }
+.recipe:last-child { page-break-after: auto; break-after: auto; }
+h1 { font-size: 22pt; margin: 0 0 6pt; }
+h2 { font-size: 13pt; margin: 12pt 0 4pt; text-transform: uppercase; letter-spacing: 1pt; }
+p, li { font-size: 11pt; line-height: 1.4; }
+.meta { font-style: italic; }
+"""
+
+# Each recipe body is a macro so single and batch renders share one compiled template
+_HTML_TEMPLATE = """
+{%- macro recipe_body(recipe) -%}
+<h1>{{ recipe.name }}</h1>
+<h2>Ingredients:</h2>
+<ul>{% for ingredient in recipe.ingredients %}<li>{{ ingredient }}</li>{% endfor %}</ul>
+<h2>Directions:</h2>
+<ol>{% for direction in recipe.directions %}<li>{{ direction }}</li>{% endfor %}</ol>
+<h2>Glass:</h2><p>{{ recipe.glass }}</p>
+{% if recipe.garnish %}<h2>Garnish:</h2><p>{{ recipe.garnish }}</p>{% endif %}
+<h2>Description:</h2><p>{{ recipe.description }}</p>
+{% if recipe.fun_fact %}<h2>Fun Fact:</h2><p>{{ recipe.fun_fact }}</p>{% endif %}
+{%- endmacro -%}
+<html>
+<head><style>{{ style }}</style></head>
+<body>
+{% for recipe in recipes %}<div class="recipe">
+{{ recipe_body(recipe) }}
+</div>
+{% endfor %}</body>
+</html>
+"""
+
+_PRINT_TEMPLATE = """
+<html>
+<head><meta charset="utf-8"><style>{{ style }}</style></head>
+<body>
+{% for recipe in recipes %}<section class="recipe">
+<h1>{{ recipe.name }}</h1>
+<p class="meta">{{ recipe.glass }}{% if recipe.garnish %} &middot; {{ recipe.garnish }}{% endif %}</p>
+<h2>Ingredients</h2>
+<ul>{% for ingredient in recipe.ingredients %}<li>{{ ingredient }}</li>{% endfor %}</ul>
+<h2>Method</h2>
+<ol>{% for direction in recipe.directions %}<li>{{ direction }}</li>{% endfor %}</ol>
+<p>{{ recipe.description }}</p>
+</section>
+{% endfor %}</body>
+</html>
+"""
+
+_MARKDOWN_TEMPLATE = """
+{%- for recipe in recipes -%}
+{% if not loop.first %}
+
+---
+
+{% endif -%}
+### {{ recipe.name | md }}
+
+**Ingredients:**
+{% for ingredient in recipe.ingredients %}
+- {{ ingredient | md }}
+{% endfor %}
+
+**Directions:**
+{% for direction in recipe.directions %}
+{{ loop.index }}. {{ direction | md }}
+{% endfor %}
+
+**Garnish:** {{ recipe.garnish | md }}
+
+**Glass:** {{ recipe.glass | md }}
+
+**Description:** {{ recipe.description | md }}
+{% if recipe.fun_fact %}
+
+**Fun Fact:** {{ recipe.fun_fact | md }}
+{% endif %}
+{%- endfor %}
+"""
+
+_TEXT_TEMPLATE = """
+{%- for recipe in recipes -%}
+{% if not loop.first %}
+
+
+{% endif -%}
+{{ recipe.name }}
+
+Ingredients:
+{% for ingredient in recipe.ingredients %}
+- {{ ingredient }}
+{% endfor %}
+
+Directions:
+{% for direction in recipe.directions %}
+{{ loop.index }}. {{ direction }}
+{% endfor %}
+
+Garnish: {{ recipe.garnish }}
+Glass: {{ recipe.glass }}
+Description: {{ recipe.description }}
+{% if recipe.fun_fact %}
+Fun Fact: {{ recipe.fun_fact }}
+{% endif %}
+{%- endfor %}
+"""
+
+_HTML_ENV = Environment(
+    autoescape=True, trim_blocks=True, lstrip_blocks=True, undefined=StrictUndefined
+)
+_TEXT_ENV = Environment(
+    autoescape=False, trim_blocks=True, lstrip_blocks=True, undefined=StrictUndefined
+)
+_TEXT_ENV.filters["md"] = markdown_escape
+
+# Compiled once at import and reused for every render
+_TEMPLATES = {
+    "html": (_HTML_ENV.from_string(_HTML_TEMPLATE), Markup(_STYLE)),
+    "print": (_HTML_ENV.from_string(_PRINT_TEMPLATE), Markup(_PRINT_STYLE)),
+    "markdown": (_TEXT_ENV.from_string(_MARKDOWN_TEMPLATE), None),
+    "text": (_TEXT_ENV.from_string(_TEXT_TEMPLATE), None),
+}
+
+def _get_template(fmt: str):
+    """ Get the compiled template and style for a format """
+    if fmt not in _TEMPLATES:
+        raise ValueError(
+            f"Unknown recipe format {fmt!r}, expected one of {', '.join(RECIPE_FORMATS)}"
+        )
+    return _TEMPLATES[fmt]
+
+def render_recipes(recipes: Iterable[Cocktail], fmt: str = "html") -> str:
+    """ Render any number of recipes into one document in a single template pass.
+    html and print output is escaped, markdown output escapes markdown formatting. """
+    template, style = _get_template(fmt)
+    return template.render(recipes=list(recipes), style=style)
+
+def render_recipe(recipe: Cocktail, fmt: str = "html") -> str:
+    """ Render a single recipe """
+    return render_recipes([recipe], fmt)
+
+def render_each(recipes: Iterable[Cocktail], fmt: str = "html") -> List[str]:
+    """ Render every recipe as its own document with the same compiled template """
+    template, style = _get_template(fmt)
+    return [template.render(recipes=[recipe], style=style) for recipe in recipes]
@@ -1,69 +1,159 @@
+""" In-memory PDF export of recipes, training guides and menus """
+import io
+import os
 import logging
-import base64
-import pdfkit
-
-path_wkhtmltopdf = r'C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe'
-config = pdfkit.configuration(wkhtmltopdf=path_wkhtmltopdf)
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import List, Optional, Sequence
+from fpdf import FPDF
+from pypdf import PdfWriter
+from models.recipes import Cocktail
+from utils.render_utils import render_recipe
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Below this many documents rendering in-process beats shipping work to the pool
+_POOL_THRESHOLD = 8
+_POOL_WORKERS = max(1, min(4, (os.cpu_count() or 1) - 1))
 
-async def recipe_to_html(recipe: dict):
+# The core PDF fonts are latin-1 only, so map common typography to plain equivalents
+_PDF_TRANSLATION = str.maketrans({
+    "‘": "'", "’": "'", "“": '"', "”": '"', "–": "-", "—": "-",
+    "…": "...", "•": "-", "⁄": "/",
+    "½": "1/2", "⅓": "1/3", "⅔": "2/3", "¼": "1/4", "¾": "3/4", "⅛": "1/8",
+})
+
+async def recipe_to_html(recipe: Cocktail):
     """ Convert a recipe to html """
-    html_content = f'''<html>
-    <head>
-    <style>
-    body {{
-        font-family: Arial, Helvetica, sans-serif;
-    }}
-    h1 {{
-        font-size: 36px;
-        color: #1d3557;
-    }}
-    h2 {{
-        font-size: 24px;
-        color: #e63946;
-    }}
-    p {{
-        font-size: 18px;
-    }}
-    ul {{
-        font-size: 18px;
-    }}
-    ol {{
-        font-size: 18px;
-    }}
-    </style>
-    </head>
-    <body>
-    <h1>{recipe["name"]}</h1>
-    <h2>Ingredients:</h2>
-    <ul>
-    '''
+    return render_recipe(recipe, "html")
+
+def _pdf_text(text: Optional[str]) -> str:
+    """ Make text safe for the latin-1 core fonts """
+    return str(text or "").translate(_PDF_TRANSLATION).encode("latin-1", "replace").decode("latin-1")
+
+def _new_pdf() -> FPDF:
+    """ Create a letter sized document with the house margins """
+    pdf = FPDF(format="letter")
+    pdf.set_margins(18, 18, 18)
+    pdf.set_auto_page_break(auto=True, margin=18)
+    return pdf
+
+def _heading(pdf: FPDF, text: str, size: int, color: Sequence[int]):
+    """ Write a heading line """
+    pdf.set_font("Helvetica", "B", size)
+    pdf.set_text_color(*color)
+    pdf.multi_cell(0, size * 0.5, _pdf_text(text), new_x="LMARGIN", new_y="NEXT")
+    pdf.set_text_color(0, 0, 0)
+    pdf.ln(2)
+
+def _paragraph(pdf: FPDF, text: str, markdown: bool = False):
+    """ Write a paragraph of body text """
+    pdf.set_font("Helvetica", "", 12)
+    pdf.multi_cell(0, 6, _pdf_text(text), markdown=markdown, new_x="LMARGIN", new_y="NEXT")
+    pdf.ln(1)
+
+def _add_recipe_page(pdf: FPDF, recipe: Cocktail):
+    """ Lay out a recipe on a new page """
+    pdf.add_page()
+    _heading(pdf, recipe.name, 24, (29, 53, 87))
+    _heading(pdf, "Ingredients", 16, (230, 57, 70))
     for ingredient in recipe.ingredients:
-        html_content += f"<li>{ingredient}</li>"
-    html_content += "</ul>"
-    html_content += "<h2>Directions:</h2><ol>"
-    for direction in recipe.directions:
-        html_content += f"<li>{direction}</li>"
-    html_content += "</ol>"
-    html_content += f"<h2>Glass:</h2><p>{recipe.glass}</p>"
+        _paragraph(pdf, f"-  {ingredient}")
+    _heading(pdf, "Directions", 16, (230, 57, 70))
+    for step, direction in enumerate(recipe.directions, start=1):
+        _paragraph(pdf, f"{step}.  {direction}")
+    _heading(pdf, "Glass", 16, (230, 57, 70))
+    _paragraph(pdf, recipe.glass)
     if recipe.garnish:
-        html_content += f"<h2>Garnish:</h2><p>{recipe.garnish}</p>"
-    html_content += f"<h2>Description:</h2><p>{recipe.description}</p>"
+        _heading(pdf, "Garnish", 16, (230, 57, 70))
+        _paragraph(pdf, recipe.garnish)
+    _heading(pdf, "Description", 16, (230, 57, 70))
+    _paragraph(pdf, recipe.description)
     if recipe.fun_fact:
-        html_content += f"<h2>Fun Fact:</h2><p>{recipe.fun_fact}</p>"
-    html_content += "</body></html>"
-
-    return html_content
-
-async def get_recipe_pdf_download_link(recipe: dict, recipe_name: str):
-    html_string = await recipe_to_html(recipe)
-    logging.debug("HTML string: %s", html_string)
-    pdfkit.from_string(html_string, 'out.pdf', configuration=config)
-    download_name = f"{recipe_name}.pdf"
-    with open('out.pdf', 'rb') as f:
-        pdf_data = f.read()
-    b64_pdf = base64.b64encode(pdf_data).decode()
-    href = f'<a href="data:file/pdf;base64,{b64_pdf}" download="{download_name}">Download Recipe as PDF</a>'
-    return href
+        _heading(pdf, "Fun Fact", 16, (230, 57, 70))
+        _paragraph(pdf, recipe.fun_fact)
+
+def _add_training_guide_pages(pdf: FPDF, recipe: Cocktail, training_guide: str):
+    """ Lay out a markdown training guide starting on a new page """
+    pdf.add_page()
+    _heading(pdf, f"Training Guide: {recipe.name}", 20, (29, 53, 87))
+    for line in training_guide.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            pdf.ln(3)
+        elif stripped.startswith("#"):
+            _heading(pdf, stripped.lstrip("#").strip().strip("*"), 14, (230, 57, 70))
+        elif stripped[:2] in ("- ", "* "):
+            _paragraph(pdf, f"-  {stripped[2:]}", markdown=True)
+        else:
+            _paragraph(pdf, stripped, markdown=True)
+
+def _render_document(
+    recipe: Cocktail, training_guide: Optional[str] = None, include_recipe: bool = True
+) -> bytes:
+    """ Render the pages for one recipe and its guide into PDF bytes, entirely in memory """
+    pdf = _new_pdf()
+    pdf.set_title(_pdf_text(recipe.name))
+    if include_recipe:
+        _add_recipe_page(pdf, recipe)
+    if training_guide:
+        _add_training_guide_pages(pdf, recipe, training_guide)
+    return bytes(pdf.output())
+
+@lru_cache(maxsize=64)
+def _render_cached_document(
+    recipe_json: str, training_guide: Optional[str], include_recipe: bool
+) -> bytes:
+    """ Render a document once per recipe and guide, since the download buttons ask for it
+    on every rerun of their page """
+    return _render_document(Cocktail.model_validate_json(recipe_json), training_guide, include_recipe)
+
+def render_recipe_pdf(recipe: Cocktail, training_guide: Optional[str] = None) -> bytes:
+    """ Render a recipe, followed by its training guide if given, as PDF bytes """
+    return _render_cached_document(recipe.model_dump_json(), training_guide or None, True)
+
+def render_training_guide_pdf(recipe: Cocktail, training_guide: str) -> bytes:
+    """ Render just the training guide for a recipe as PDF bytes """
+    return _render_cached_document(recipe.model_dump_json(), training_guide, False)
+
+@lru_cache(maxsize=None)
+def get_pdf_worker_pool() -> ProcessPoolExecutor:
+    """ Get the process-wide pool used to render large batches.  Workers are spawned rather
+    than forked because Streamlit serves sessions from threads. """
+    return ProcessPoolExecutor(
+        max_workers=_POOL_WORKERS, mp_context=multiprocessing.get_context("spawn")
+    )
+
+def render_menu_pdf(
+    recipes: List[Cocktail], training_guides: Optional[List[Optional[str]]] = None,
+    guides_only: bool = False
+) -> bytes:
+    """ Render a whole menu, or all of its training guides when guides_only is set, into
+    a single multi-page PDF.  Each recipe is rendered separately, in the worker pool for
+    large batches, and the pieces are merged in order. """
+    training_guides = training_guides or [None] * len(recipes)
+    jobs = [
+        (recipe, guide, not guides_only)
+        for recipe, guide in zip(recipes, training_guides)
+        if not guides_only or guide
+    ]
+    if not jobs:
+        raise ValueError("There is nothing to export")
+    if len(jobs) >= _POOL_THRESHOLD and _POOL_WORKERS > 1:
+        chunksize = max(1, len(jobs) // (_POOL_WORKERS * 4))
+        documents = list(
+            get_pdf_worker_pool().map(_render_document, *zip(*jobs), chunksize=chunksize)
+        )
+    else:
+        documents = [_render_document(*job) for job in jobs]
+
+    writer = PdfWriter()
+    for document in documents:
+        writer.append(io.BytesIO(document))
+    output = io.BytesIO()
+    writer.write(output)
+    logger.debug("Rendered %d documents into a %d byte PDF", len(documents), output.tell())
+    return output.getvalue()
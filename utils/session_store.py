@@ -0,0 +1,280 @@
+""" Compact, budgeted storage for the per-session data that grows: chat histories, plus
+shared copies of the recipes and guides that many sessions look at.
+
+Chat histories keep their messages as (role, content) tuples with interned roles and
+are tracked by the process-wide SessionStore.  When the histories held in memory pass
+the budget (BARGURU_SESSION_MEMORY_MB, 256 by default), those of the sessions idle the
+longest are written to disk and read back the next time they are used.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import logging
+import threading
+import weakref
+from collections import OrderedDict
+from collections.abc import MutableSequence
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+from models.recipes import Cocktail
+from dependencies import get_cache_dir
+from utils.cocktail_utils import get_recipe_hash
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Tuple and list slot overhead of one stored message
+_MESSAGE_OVERHEAD = sys.getsizeof((None, None)) + 8
+
+def _message_size(content: str) -> int:
+    return _MESSAGE_OVERHEAD + sys.getsizeof(content)
+
+class ChatHistory(MutableSequence):
+    """ A list of chat messages that reads and writes {"role", "content"} dicts, but
+    stores compact tuples and can be spilled to disk while its session is idle.  Every
+    read and write holds the history's lock, so it is never spilled part way through one. """
+    __slots__ = ("name", "session_id", "last_used", "nbytes", "_messages", "_spill_path",
+                 "_lock", "__weakref__")
+
+    def __init__(self, name: str = "chat", messages=()):
+        self._lock = threading.RLock()
+        self.name = name
+        self.session_id = ""
+        self.last_used = time.monotonic()
+        self.nbytes = 0
+        self._messages: Optional[List[Tuple[str, str]]] = []
+        self._spill_path: Optional[str] = None
+        self.extend(messages)
+
+    @property
+    def spilled(self) -> bool:
+        return self._messages is None
+
+    def _loaded(self) -> List[Tuple[str, str]]:
+        """ The messages, read back from disk if they were spilled.  Called with the lock held. """
+        self.last_used = time.monotonic()
+        if self._messages is None:
+            with open(self._spill_path, encoding="utf-8") as f:
+                self._messages = [(sys.intern(role), content) for role, content in json.load(f)]
+            self.nbytes = sum(_message_size(content) for _, content in self._messages)
+            logger.debug("Loaded %d spilled %s messages for %s", len(self._messages), self.name, self.session_id)
+        return self._messages
+
+    def spill(self, directory: str) -> int:
+        """ Write the messages to disk and drop them from memory.  A history in use by its
+        session's script is left alone.  Returns the bytes freed. """
+        if not self._lock.acquire(blocking=False):
+            return 0
+        try:
+            if self._messages is None or not self._messages:
+                return 0
+            if self._spill_path is None:
+                self._spill_path = os.path.join(directory, f"{self.session_id or uuid.uuid4().hex}-{self.name}.json")
+                weakref.finalize(self, _remove_quietly, self._spill_path)
+            with open(self._spill_path, "w", encoding="utf-8") as f:
+                json.dump(self._messages, f)
+            self._messages = None
+            freed, self.nbytes = self.nbytes, 0
+            return freed
+        finally:
+            self._lock.release()
+
+    @staticmethod
+    def _pack(message) -> Tuple[str, str]:
+        return sys.intern(str(message["role"])), str(message["content"])
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._loaded())
+
+    def __getitem__(self, index):
+        with self._lock:
+            messages = self._loaded()
+            if isinstance(index, slice):
+                return [{"role": role, "content": content} for role, content in messages[index]]
+            role, content = messages[index]
+        return {"role": role, "content": content}
+
+    def __iter__(self):
+        with self._lock:
+            messages = list(self._loaded())
+        for role, content in messages:
+            yield {"role": role, "content": content}
+
+    def __setitem__(self, index, message):
+        with self._lock:
+            messages = self._loaded()
+            if isinstance(index, slice):
+                removed, added = messages[index], [self._pack(m) for m in message]
+                messages[index] = added
+            else:
+                removed, added = [messages[index]], [self._pack(message)]
+                messages[index] = added[0]
+            self.nbytes += sum(_message_size(content) for _, content in added)
+            self.nbytes -= sum(_message_size(content) for _, content in removed)
+
+    def __delitem__(self, index):
+        with self._lock:
+            messages = self._loaded()
+            removed = messages[index] if isinstance(index, slice) else [messages[index]]
+            del messages[index]
+            self.nbytes -= sum(_message_size(content) for _, content in removed)
+
+    def insert(self, index: int, message):
+        packed = self._pack(message)
+        with self._lock:
+            self._loaded().insert(index, packed)
+            self.nbytes += _message_size(packed[1])
+
+    def clear(self):
+        with self._lock:
+            self._messages = []
+            self.nbytes = 0
+            self.last_used = time.monotonic()
+
+    def __repr__(self) -> str:
+        return f"ChatHistory({self.name!r}, {len(self)} messages)"
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+class SessionStore:
+    """ Tracks every live session's chat histories against a memory budget, and keeps one
+    shared copy of each recipe and training guide however many sessions show it """
+    def __init__(
+        self, budget_bytes: int, spill_dir: str, min_idle_seconds: float = 30.0, max_shared_texts: int = 256
+    ):
+        self.budget_bytes = budget_bytes
+        self.min_idle_seconds = min_idle_seconds
+        self.spill_dir = spill_dir
+        self._histories: "weakref.WeakSet[ChatHistory]" = weakref.WeakSet()
+        self._recipes: "weakref.WeakValueDictionary[str, Cocktail]" = weakref.WeakValueDictionary()
+        # Recently shared texts, each mapped to itself.  Bounded since str cannot be weakly referenced.
+        self._texts: "OrderedDict[str, str]" = OrderedDict()
+        self.max_shared_texts = max_shared_texts
+        self._lock = threading.Lock()
+        self.spills = 0
+        self._last_checked = 0.0
+        os.makedirs(spill_dir, exist_ok=True)
+
+    def attach(self, session_id: str, state) -> None:
+        """ Track the chat histories in a session's state and mark the session as active.
+        Called on every rerun, so it also checks the budget, at most once a second. """
+        now = time.monotonic()
+        for value in state.values():
+            # Exact type check, isinstance against an ABC is slow on every rerun
+            if type(value) is ChatHistory:
+                value.last_used = now
+                if value.session_id != session_id:
+                    value.session_id = session_id
+                    with self._lock:
+                        self._histories.add(value)
+        if now - self._last_checked >= 1.0:
+            self._last_checked = now
+            self.enforce_budget(keep=session_id)
+
+    def enforce_budget(self, keep: str = "") -> int:
+        """ Spill the histories idle the longest until memory use is back under 80% of
+        the budget.  The session keep, and any used in the last min_idle_seconds, are left
+        alone since their scripts may be running.  Returns the bytes freed. """
+        with self._lock:
+            histories = [history for history in self._histories if not history.spilled]
+            in_memory = sum(history.nbytes for history in histories)
+            if in_memory <= self.budget_bytes:
+                return 0
+            now = time.monotonic()
+            freed = 0
+            for history in sorted(histories, key=lambda history: history.last_used):
+                if in_memory - freed <= self.budget_bytes * 0.8:
+                    break
+                if history.session_id == keep or now - history.last_used < self.min_idle_seconds:
+                    continue
+                try:
+                    spilled = history.spill(self.spill_dir)
+                except OSError as e:
+                    logger.error("Error spilling chat history for %s: %s", history.session_id, e)
+                    continue
+                # A history busy in its script, or empty, frees nothing and is not a spill
+                if spilled:
+                    freed += spilled
+                    self.spills += 1
+        if freed:
+            logger.info("Spilled %d bytes of idle chat history to disk", freed)
+        return freed
+
+    def share_recipe(self, cocktail: Optional[Cocktail]) -> Optional[Cocktail]:
+        """ The one shared copy of a recipe, so sessions showing the same recipe hold one object """
+        if cocktail is None:
+            return None
+        recipe_hash = get_recipe_hash(cocktail)
+        with self._lock:
+            shared = self._recipes.get(recipe_hash)
+            if shared is None:
+                self._recipes[recipe_hash] = shared = cocktail
+        return shared
+
+    def share_text(self, text: Optional[str]) -> Optional[str]:
+        """ The one shared copy of a long text such as a training guide, while it is among
+        the max_shared_texts shared most recently """
+        if not text:
+            return text
+        with self._lock:
+            shared = self._texts.get(text)
+            if shared is None:
+                self._texts[text] = shared = text
+                if len(self._texts) > self.max_shared_texts:
+                    self._texts.popitem(last=False)
+            else:
+                self._texts.move_to_end(text)
+        return shared
+
+    def report(self) -> Dict:
+        """ Bytes held per session, what has been spilled, and the process RSS """
+        with self._lock:
+            histories = list(self._histories)
+            shared_recipes = len(self._recipes)
+            shared_texts = len(self._texts)
+        sessions: Dict[str, Dict] = {}
+        now = time.monotonic()
+        for history in histories:
+            row = sessions.setdefault(history.session_id or "(unattached)", {
+                "session": history.session_id or "(unattached)", "histories": 0, "in_memory_bytes": 0,
+                "spilled_histories": 0, "idle_seconds": None,
+            })
+            row["histories"] += 1
+            row["in_memory_bytes"] += history.nbytes
+            row["spilled_histories"] += history.spilled
+            idle = now - history.last_used
+            row["idle_seconds"] = idle if row["idle_seconds"] is None else min(row["idle_seconds"], idle)
+        rows = sorted(sessions.values(), key=lambda row: -row["in_memory_bytes"])
+        return {
+            "sessions": rows,
+            "in_memory_bytes": sum(row["in_memory_bytes"] for row in rows),
+            "budget_bytes": self.budget_bytes,
+            "spills": self.spills,
+            "shared_recipes": shared_recipes,
+            "shared_texts": shared_texts,
+            "rss_bytes": process_rss(),
+        }
+
+def process_rss() -> Optional[int]:
+    """ Resident memory of this process, where /proc is available """
+    try:
+        with open("/proc/self/statm", encoding="ascii") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+@lru_cache(maxsize=None)
+def get_session_store() -> SessionStore:
+    """ Get the process-wide session store """
+    return SessionStore(
+        int(float(os.getenv("BARGURU_SESSION_MEMORY_MB", "256")) * 1024 * 1024),
+        os.path.join(get_cache_dir(), "sessions")
+    )
@@ -0,0 +1,40 @@
+""" Session state defaults for each page """
+import uuid
+from typing import Any, Callable, Dict, MutableMapping
+from utils.session_store import ChatHistory, get_session_store
+
+# Variable name -> factory for its default value.  Factories keep mutable defaults
+# from being shared between sessions and are only called for missing variables.
+COCKTAIL_SESSION_DEFAULTS: Dict[str, Callable[[], Any]] = {
+    "current_cocktail": lambda: None,
+    "current_image": lambda: None,
+    "cocktail_page": lambda: "get_cocktail_info",
+    "training_guide": lambda: None,
+    "cocktail_chat_messages": lambda: ChatHistory("cocktail_chat_messages"),
+    "training_guide_key": lambda: None,
+    # The spirit, type, cuisine, theme and fresh choice of a recipe still to be streamed in
+    "recipe_request": lambda: None,
+    # Whether the current recipe came from the library because the models were unavailable
+    "recipe_degraded": lambda: False,
+    "session_id": lambda: uuid.uuid4().hex,
+}
+
+GENERAL_CHAT_SESSION_DEFAULTS: Dict[str, Callable[[], Any]] = {
+    "general_chat_messages": lambda: ChatHistory("general_chat_messages"),
+    "general_chat_summary": lambda: None,
+    "session_id": lambda: uuid.uuid4().hex,
+}
+
+BATCH_SESSION_DEFAULTS: Dict[str, Callable[[], Any]] = {
+    "batch_results": list,
+}
+
+def init_session_variables(state: MutableMapping, defaults: Dict[str, Callable[[], Any]]):
+    """ Set any session variables that are not set yet.  This runs on every rerun, so
+    it only builds the defaults that are actually missing. """
+    for var, default_factory in defaults.items():
+        if var not in state:
+            state[var] = default_factory()
+    # Count this session's chat histories against the process memory budget
+    if "session_id" in state:
+        get_session_store().attach(state["session_id"], state)
@@ -0,0 +1,260 @@
+""" Coalesced rendering of streamed chat completions, the chat pages' turn, and hedgeable async streams """
+import io
+import time
+import asyncio
+import logging
+from contextlib import nullcontext
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, Iterable, Optional, Tuple
+from openai import AsyncStream, OpenAIError
+from dependencies import OPENAI_TIMEOUTS, get_async_openai_client, get_openai_client, sdk_httpx
+from utils.chat_context import count_tokens, get_chat_context_manager
+from utils.circuit_breaker import CircuitOpenError, get_circuit_breakers
+from utils.metrics import CallRecord, track_call
+from utils.rate_limiter import (
+    Priority, SchedulerBusyError, Ticket, estimate_request_tokens, format_queue_position,
+    get_request_scheduler, listen_for_queue
+)
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Errors that mean a chat answer was lost on the way.  The SDK wraps failures to send the
+# request, but a stream cut off part way, e.g. by a read timeout, raises the HTTP error itself.
+CHAT_CONNECTION_ERRORS = (OpenAIError, sdk_httpx.HTTPError)
+
+LOST_CONNECTION_NOTICE = "We lost the connection to our bartender.  Please ask again in a moment."
+
+def drop_unanswered_prompt(messages, placeholder, notice: str):
+    """ Take the unanswered question back out of a chat history, so it can simply be
+    asked again, tell the user why, and stop the page """
+    # Only the chat pages call this, so the other users of this module do not load Streamlit
+    import streamlit as st
+    messages.pop()
+    placeholder.warning(notice)
+    st.stop()
+
+@dataclass
+class StreamStats:
+    """ Timing for a single streamed response """
+    time_to_first_token: Optional[float] = None
+    total_time: float = 0.0
+    chunks: int = 0
+    tokens: int = 0
+    ui_updates: int = 0
+
+    @property
+    def tokens_per_second(self) -> float:
+        """ Generation speed after the first token arrived """
+        generation_time = self.total_time - (self.time_to_first_token or 0.0)
+        return self.tokens / generation_time if generation_time > 0 else 0.0
+
+class StreamRenderer:
+    """ Buffers streamed text and only re-renders the placeholder every min_interval
+    seconds or min_chars new characters, instead of once per token """
+    def __init__(
+        self, placeholder, min_interval: float = 0.08, min_chars: int = 64, cursor: str = "▌"
+    ):
+        self.placeholder = placeholder
+        self.min_interval = min_interval
+        self.min_chars = min_chars
+        self.cursor = cursor
+        self._buffer = io.StringIO()
+        self._pending_chars = 0
+        self._last_render = 0.0
+        self.ui_updates = 0
+
+    @property
+    def text(self) -> str:
+        """ Everything received so far """
+        return self._buffer.getvalue()
+
+    def feed(self, text: str):
+        """ Add streamed text, rendering if enough time or text has built up """
+        if not text:
+            return
+        self._buffer.write(text)
+        self._pending_chars += len(text)
+        now = time.perf_counter()
+        if self._pending_chars >= self.min_chars or now - self._last_render >= self.min_interval:
+            self._render(self.text + self.cursor, now)
+
+    def flush(self) -> str:
+        """ Render the final text without the cursor and return it """
+        text = self.text
+        self._render(text, time.perf_counter())
+        return text
+
+    def _render(self, text: str, now: float):
+        """ Push the text to the placeholder """
+        self.placeholder.markdown(text)
+        self._pending_chars = 0
+        self._last_render = now
+        self.ui_updates += 1
+
+def iter_stream_text(response: Iterable) -> Iterable[str]:
+    """ Yield the text of each chat completion chunk, skipping empty and usage-only chunks """
+    for chunk in response:
+        if not chunk.choices:
+            continue
+        choice = chunk.choices[0]
+        if choice.delta is not None and choice.delta.content:
+            yield choice.delta.content
+        if choice.finish_reason is not None:
+            break
+
+def render_stream(
+    response: Iterable, placeholder, start_time: Optional[float] = None, **renderer_options
+) -> Tuple[str, StreamStats]:
+    """ Render a streamed chat completion into a placeholder and return the full text
+    along with its time to first token and tokens per second.  Pass the perf_counter
+    time the request was sent as start_time to include the wait for the first chunk. """
+    renderer = StreamRenderer(placeholder, **renderer_options)
+    stats = StreamStats()
+    start = start_time if start_time is not None else time.perf_counter()
+    for text in iter_stream_text(response):
+        if stats.time_to_first_token is None:
+            stats.time_to_first_token = time.perf_counter() - start
+        stats.chunks += 1
+        renderer.feed(text)
+    full_response = renderer.flush()
+    stats.total_time = time.perf_counter() - start
+    stats.tokens = count_tokens(full_response) if full_response else 0
+    stats.ui_updates = renderer.ui_updates
+    logger.debug(
+        "Streamed %d tokens in %.2fs (first token %.2fs, %.1f tokens/s, %d UI updates)",
+        stats.tokens, stats.total_time, stats.time_to_first_token or 0.0,
+        stats.tokens_per_second, stats.ui_updates
+    )
+    return full_response, stats
+
+def run_chat_turn(
+    state, chat: str, system_message: Dict[str, str], placeholder, waiting=None,
+    model: str = "gpt-4o-mini", max_tokens: int = 750, temperature: float = 0.6
+) -> str:
+    """ Answer the question just added to a chat page's history, streaming the answer into
+    the placeholder.  The history and rolling summary are read from, and written back to,
+    state[f"{chat}_messages"] and state[f"{chat}_summary"], and the stream's timing to
+    state["last_stream_stats"].  waiting, e.g. a spinner, is held until the answer starts
+    streaming.  Returns the answer, which is also added to the history; if there is none
+    the question is dropped again and the page stopped. """
+    chat_messages = state[f"{chat}_messages"]
+    client = get_openai_client(timeout=OPENAI_TIMEOUTS["chat"])
+    scheduler = get_request_scheduler()
+    with waiting or nullcontext():
+        try:
+            # Answer at once that chat is down rather than waiting out the timeout
+            get_circuit_breakers().check("chat", model)
+            # Show the queue position while other sessions are ahead of this one
+            with listen_for_queue(
+                lambda position, eta: placeholder.caption(format_queue_position(position, eta))
+            ):
+                # Keep the prompt within budget, folding older turns into a rolling summary
+                messages, state[f"{chat}_summary"] = get_chat_context_manager().build_messages(
+                    system_message, chat_messages, state[f"{chat}_summary"]
+                )
+                ticket = scheduler.acquire_sync(
+                    model, estimate_request_tokens(messages, max_tokens), Priority.CHAT
+                )
+        except SchedulerBusyError as e:
+            drop_unanswered_prompt(chat_messages, placeholder, f"The bar is slammed right now.  {e}")
+        except CircuitOpenError as e:
+            drop_unanswered_prompt(
+                chat_messages, placeholder, "Our bartender has stepped away for a moment.  "
+                f"Please ask again in about {max(1, round(e.retry_in))} seconds."
+            )
+        request_start = time.perf_counter()
+        try:
+            with track_call("chat", model, ticket.tokens - max_tokens, ticket.waited) as call:
+                # Recorded once the stream has been rendered
+                response = call.stream(client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    stream=True,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                ))
+        except CHAT_CONNECTION_ERRORS:
+            scheduler.settle(ticket, ticket.tokens - max_tokens)
+            drop_unanswered_prompt(chat_messages, placeholder, LOST_CONNECTION_NOTICE)
+    try:
+        full_response, stats = render_stream(response, placeholder, start_time=request_start)
+    except CHAT_CONNECTION_ERRORS:
+        scheduler.settle(ticket, ticket.tokens - max_tokens)
+        drop_unanswered_prompt(chat_messages, placeholder, LOST_CONNECTION_NOTICE)
+    state["last_stream_stats"] = stats
+    scheduler.settle(ticket, ticket.tokens - max_tokens + stats.tokens)
+    chat_messages.append({"role": "assistant", "content": full_response})
+    return full_response
+
+@dataclass
+class ChatStream:
+    """ An async chat completion stream that has produced its first text """
+    response: AsyncStream
+    chunks: AsyncIterator
+    first_text: str
+    call: CallRecord
+    ticket: Ticket
+    max_output_tokens: int
+
+    async def aclose(self):
+        """ Abandon the stream, e.g. when another model won the race """
+        await self.response.close()
+        self.call.finish(asyncio.CancelledError())
+
+    async def texts(self) -> AsyncIterator[str]:
+        """ Yield the first text and then the rest of the stream.  The call is recorded and
+        its scheduler ticket settled once the stream ends. """
+        call = self.call
+        try:
+            async with self.response:
+                yield self.first_text
+                async for chunk in self.chunks:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        call.completion_tokens += count_tokens(chunk.choices[0].delta.content)
+                        yield chunk.choices[0].delta.content
+        except (GeneratorExit, asyncio.CancelledError):  # Stopped by the reader, not a failure
+            raise
+        except Exception as e:
+            call.finish(e)
+            raise
+        finally:
+            call.finish()
+        get_request_scheduler().settle(
+            self.ticket, self.ticket.tokens - self.max_output_tokens + call.completion_tokens
+        )
+
+async def open_chat_stream(
+    call_type: str, model: str, messages, priority: Priority, max_output_tokens: int, **create_options
+) -> ChatStream:
+    """ Start streaming a chat completion and wait for its first text, so callers racing
+    models with run_hedged() can judge them by their time to first token """
+    get_circuit_breakers().check(call_type, model)
+    scheduler = get_request_scheduler()
+    ticket = await scheduler.acquire(model, estimate_request_tokens(messages, max_output_tokens), priority)
+    client = get_async_openai_client(timeout=OPENAI_TIMEOUTS[call_type])
+    with track_call(call_type, model, ticket.tokens - max_output_tokens, ticket.waited) as call:
+        response = await client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_output_tokens,
+            stream=True,
+            **create_options
+        )
+        # The call is recorded once the stream ends
+        call.defer()
+    chunks = response.__aiter__()
+    try:
+        async for chunk in chunks:
+            if chunk.choices and chunk.choices[0].delta.content:
+                call.mark_first_token()
+                call.completion_tokens += count_tokens(chunk.choices[0].delta.content)
+                return ChatStream(
+                    response, chunks, chunk.choices[0].delta.content, call, ticket, max_output_tokens
+                )
+        raise ValueError(f"{model} returned an empty {call_type} response")
+    except BaseException as e:
+        await response.close()
+        call.finish(e)
+        raise
@@ -1,17 +1,29 @@
 """ Cocktail helper functions """
+import asyncio
 import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import AsyncIterator, List, Optional, Set
 from openai import OpenAIError
-from dependencies import get_openai_client
+from dependencies import OPENAI_TIMEOUTS, get_async_openai_client, get_background_loop
 from models.recipes import Cocktail
-# Load the OpenAI client
-client = get_openai_client()
+from utils.circuit_breaker import get_circuit_breakers
+from utils.cocktail_utils import get_recipe_hash
+from utils.metrics import track_call
+from utils.model_chain import get_model_chain, run_hedged
+from utils.recipe_library import get_recipe_library
+from utils.rate_limiter import Priority, estimate_request_tokens, get_request_scheduler
+from utils.streaming_utils import ChatStream, open_chat_stream
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
 
-async def create_training_guide(cocktail : Cocktail):
-    """ Create a training guide for a cocktail."""
-    messages = [
+def _training_guide_messages(cocktail: Cocktail):
+    """ Build the prompt for a training guide """
+    return [
         {
             "role": "system",
             "content": f"""You are a master mixologist who has
@@ -25,23 +37,177 @@ async def create_training_guide(cocktail : Cocktail):
             their guests."""
         }
     ]
-    try:
-        logging.debug("Trying model: gpt-4o-mini")
-        # Assuming client has an async method for chat completions
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
+
+async def _complete_training_guide(model: str, messages, priority: Priority) -> Optional[str]:
+    """ Ask one model for a whole training guide """
+    get_circuit_breakers().check("training", model)
+    scheduler = get_request_scheduler()
+    ticket = await scheduler.acquire(model, estimate_request_tokens(messages, 750), priority)
+    client = get_async_openai_client(timeout=OPENAI_TIMEOUTS["training"])
+    with track_call("training", model, queued=ticket.waited) as call:
+        response = await client.chat.completions.create(
+            model=model,
             messages=messages,
             temperature=0.75,
             top_p=1,
             max_tokens=750,
         )
-        training_response = response.choices[0].message.content
+        call.set_usage(response.usage)
+    scheduler.settle(ticket, response.usage.total_tokens if response.usage else None)
+    return response.choices[0].message.content
+
+async def create_training_guide(cocktail : Cocktail, priority: Priority = Priority.RECIPE):
+    """ Create a training guide for a cocktail, backing a slow or failed model up with
+    the next one in the training model chain """
+    messages = _training_guide_messages(cocktail)
+    try:
+        training_response = await run_hedged(
+            "training", lambda model: _complete_training_guide(model, messages, priority)
+        )
         logging.debug("Response: %s", training_response)
         return training_response
     except OpenAIError as e:
-        logging.error("Error with model: %s. Error: %s", "gpt-4o-mini", e)
+        logging.error("Error creating training guide: %s", e)
 
     except Exception as e:
-        logging.error("Error with model: %s. Error: %s", "gpt-4o-mini", e)
+        logging.error("Error creating training guide: %s", e)
 
     return None  # Return None or a default response if all models fail
+
+async def stream_training_guide(
+    cocktail: Cocktail, priority: Priority = Priority.RECIPE, hedge: bool = True
+) -> AsyncIterator[str]:
+    """ Stream the text of a training guide for a cocktail as it is generated.  A model
+    that fails, or with hedge set is slow to start, is backed up by the next one in the
+    training model chain. """
+    messages = _training_guide_messages(cocktail)
+    stream = await run_hedged(
+        "training", lambda model: open_chat_stream(
+            "training", model, messages, priority, 750, temperature=0.75, top_p=1
+        ),
+        chain=get_model_chain("training", hedge), discard=ChatStream.aclose
+    )
+    async for text in stream.texts():
+        yield text
+
+@dataclass
+class PrefetchedGuide:
+    """ A training guide being generated, or already generated, in the background """
+    recipe_hash: str
+    chunks: List[str] = field(default_factory=list)
+    owners: Set[str] = field(default_factory=set)
+    done: bool = False
+    error: Optional[str] = None
+    future: Optional[Future] = None
+    # Notified whenever a chunk arrives or the guide finishes
+    _changed: threading.Condition = field(default_factory=threading.Condition, repr=False, compare=False)
+
+    @property
+    def text(self) -> str:
+        """ The guide text received so far """
+        return "".join(self.chunks)
+
+    def add(self, text: str):
+        """ Append a chunk of the guide and wake anyone waiting on it """
+        with self._changed:
+            self.chunks.append(text)
+            self._changed.notify_all()
+
+    def mark_done(self, error: Optional[str] = None):
+        """ Record that the guide has finished, successfully unless there is an error """
+        with self._changed:
+            self.error = error
+            self.done = True
+            self._changed.notify_all()
+
+    def wait(self, seen_chunks: int, timeout: Optional[float] = None) -> bool:
+        """ Block until there are more than seen_chunks chunks or the guide is done.
+        Returns False if the timeout passed first. """
+        with self._changed:
+            return self._changed.wait_for(lambda: self.done or len(self.chunks) > seen_chunks, timeout)
+
+class TrainingGuidePrefetcher:
+    """ Generates training guides speculatively on a background event loop as soon as a
+    recipe is shown, keyed by recipe hash, so the guide is usually ready before anyone
+    asks for it.  Partial output can be read while the guide is still streaming. """
+    def __init__(self, max_guides: int = 256):
+        self.max_guides = max_guides
+        self._guides: "OrderedDict[str, PrefetchedGuide]" = OrderedDict()
+        self._lock = threading.Lock()
+        # The loop the OpenAI connections live on, so prefetch calls use them directly
+        self._loop = get_background_loop()
+
+    async def _generate(self, cocktail: Cocktail, guide: PrefetchedGuide):
+        """ Stream the guide into its entry, or take it from the recipe library if it was
+        written before, and store new guides there.  Speculative guides queue behind
+        requests someone is waiting on and are not hedged. """
+        library = get_recipe_library()
+        stored_guide = await asyncio.to_thread(library.get_training_guide, guide.recipe_hash)
+        if stored_guide:
+            guide.add(stored_guide)
+            return
+        async for text in stream_training_guide(cocktail, Priority.BATCH, hedge=False):
+            guide.add(text)
+        if guide.chunks:
+            library.save(cocktail, training_guide=guide.text)
+
+    @staticmethod
+    def _finish(guide: PrefetchedGuide, future: Future):
+        """ Mark a guide done however its future ended, including when it was cancelled
+        before it started.  Runs without the lock, since cancel() calls it while holding it. """
+        error = None
+        if future.cancelled():
+            error = "cancelled"
+        elif future.exception() is not None:
+            logging.error("Error prefetching training guide: %s", future.exception())
+            error = str(future.exception()) or type(future.exception()).__name__
+        guide.mark_done(error)
+
+    def start(self, cocktail: Cocktail, owner: str = "") -> str:
+        """ Start generating the guide for a recipe unless it is already underway or done,
+        and return the recipe hash to look it up by.  The owner, usually a session id,
+        is recorded so one session cannot cancel a guide another session is waiting on. """
+        recipe_hash = get_recipe_hash(cocktail)
+        with self._lock:
+            guide = self._guides.get(recipe_hash)
+            if guide is not None and not guide.error:
+                guide.owners.add(owner)
+                self._guides.move_to_end(recipe_hash)
+                return recipe_hash
+            guide = PrefetchedGuide(recipe_hash, owners={owner})
+            self._guides[recipe_hash] = guide
+            # Set under the lock, so a cancel() right after this always finds the future
+            guide.future = asyncio.run_coroutine_threadsafe(self._generate(cocktail, guide), self._loop)
+            guide.future.add_done_callback(lambda future: self._finish(guide, future))
+            while len(self._guides) > self.max_guides:
+                _, evicted = self._guides.popitem(last=False)
+                evicted.future.cancel()
+        logging.debug("Prefetching training guide for %s", recipe_hash)
+        return recipe_hash
+
+    def get(self, recipe_hash: Optional[str]) -> Optional[PrefetchedGuide]:
+        """ Get the guide entry for a recipe hash, finished or not """
+        if not recipe_hash:
+            return None
+        with self._lock:
+            return self._guides.get(recipe_hash)
+
+    def cancel(self, recipe_hash: Optional[str], owner: str = ""):
+        """ Stop generating a guide once no owner needs it any more """
+        if not recipe_hash:
+            return
+        with self._lock:
+            guide = self._guides.get(recipe_hash)
+            if guide is None or guide.done:
+                return
+            guide.owners.discard(owner)
+            if guide.owners:
+                return
+            del self._guides[recipe_hash]
+            guide.future.cancel()
+        logging.debug("Cancelled training guide prefetch for %s", recipe_hash)
+
+@lru_cache(maxsize=None)
+def get_training_guide_prefetcher() -> TrainingGuidePrefetcher:
+    """ Get the process-wide training guide prefetcher shared by all sessions """
+    return TrainingGuidePrefetcher()
@@ -0,0 +1,180 @@
+""" Off-peak warm-up of the recipe cache, recipe library and images for the most popular
+spirit, cocktail type and cuisine combinations.  Runs headless, outside Streamlit:
+
+    python -m utils.warmup_utils --budget 200 --concurrency 4
+    python -m utils.warmup_utils --budget 500 --at 03:30     # every night at 3:30
+
+Combinations that are already warm only cost a cache lookup, so the job can be rerun
+as often as the cache expires.
+"""
+import sys
+import json
+import time
+import heapq
+import asyncio
+import logging
+import argparse
+from datetime import datetime, timedelta
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from dependencies import run_async
+from utils.cocktail_options import COCKTAIL_TYPES, CUISINES, DEFAULT_THEME, SPIRITS
+from utils.cocktail_utils import create_cocktail
+from utils.inventory_utils import load_inventory, prioritize_spirits, rank_dead_stock
+from utils.pipeline_utils import run_cocktail_pipeline
+from utils.rate_limiter import Priority
+from utils.recipe_library import get_recipe_library
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class WarmupCombination:
+    """ One request to have ready before anyone asks for it """
+    liquor: str
+    cocktail_type: str
+    cuisine: str
+    theme: str
+    weight: float
+
+@dataclass
+class WarmupResult:
+    """ What warming a single combination produced """
+    combination: WarmupCombination
+    ok: bool = False
+    image: bool = False
+    error: Optional[str] = None
+    elapsed: float = 0.0
+
+def _rank_weights(options: List[str], overrides: Optional[Dict[str, float]] = None) -> Dict[str, float]:
+    """ Weight options by list position, earlier ones being picked more often, times any
+    override.  An override of 0 leaves an option out. """
+    overrides = overrides or {}
+    return {
+        option: overrides.get(option, 1.0) / (position + 1) ** 0.5
+        for position, option in enumerate(options) if option != "Other"
+    }
+
+def build_warmup_plan(
+    budget: int, spirits: Optional[List[str]] = None, weights: Optional[Dict[str, Dict[str, float]]] = None,
+    theme: str = DEFAULT_THEME
+) -> List[WarmupCombination]:
+    """ The budget most popular spirit x type x cuisine combinations, most popular first.
+    Spirits default to the order the create page lists them in, which puts the dead stock
+    in our inventory first.  weights may hold "spirits", "types" and "cuisines" maps of
+    popularity multipliers, for example from request logs. """
+    weights = weights or {}
+    if spirits is None:
+        spirits = prioritize_spirits(SPIRITS, rank_dead_stock(load_inventory()))
+    spirit_weights = _rank_weights(spirits, weights.get("spirits"))
+    type_weights = _rank_weights(COCKTAIL_TYPES, weights.get("types"))
+    cuisine_weights = _rank_weights(CUISINES, weights.get("cuisines"))
+    combinations = (
+        WarmupCombination(liquor, cocktail_type, cuisine, theme, spirit_weight * type_weight * cuisine_weight)
+        for liquor, spirit_weight in spirit_weights.items()
+        for cocktail_type, type_weight in type_weights.items()
+        for cuisine, cuisine_weight in cuisine_weights.items()
+    )
+    return [
+        combination for combination in heapq.nlargest(budget, combinations, key=lambda c: c.weight)
+        if combination.weight > 0
+    ]
+
+async def _warm(combination: WarmupCombination, semaphore: asyncio.Semaphore, images: bool) -> WarmupResult:
+    """ Create, or find, the recipe and image for one combination under the concurrency limit """
+    async with semaphore:
+        result = WarmupResult(combination)
+        start = time.perf_counter()
+        try:
+            if images:
+                pipeline_result = await run_cocktail_pipeline(
+                    liquor=combination.liquor, cocktail_type=combination.cocktail_type,
+                    cuisine=combination.cuisine, theme=combination.theme, priority=Priority.BATCH
+                )
+                result.ok = pipeline_result.cocktail is not None
+                result.image = pipeline_result.image_key is not None
+            else:
+                result.ok = await create_cocktail(
+                    liqour=combination.liquor, type=combination.cocktail_type,
+                    cuisine=combination.cuisine, theme=combination.theme, priority=Priority.BATCH
+                ) is not None
+            if not result.ok:
+                result.error = "No recipe was returned"
+        except Exception as e:
+            logger.error("Error warming %s: %s", combination, e)
+            result.error = str(e)
+        result.elapsed = time.perf_counter() - start
+        return result
+
+async def run_warmup(
+    plan: List[WarmupCombination], concurrency: int = 4, images: bool = True
+) -> List[WarmupResult]:
+    """ Warm every combination in the plan with at most concurrency in flight.  Requests
+    go through the shared scheduler at batch priority, so a warm-up running into opening
+    hours yields to guests. """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    tasks = [asyncio.create_task(_warm(combination, semaphore, images)) for combination in plan]
+    results = []
+    for done, next_result in enumerate(asyncio.as_completed(tasks), start=1):
+        result = await next_result
+        results.append(result)
+        logger.info(
+            "Warmed %d/%d: %s / %s / %s in %.1fs%s", done, len(plan), result.combination.liquor,
+            result.combination.cocktail_type, result.combination.cuisine, result.elapsed,
+            f" ({result.error})" if result.error else ""
+        )
+    # Make sure the library has every recipe and image before the process exits
+    await asyncio.to_thread(get_recipe_library().flush)
+    return results
+
+def _seconds_until(clock_time: str) -> float:
+    """ Seconds until the next HH:MM local time """
+    hour, minute = (int(part) for part in clock_time.split(":"))
+    now = datetime.now()
+    next_run = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if next_run <= now:
+        next_run += timedelta(days=1)
+    return (next_run - now).total_seconds()
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Pre-generate recipes and images for popular requests.")
+    parser.add_argument("--budget", type=int, default=100, help="Number of combinations to keep warm")
+    parser.add_argument("--concurrency", type=int, default=4, help="Combinations warmed at once")
+    parser.add_argument("--no-images", action="store_true", help="Only create the recipes")
+    parser.add_argument("--weights", default=None,
+                        help='JSON file of popularity multipliers, e.g. {"spirits": {"Gin": 3}}')
+    parser.add_argument("--at", default=None, metavar="HH:MM",
+                        help="Run every day at this local time instead of once")
+    parser.add_argument("--dry-run", action="store_true", help="Print the plan without running it")
+    args = parser.parse_args(argv)
+    logging.getLogger().setLevel(logging.WARNING)
+    logger.setLevel(logging.INFO)
+
+    weights = None
+    if args.weights:
+        with open(args.weights, encoding="utf-8") as f:
+            weights = json.load(f)
+    while True:
+        if args.at:
+            wait = _seconds_until(args.at)
+            logger.info("Next warm-up at %s, in %.0f minutes", args.at, wait / 60)
+            time.sleep(wait)
+        plan = build_warmup_plan(args.budget, weights=weights)
+        if args.dry_run:
+            for combination in plan:
+                print(f"{combination.weight:8.4f}  {combination.liquor} / {combination.cocktail_type}"
+                      f" / {combination.cuisine}")
+            return 0
+        start = time.perf_counter()
+        results = run_async(run_warmup(plan, args.concurrency, images=not args.no_images))
+        failed = sum(not result.ok for result in results)
+        logger.info(
+            "Warmed %d combinations (%d images, %d failed) in %.0fs", len(results) - failed,
+            sum(result.image for result in results), failed, time.perf_counter() - start
+        )
+        if not args.at:
+            return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))